@@ -4,9 +4,31 @@
 docker_image_tag="gispacker"
 docker_image_version="v1.0"
 
-# Run a command
-sudo docker run --rm -it --name=gis_packer \
-        -p 8888:8888 \
+# Run the worker in the background, the commands are forwarded to it through
+# its socket in $HOME/.config while it is running
+if [ "$1" == "serve-worker" ]; then
+    sudo docker run -d --rm --name=gis_packer_worker \
+            --mount type=bind,source="$HOME/.config",destination="/root/.config" \
+            --mount type=bind,source="$HOME",destination="$HOME" \
+            "${docker_image_tag}:${docker_image_version}" \
+            python3 -m gis_packer.cli $@
+    exit
+fi
+
+# Only the jupyter and documentation servers need the port, the other commands can run concurrently
+port_args=""
+case "$1" in
+    notebook|lab|tutorials|documentation) port_args="-p 8888:8888" ;;
+esac
+
+# a tty only when there is one, e.g. not when started by xargs -P
+tty_args="-i"
+if [ -t 0 ]; then
+    tty_args="-it"
+fi
+
+# Run a command, in an unnamed container so several can run at the same time
+sudo docker run --rm ${tty_args} ${port_args} \
         -v /var/run/docker.sock:/var/run/docker.sock \
         --mount type=bind,source="$HOME/.config",destination="/root/.config" \
         --mount type=bind,source="$HOME",destination="$HOME" \
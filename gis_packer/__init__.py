@@ -1,3 +1,12 @@
-from . import cli, cloudstorage, database, utils, config, httpserver
+import importlib
 
 __version__ = "0.0.1"
+
+# The submodules are imported on first access, so that running a single cli command
+# does not import boto3, SQLAlchemy, matplotlib, ... when it doesn't need them
+__all__ = ['cli', 'cloudstorage', 'database', 'utils', 'config', 'httpserver', 'worker']
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__} has no attribute {name}')
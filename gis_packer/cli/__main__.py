@@ -5,24 +5,37 @@ import sys
 import click
 
 # config file interface
-from ..config import load_config, create_template_config_file, DEFAULT_CONFIG_FILE
+from ..config import load_config, create_template_config_file, DEFAULT_CONFIG_FILE, WORKER_SOCKET_PATH_KEY
+
+# worker daemon
+from ..worker import forward
 
 # import api funcs
 from .api import configure as configure_api
 from .api import notebook as notebook_api
 from .api import search as search_api
+from .api import export as export_api
+from .api import sync_replica as sync_replica_api
 from .api import lab as lab_api
 from .api import tutorials as tutorials_api
 from .api import get_file as get_file_api
 from .api import post_file as post_file_api
+from .api import get_files as get_files_api
+from .api import post_files as post_files_api
+from .api import sync as sync_api
+from .api import delete_files as delete_files_api
+from .api import reconcile as reconcile_api
+from .api import batch as batch_api
 from .api import info as info_api
 from .api import autotest as autotest_api
 from .api import create_tiles as create_tiles_api
 from .api import unstack_bands as unstack_bands_api
 from .api import stack_bands as stack_bands_api
 from .api import to_uint8 as to_uint8_api
+from .api import quicklook as quicklook_api
 from .api import compress as compress_api
 from .api import documentation as documentation_api
+from .api import serve_worker as serve_worker_api
 from .api import reproject as reproject_api
 from .api import select_bands as select_bands_api
 from .api import create_aws_lambda_layer as create_aws_lambda_layer_api
@@ -65,6 +78,15 @@ def documentation():
     documentation_api()
 
 
+@click.command()
+@click.option('--socket-path', type=str, help='Path of the Unix socket, defaults to the WORKER_SOCKET_PATH config')
+def serve_worker(socket_path=None):
+    """
+        Runs a worker keeping the modules, connections and caches loaded, the other commands are forwarded to it while it runs
+    """
+    serve_worker_api(cli, socket_path=socket_path)
+
+
 @click.command()
 def tutorials():
     """
@@ -77,7 +99,8 @@ def tutorials():
 @click.option('--bucket-name', type=str, help='Name of the AWS S3 bucket')
 @click.option('--file-key', type=str, help='File key')
 @click.option('--out-path', type=str, help='Output path to save the file')
-def get_file(bucket_name, file_key, out_path):
+@click.option('--resume', is_flag=True, help='Checkpoint the download and continue an interrupted one')
+def get_file(bucket_name, file_key, out_path, resume=False):
     """
         Downloads a file from the an AWS S3 Bucket
     """
@@ -92,14 +115,15 @@ def get_file(bucket_name, file_key, out_path):
     if file_key is None:
         raise Exception('Must provide a file key')
 
-    get_file_api(bucket_name, file_key, out_path)
+    get_file_api(bucket_name, file_key, out_path, resume=resume)
 
 
 @click.command()
 @click.option('--bucket-name', type=str, help='Name of the AWS S3 bucket')
 @click.option('--file-key', type=str, help='File key')
 @click.option('--file-path', type=str, help='Path to .tif file')
-def post_file(bucket_name, file_key, file_path):
+@click.option('--resume', is_flag=True, help='Checkpoint the upload and continue an interrupted one')
+def post_file(bucket_name, file_key, file_path, resume=False):
     """
         Uploads a file to the AWS S3 Bucket
     """
@@ -114,11 +138,52 @@ def post_file(bucket_name, file_key, file_path):
     if file_key is None:
         raise Exception('Must provide a file key')
 
-    post_file_api(bucket_name, file_key, file_path)
+    post_file_api(bucket_name, file_key, file_path, resume=resume)
 
 
 @click.command()
-@click.option('--file-path', type=str, help='Path to .tif file')
+@click.option('--bucket-name', type=str, help='Name of the AWS S3 bucket')
+@click.option('--out-dir', type=str, help='Output directory, the file keys are used as relative paths')
+@click.option('--prefix', type=str, help='Download every file whose key starts with this prefix')
+@click.option('--keys-path', type=str, help='Path to a text file listing the file keys, one per line')
+@click.option('--max-workers', type=int, help='Number of files downloaded at the same time')
+@click.option('--order', type=click.Choice(['fifo', 'smallest', 'largest']), help='Order in which the files are started, defaults to the TRANSFER_ORDER config')
+def get_files(bucket_name, out_dir, prefix=None, keys_path=None, max_workers=None, order=None):
+    """
+        Downloads many files from an AWS S3 Bucket
+    """
+
+    # check input
+    if bucket_name is None:
+        raise Exception('Must provide a bucket name')
+
+    if out_dir is None:
+        raise Exception('Must provide an output directory')
+
+    get_files_api(bucket_name, out_dir, prefix=prefix, keys_path=keys_path, max_workers=max_workers, order=order)
+
+
+@click.command()
+@click.option('--bucket-name', type=str, help='Name of the AWS S3 bucket')
+@click.option('--src-dir', type=str, help='Upload every file in this directory, relative paths are used as keys')
+@click.option('--paths-path', type=str, help='Path to a text file listing the files to upload, one per line')
+@click.option('--key-prefix', type=str, default='', help='Prefix added to every file key')
+@click.option('--max-workers', type=int, help='Number of files uploaded at the same time')
+@click.option('--order', type=click.Choice(['fifo', 'smallest', 'largest']), help='Order in which the files are started, defaults to the TRANSFER_ORDER config')
+def post_files(bucket_name, src_dir=None, paths_path=None, key_prefix='', max_workers=None, order=None):
+    """
+        Uploads many files to the AWS S3 Bucket (without adding meta data to the DB)
+    """
+
+    # check input
+    if bucket_name is None:
+        raise Exception('Must provide a bucket name')
+
+    post_files_api(bucket_name, src_dir=src_dir, paths_path=paths_path, key_prefix=key_prefix, max_workers=max_workers, order=order)
+
+
+@click.command()
+@click.option('--file-path', type=str, help='Path to .tif file or s3://bucket/key uri')
 def info(file_path):
     """
         Prints the GIS info about the .tif file
@@ -132,7 +197,42 @@ def info(file_path):
 
 
 @click.command()
-@click.option('--file-path', type=str, help='Path to .tif file')
+@click.option('--local-dir', type=str, help='Path to the local directory')
+@click.option('--bucket-name', type=str, help='Name of the AWS S3 bucket')
+@click.option('--prefix', type=str, default='', help='Prefix of the file keys, empty or ending with /')
+@click.option('--direction', type=click.Choice(['upload', 'download']), default='upload', help='upload (local -> S3) or download (S3 -> local)')
+@click.option('--compare', type=click.Choice(['size', 'mtime', 'etag']), default='size', help='How the files present on both sides are compared')
+@click.option('--delete', is_flag=True, help='Delete the files missing from the source from the destination')
+@click.option('--dry-run', is_flag=True, help='Only print what would be transferred and deleted')
+@click.option('--max-workers', type=int, help='Number of files transferred at the same time')
+@click.option('--order', type=click.Choice(['fifo', 'smallest', 'largest']), help='Order in which the files are started, defaults to the TRANSFER_ORDER config')
+def sync(local_dir, bucket_name, prefix='', direction='upload', compare='size', delete=False, dry_run=False, max_workers=None, order=None):
+    """
+        Transfers only the files that differ between a local directory and a prefix of the AWS S3 Bucket
+    """
+
+    # check input
+    if local_dir is None:
+        raise Exception('Must provide a local directory')
+
+    if bucket_name is None:
+        raise Exception('Must provide a bucket name')
+
+    sync_api(
+        local_dir,
+        bucket_name,
+        prefix=prefix,
+        direction=direction,
+        compare=compare,
+        delete=delete,
+        dry_run=dry_run,
+        max_workers=max_workers,
+        order=order
+    )
+
+
+@click.command()
+@click.option('--file-path', type=str, help='Path to .tif file or s3://bucket/key uri')
 @click.option('--out-dir', type=str, help='Path to output directory')
 def unstack_bands(file_path, out_dir):
     """
@@ -168,7 +268,26 @@ def stack_bands(src_dir, out_path):
 
 
 @click.command()
-@click.option('--file-path', type=str, help='Path to .tif file')
+@click.option('--file-path', type=str, help='Path to .tif file or s3://bucket/key uri')
+@click.option('--out-path', type=str, help='Path to output .tif file')
+@click.option('--max-size', type=int, default=1024, help='Maximum width and height of the preview in pixels')
+def quicklook(file_path, out_path, max_size):
+    """
+        Writes a downsampled preview of an image, only the overviews are read from a s3:// COG
+    """
+
+    # check input
+    if file_path is None:
+        raise Exception('Must provide a file path')
+
+    if out_path is None:
+        raise Exception('Must provide a output path')
+
+    quicklook_api(file_path, out_path, max_size=max_size)
+
+
+@click.command()
+@click.option('--file-path', type=str, help='Path to .tif file or s3://bucket/key uri')
 @click.option('--out-path', type=str, help='Path to output .tif file')
 def to_uint8(file_path, out_path):
     """
@@ -186,7 +305,7 @@ def to_uint8(file_path, out_path):
 
 
 @click.command()
-@click.option('--file-path', type=str, help='Path to source .tif file')
+@click.option('--file-path', type=str, help='Path to source .tif file or s3://bucket/key uri')
 @click.option('--out-path', type=str, help='Path to output .tif file')
 def compress(file_path, out_path):
     """
@@ -204,14 +323,15 @@ def compress(file_path, out_path):
 
 
 @click.command()
-@click.option('--file-path', type=str, help='Path to source .tif file')
-@click.option('--out-dir', type=str, help='Path to output .tif tiles')
+@click.option('--file-path', type=str, help='Path to source .tif file or s3://bucket/key uri')
+@click.option('--out-dir', type=str, help='Path to output .tif tiles, or s3://bucket/prefix/ to upload them from memory')
 @click.option('--tile-width-meters', type=int, help='Tile with in ground meters')
 @click.option('--tile-height-meters', type=int, help='Tile height in ground meters')
 @click.option('--tile-width-pixels', type=int, help='Tile with in pixels')
 @click.option('--tile-height-pixels', type=int, help='Tile height in pixels')
 @click.option('--tile-overlap', type=float, help='Amount of overlap of each tile in float format. Should range between [0.0,0.9]')
-def create_tiles(file_path, out_dir, tile_width_meters=None, tile_height_meters=None, tile_width_pixels=None, tile_height_pixels=None, tile_overlap=0.0):
+@click.option('--register', is_flag=True, help='Add the meta data of each tile uploaded to a s3:// out dir to the DB')
+def create_tiles(file_path, out_dir, tile_width_meters=None, tile_height_meters=None, tile_width_pixels=None, tile_height_pixels=None, tile_overlap=0.0, register=False):
     """
         Tiles an image into smaller square chunks
     """
@@ -259,7 +379,8 @@ def create_tiles(file_path, out_dir, tile_width_meters=None, tile_height_meters=
         out_dir,
         tile_size_in_m=tile_meters,
         tile_size_in_pixels=tile_pixels,
-        tile_overlap=tile_overlap
+        tile_overlap=tile_overlap,
+        register=register
     )
 
 
@@ -269,7 +390,10 @@ def create_tiles(file_path, out_dir, tile_width_meters=None, tile_height_meters=
 @click.option('--taken-at-max', type=str, help='Max timestamp for when the raster was taken')
 @click.option('--pixel-size-m-max', type=int, help='Max pixel size in ground meters')
 @click.option('--point-contained', type=tuple, help='Point in the (lat,lng) format that must be contained by the geometry')
-def search(limit=100, taken_at_min=None, taken_at_max=None, pixel_size_m_max=None, point_contained=None):
+@click.option('--intersects', type=str, help='Area of interest as a min_lng,min_lat,max_lng,max_lat bounding box, a GeoJSON or the path to a GeoJSON file')
+@click.option('--min-overlap', type=float, help='Min fraction of the area of interest covered by the raster. Should range between ]0.0,1.0]')
+@click.option('--offline', is_flag=True, help='Search the local replica instead of the database')
+def search(limit=100, taken_at_min=None, taken_at_max=None, pixel_size_m_max=None, point_contained=None, intersects=None, min_overlap=None, offline=False):
     """
         Searches for raster on the database
     """
@@ -278,7 +402,128 @@ def search(limit=100, taken_at_min=None, taken_at_max=None, pixel_size_m_max=Non
             taken_at_min=taken_at_min,
             taken_at_max=taken_at_max,
             pixel_size_m_max=pixel_size_m_max,
-            point_contained=point_contained
+            point_contained=point_contained,
+            intersects=intersects,
+            min_overlap=min_overlap,
+            offline=offline
+        )
+
+
+@click.command()
+@click.option('--manifest-path', type=str, help='Path to a .csv file with bucket_name and file_key columns, or to a text file with one s3://bucket/key per line')
+@click.option('--taken-at-min', type=str, help='Min timestamp for when the raster was taken')
+@click.option('--taken-at-max', type=str, help='Max timestamp for when the raster was taken')
+@click.option('--pixel-size-m-max', type=int, help='Max pixel size in ground meters')
+@click.option('--point-contained', type=tuple, help='Point in the (lat,lng) format that must be contained by the geometry')
+@click.option('--intersects', type=str, help='Area of interest as a min_lng,min_lat,max_lng,max_lat bounding box, a GeoJSON or the path to a GeoJSON file')
+@click.option('--min-overlap', type=float, help='Min fraction of the area of interest covered by the raster. Should range between ]0.0,1.0]')
+@click.option('--dry-run', is_flag=True, help='Only print the raster that would be deleted')
+@click.option('--max-workers', type=int, help='Number of batches of 1000 files deleted at the same time')
+def delete_files(manifest_path=None, taken_at_min=None, taken_at_max=None, pixel_size_m_max=None, point_contained=None, intersects=None, min_overlap=None, dry_run=False, max_workers=None):
+    """
+        Deletes many raster from the AWS S3 Bucket and their meta data from the DB
+    """
+    delete_files_api(
+            manifest_path=manifest_path,
+            taken_at_min=taken_at_min,
+            taken_at_max=taken_at_max,
+            pixel_size_m_max=pixel_size_m_max,
+            point_contained=point_contained,
+            intersects=intersects,
+            min_overlap=min_overlap,
+            dry_run=dry_run,
+            max_workers=max_workers
+        )
+
+
+@click.command()
+@click.option('--bucket-name', type=str, help='Name of the AWS S3 bucket')
+@click.option('--prefix', type=str, default='', help='Only reconcile the file keys starting with this prefix')
+@click.option('--out-path', type=str, help='Path to a .csv file where to write the mismatches')
+@click.option('--fix', is_flag=True, help='Delete the rows without a file, the files without a row are only reported')
+@click.option('--register-orphans', is_flag=True, help='With --fix, add the files without a row to the DB')
+@click.option('--delete-orphan-files', is_flag=True, help='With --fix, delete the files without a row from the bucket, including the files uploaded on purpose without a row')
+@click.option('--min-age-s', type=int, default=3600, help='Ignore the rows and files more recent than this, e.g. uploads in progress')
+def reconcile(bucket_name, prefix='', out_path=None, fix=False, register_orphans=False, delete_orphan_files=False, min_age_s=3600):
+    """
+        Finds the DB rows without a file in the AWS S3 Bucket and the files without a row
+    """
+
+    # check input
+    if bucket_name is None:
+        raise Exception('Must provide a bucket name')
+
+    reconcile_api(
+        bucket_name,
+        prefix=prefix,
+        out_path=out_path,
+        fix=fix,
+        register_orphans=register_orphans,
+        delete_orphan_files=delete_orphan_files,
+        min_age_s=min_age_s
+    )
+
+
+@click.command()
+@click.option('--jobs-path', type=str, help='Path to the job file, one json object per line with the operation and its arguments')
+@click.option('--manifest-path', type=str, help='Path to the manifest of the job statuses, defaults to the job file path followed by .manifest')
+@click.option('--max-workers', type=int, help='Number of worker processes, defaults to the number of cpus')
+@click.option('--max-memory-gb', type=float, help='Memory the worker processes and their jobs can use, defaults to 80% of the available memory')
+@click.option('--max-retries', type=int, default=3, help='Number of times a job failing with a network or database error is retried')
+def batch(jobs_path, manifest_path=None, max_workers=None, max_memory_gb=None, max_retries=3):
+    """
+        Runs the to-uint8, compress, reproject, create-tiles, quicklook and unstack-bands jobs of a job file, a rerun skips the jobs already done
+    """
+
+    # check input
+    if jobs_path is None:
+        raise Exception('Must provide a job file')
+
+    batch_api(
+        jobs_path,
+        manifest_path=manifest_path,
+        max_workers=max_workers,
+        max_memory_gb=max_memory_gb,
+        max_retries=max_retries
+    )
+
+
+@click.command()
+@click.option('--full', is_flag=True, help='Rebuild the replica from scratch')
+def sync_replica(full=False):
+    """
+        Copies the raster added to the database into the local replica
+    """
+    sync_replica_api(full=full)
+
+
+@click.command()
+@click.option('--out-path', type=str, help='Path to the output .csv file')
+@click.option('--taken-at-min', type=str, help='Min timestamp for when the raster was taken')
+@click.option('--taken-at-max', type=str, help='Max timestamp for when the raster was taken')
+@click.option('--pixel-size-m-max', type=int, help='Max pixel size in ground meters')
+@click.option('--point-contained', type=tuple, help='Point in the (lat,lng) format that must be contained by the geometry')
+@click.option('--intersects', type=str, help='Area of interest as a min_lng,min_lat,max_lng,max_lat bounding box, a GeoJSON or the path to a GeoJSON file')
+@click.option('--min-overlap', type=float, help='Min fraction of the area of interest covered by the raster. Should range between ]0.0,1.0]')
+@click.option('--after-index', type=int, help='Only export the raster with an index greater than this one (to resume an export)')
+def export(out_path, taken_at_min=None, taken_at_max=None, pixel_size_m_max=None, point_contained=None, intersects=None, min_overlap=None, after_index=None):
+    """
+        Exports the raster found on the database to a .csv file
+    """
+
+    # check input
+    if out_path is None:
+        raise Exception('Must provide an output path')
+
+    export_api(
+            out_path,
+            taken_at_min=taken_at_min,
+            taken_at_max=taken_at_max,
+            pixel_size_m_max=pixel_size_m_max,
+            point_contained=point_contained,
+            intersects=intersects,
+            min_overlap=min_overlap,
+            after_index=after_index
         )
 
 
@@ -292,7 +537,7 @@ def autotest(module_name=None):
 
 
 @click.command()
-@click.option('--file-path', type=str, help='Path to source .tif file')
+@click.option('--file-path', type=str, help='Path to source .tif file or s3://bucket/key uri')
 @click.option('--out-path', type=str, help='Path to output .tif file')
 @click.option('--target-espg', type=int, help='ESPG code of the target coordinates reference system')
 def reproject(file_path, out_path, target_espg=4326):
@@ -303,7 +548,7 @@ def reproject(file_path, out_path, target_espg=4326):
 
 
 @click.command()
-@click.option('--file-path', type=str, help='Path to source .tif file')
+@click.option('--file-path', type=str, help='Path to source .tif file or s3://bucket/key uri')
 @click.option('--out-path', type=str, help='Path to output .tif file')
 def select_bands(file_path, out_path):
     """
@@ -335,9 +580,18 @@ def create_aws_lambda_layer(req_path, out_path, bucket_name, file_key):
 # add commands
 cli.add_command(configure)
 cli.add_command(search)
+cli.add_command(export)
+cli.add_command(sync_replica)
 cli.add_command(get_file)
 cli.add_command(post_file)
+cli.add_command(get_files)
+cli.add_command(post_files)
+cli.add_command(sync)
+cli.add_command(delete_files)
+cli.add_command(reconcile)
+cli.add_command(batch)
 cli.add_command(to_uint8)
+cli.add_command(quicklook)
 cli.add_command(compress)
 cli.add_command(unstack_bands)
 cli.add_command(info)
@@ -347,6 +601,7 @@ cli.add_command(lab)
 cli.add_command(tutorials)
 cli.add_command(autotest)
 cli.add_command(documentation)
+cli.add_command(serve_worker)
 cli.add_command(reproject)
 cli.add_command(select_bands)
 cli.add_command(create_aws_lambda_layer)
@@ -378,5 +633,10 @@ if __name__ == "__main__":
         # launch config routine
         configure()
 
+    # run the command in the worker if one is running
+    exit_code = forward(sys.argv[1:], config[WORKER_SOCKET_PATH_KEY])
+    if exit_code is not None:
+        sys.exit(exit_code)
+
     # run app
     cli()
@@ -1,4 +1,6 @@
 import os
+import csv
+from concurrent.futures import ThreadPoolExecutor
 
 # Pretty print
 import pprint
@@ -7,32 +9,14 @@ pp = pprint.PrettyPrinter(depth=4)
 # config file interface
 from ..config import get_config
 
-# aws interface
-from ..cloudstorage import get_cloudstorage
-
-# database interface
-from ..database import get_database
-
-# raster helper
-from ..utils.raster import to_uint8 as img_to_uint8
-from ..utils.raster import compress as img_compress
-from ..utils.raster import unstack_bands as img_unstack_bands
-from ..utils.raster import stack_bands as img_stack_bands
-from ..utils.raster import info as img_info
-from ..utils.raster import create_tiles as img_create_tiles
-from ..utils.raster import get_attributes
-from ..utils.raster import reproject as img_reproject
-from ..utils.raster import select_bands as img_select_bands
-from ..utils.raster import bands_info
-
 # basic funcs
-from ..utils.basic import is_int
+from ..utils.basic import is_int, is_float, is_s3_uri
 
 # http server
 from ..httpserver import launch
 
-# lambda helper
-from ..aws.Lambda.layers import create as create_lambda_layer
+# The cloudstorage, database, raster and lambda modules pull boto3, SQLAlchemy, rasterio,
+# matplotlib, ... so they are imported by the commands that need them, not when the cli starts
 
 
 def configure():
@@ -89,7 +73,27 @@ def documentation():
     launch('/gis-packer/docs/_build/html/')
 
 
-def get_file(bucket_name, file_key, out_path):
+def serve_worker(cli, socket_path=None):
+    """Runs the worker daemon, the cli forwards its commands to it while it is running
+
+    Arguments
+    ----------
+        cli : click.Group
+            Group of the cli commands
+        socket_path : str
+            Path of the Unix socket, defaults to the WORKER_SOCKET_PATH config
+    """
+
+    from ..config import WORKER_SOCKET_PATH_KEY
+    from ..worker import serve
+
+    if socket_path is None:
+        socket_path = get_config()[WORKER_SOCKET_PATH_KEY]
+
+    serve(cli, socket_path)
+
+
+def get_file(bucket_name, file_key, out_path, resume=False):
     """Downloads a file from the an AWS S3 Bucket
 
     Arguments
@@ -100,6 +104,8 @@ def get_file(bucket_name, file_key, out_path):
             File key in the S3 bucket
         out_path : str
             Path where to save the downloaded file
+        resume : bool
+            If true the download is checkpointed and continues where a previous attempt stopped
     """
 
     # check input
@@ -110,17 +116,27 @@ def get_file(bucket_name, file_key, out_path):
     if not os.path.isabs(out_path):
         raise Exception('Must be an absolute path')
 
+    from ..cloudstorage import get_cloudstorage
+
     # grab cloud storage
     cloudstorage = get_cloudstorage()
 
     # get file
-    cloudstorage.get(bucket_name, file_key, out_path)
+    if resume:
+        stats = cloudstorage.get_resumable(bucket_name, file_key, out_path)
+        if stats['resumed_from'] > 0:
+            print(f"Resumed from {round(stats['resumed_from']/(1024.0*1024.0), 2)} mb")
+    else:
+        stats = cloudstorage.get(bucket_name, file_key, out_path)
 
     # inform user
-    print(f'File downloaded successfully at {out_path}')
+    if stats['cached']:
+        print(f'File retrieved from the download cache at {out_path}')
+    else:
+        print(f"File downloaded successfully at {out_path} ({round(stats['seconds'], 1)} s, {round(stats['mb_per_s'], 2)} MB/s)")
 
 
-def post_file(bucket_name, file_key, file_path):
+def post_file(bucket_name, file_key, file_path, resume=False):
     """Uploads a file to the AWS S3 Bucket
 
     Arguments
@@ -131,6 +147,8 @@ def post_file(bucket_name, file_key, file_path):
             File key in the S3 bucket
         file_path : str
             Path of the file to upload
+        resume : bool
+            If true the upload is checkpointed and continues where a previous attempt stopped
     """
 
     # check input
@@ -141,58 +159,329 @@ def post_file(bucket_name, file_key, file_path):
     if not os.path.isabs(file_path):
         raise Exception('Must be an absolute path')
 
+    from ..cloudstorage import get_cloudstorage
+    from ..database import get_database
+    from ..utils.raster import get_attributes
+    from ..utils.basic import get_content_hash
+
     # grab cloud storage
     cloudstorage = get_cloudstorage()
 
     # grab database
     database = get_database()
 
-    # get raster attributes dict
-    attributes = get_attributes(file_path)
-
-    # insert into db
-    db_success = False
+    # the attributes are extracted in the background during the hash and the upload
+    executor = ThreadPoolExecutor(max_workers=1)
     try:
-        database.insert(
-            attributes['taken_at'],
-            bucket_name,
-            file_key,
-            attributes['pixel_size_m'],
-            attributes['geometry'],
-            attributes['bands'],
-            attributes['profile']
+        attributes_future = executor.submit(get_attributes, file_path)
+
+        # the hash is needed before the upload, to skip duplicates
+        content_hash = get_content_hash(
+            file_path,
+            multipart_threshold=cloudstorage.transfer_config.multipart_threshold,
+            multipart_chunksize=cloudstorage.transfer_config.multipart_chunksize
         )
-        db_success = True
-    except:
-        pass
 
-    if not db_success:
-        raise Exception('Could not insert meta data into the database')
+        # skip the upload if an identical raster is already in the cloudstorage
+        duplicates = database.find_by_content_hash(content_hash)
+        if len(duplicates.index) > 0:
+            duplicate = duplicates.iloc[0]
+            print(f"Identical raster already stored at {duplicate['bucket_name']}/{duplicate['file_key']}, skipping upload")
+            return
 
-    # upload to aws
-    upload_success = False
-    try:
-        cloudstorage.post(bucket_name, file_key, file_path)
-        upload_success = True
-    except:
-        pass
+        # upload to aws
+        try:
+            if resume:
+                stats = cloudstorage.post_resumable(bucket_name, file_key, file_path)
+            else:
+                stats = cloudstorage.post(bucket_name, file_key, file_path)
+        except Exception as e:
+            raise Exception(f'Could not upload file, nothing was added to the DB : {e}')
+
+        # wait for the attributes
+        attributes_error = None
+        try:
+            attributes = attributes_future.result()
+        except Exception as e:
+            attributes_error = e
 
-    if not upload_success:
+    finally:
+        executor.shutdown(wait=False)
 
-        db_success = False
+    # insert into db, only once both the upload and the extraction succeeded
+    db_error = attributes_error
+    if db_error is None:
+        try:
+            database.insert(
+                attributes['taken_at'],
+                bucket_name,
+                file_key,
+                attributes['pixel_size_m'],
+                attributes['geometry'],
+                attributes['bands'],
+                attributes['profile'],
+                content_hash=content_hash
+            )
+        except Exception as e:
+            db_error = e
+
+    # remove the uploaded file so the cloudstorage and the DB stay consistent
+    if db_error is not None:
+
+        delete_success = False
         try:
-            database.delete(bucket_name, file_key)
-            db_success = True
+            cloudstorage.delete(bucket_name, file_key)
+            delete_success = True
         except:
             pass
 
-        if db_success:
-            raise Exception('Could not upload file, but was able to delete meta data from DB')
+        if delete_success:
+            raise Exception(f'Could not insert meta data into the database, but was able to delete the uploaded file : {db_error}')
         else:
-            raise Exception('Could not upload file and could not delete meta data from DB')
+            raise Exception(f'Could not insert meta data into the database and could not delete the uploaded file : {db_error}')
 
     # inform
-    print('File uploaded successfully and meta data added to DB')
+    print(f"File uploaded successfully and meta data added to DB ({round(stats['seconds'], 1)} s, {round(stats['mb_per_s'], 2)} MB/s)")
+
+
+def print_transfer_results(results):
+    """Prints the result of each transfer and a summary
+
+    Arguments
+    ----------
+        results : list
+            Results returned by CloudStorage.get_many / post_many
+    """
+
+    nbr_of_bytes = 0
+    nbr_of_failures = 0
+    for result in results:
+        if result['success']:
+            nbr_of_bytes += result['stats']['bytes']
+            print(f"OK      {result['bucket_name']}/{result['file_key']} <-> {result['path']}")
+        else:
+            nbr_of_failures += 1
+            print(f"FAILED  {result['bucket_name']}/{result['file_key']} <-> {result['path']} : {result['error']}")
+
+    print(f'{len(results) - nbr_of_failures}/{len(results)} files transferred ({round(nbr_of_bytes/(1024.0*1024.0), 2)} mb)')
+
+
+def print_transfer_metrics(metrics):
+    """Prints the throughput of each priority class
+
+    Arguments
+    ----------
+        metrics : dict
+            Metrics returned by TransferScheduler.metrics
+    """
+
+    for priority, m in metrics.items():
+        if m['transfers'] + m['failures'] == 0:
+            continue
+        print(f"{priority} : {m['transfers']} transfers, {m['failures']} failed, {round(m['bytes']/(1024.0*1024.0), 2)} mb in {round(m['seconds'], 2)}s ({round(m['mb_per_s'], 2)} MB/s)")
+
+
+def read_lines(file_path):
+    """
+        Returns the non-empty lines of a text file
+    """
+
+    with open(file_path, 'r') as fh:
+        return [line.strip() for line in fh if line.strip() != '']
+
+
+def get_files(bucket_name, out_dir, prefix=None, keys_path=None, max_workers=None, order=None):
+    """Downloads many files from an AWS S3 Bucket in a single process
+
+    Arguments
+    ----------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        out_dir : str
+            Directory where to save the files, the key of each file is used as its relative path, keys ending with / are skipped
+        prefix : str
+            Download every file whose key starts with this prefix
+        keys_path : str
+            Path to a text file listing the keys to download, one per line
+        max_workers : int
+            Number of files downloaded at the same time
+        order : str
+            'fifo', 'smallest' or 'largest' first, defaults to the TRANSFER_ORDER config
+    """
+
+    # check input
+    if out_dir is None or out_dir == '':
+        raise Exception('Must provide a valid output directory')
+
+    # check if absolute
+    if not os.path.isabs(out_dir):
+        raise Exception('Must be an absolute path')
+
+    if (prefix is None) == (keys_path is None):
+        raise Exception('Must provide either a prefix or a keys file')
+
+    from ..cloudstorage import get_cloudstorage
+
+    # grab cloud storage
+    cloudstorage = get_cloudstorage()
+
+    # grab the keys, and the sizes when listing
+    sizes = None
+    if prefix is not None:
+        objs = [obj for obj in cloudstorage.list(bucket_name, prefix=prefix) if not obj['Key'].endswith('/')]
+        file_keys = [obj['Key'] for obj in objs]
+        sizes = [obj['Size'] for obj in objs]
+    else:
+        file_keys = [file_key for file_key in read_lines(keys_path) if not file_key.endswith('/')]
+
+    # map each key to an output path, folder placeholders are skipped
+    items = []
+    for file_key in file_keys:
+
+        # the key must stay inside the output directory
+        parts = file_key.split('/')
+        if file_key.startswith('/') or any([p in ('', '.', '..') for p in parts]):
+            raise Exception(f'Invalid file key {file_key}')
+
+        out_path = os.path.join(out_dir, *parts)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        items.append((bucket_name, file_key, out_path))
+
+    # download
+    results = cloudstorage.get_many(items, max_workers=max_workers, order=order, sizes=sizes)
+
+    # inform user
+    print_transfer_results(results)
+    print_transfer_metrics(cloudstorage.scheduler.metrics())
+
+
+def post_files(bucket_name, src_dir=None, paths_path=None, key_prefix='', max_workers=None, order=None):
+    """Uploads many files to an AWS S3 Bucket in a single process, without adding their meta data to the DB
+
+    Arguments
+    ----------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        src_dir : str
+            Upload every file in this directory, the relative path of each file is used as its key
+        paths_path : str
+            Path to a text file listing the absolute paths of the files to upload, one per line
+        key_prefix : str
+            Prefix added to every key
+        max_workers : int
+            Number of files uploaded at the same time
+        order : str
+            'fifo', 'smallest' or 'largest' first, defaults to the TRANSFER_ORDER config
+    """
+
+    if (src_dir is None) == (paths_path is None):
+        raise Exception('Must provide either a source directory or a paths file')
+
+    if key_prefix is None:
+        key_prefix = ''
+
+    # map each file to a key
+    items = []
+    if src_dir is not None:
+
+        # check if absolute
+        if not os.path.isabs(src_dir):
+            raise Exception('Must be an absolute path')
+
+        for root, _, filenames in os.walk(src_dir):
+            for filename in filenames:
+                src_path = os.path.join(root, filename)
+                file_key = key_prefix + os.path.relpath(src_path, src_dir).replace(os.sep, '/')
+                items.append((bucket_name, file_key, src_path))
+
+    else:
+        for src_path in read_lines(paths_path):
+            if not os.path.isabs(src_path):
+                raise Exception(f'Must be an absolute path : {src_path}')
+            items.append((bucket_name, key_prefix + os.path.basename(src_path), src_path))
+
+    from ..cloudstorage import get_cloudstorage
+
+    # grab cloud storage
+    cloudstorage = get_cloudstorage()
+
+    # upload
+    results = cloudstorage.post_many(items, max_workers=max_workers, order=order)
+
+    # inform user
+    print_transfer_results(results)
+    print_transfer_metrics(cloudstorage.scheduler.metrics())
+
+
+def sync(local_dir, bucket_name, prefix='', direction='upload', compare='size', delete=False, dry_run=False, max_workers=None, order=None):
+    """Transfers only the files that differ between a local directory and a prefix of an AWS S3 Bucket
+
+    Arguments
+    ----------
+        local_dir : str
+            Path to the local directory
+        bucket_name : str
+            Name of the AWS S3 bucket
+        prefix : str
+            Prefix of the file keys, empty or ending with /
+        direction : str
+            'upload' or 'download'
+        compare : str
+            'size', 'mtime' or 'etag'
+        delete : bool
+            If true the files missing from the source are deleted from the destination
+        dry_run : bool
+            If true only prints what would be transferred and deleted
+        max_workers : int
+            Number of files transferred at the same time
+        order : str
+            'fifo', 'smallest' or 'largest' first, defaults to the TRANSFER_ORDER config
+    """
+
+    # check input
+    if local_dir is None or local_dir == '':
+        raise Exception('Must provide a valid local directory')
+
+    # check if absolute
+    if not os.path.isabs(local_dir):
+        raise Exception('Must be an absolute path')
+
+    if prefix is None:
+        prefix = ''
+
+    from ..cloudstorage import get_cloudstorage
+
+    # grab cloud storage
+    cloudstorage = get_cloudstorage()
+
+    # sync
+    report = cloudstorage.sync(
+        local_dir,
+        bucket_name,
+        prefix=prefix,
+        direction=direction,
+        compare=compare,
+        delete=delete,
+        dry_run=dry_run,
+        max_workers=max_workers,
+        order=order
+    )
+
+    # inform user
+    if dry_run:
+        for file_key in report['transfers']:
+            print(f'TRANSFER  {file_key}')
+        for deleted in report['deleted']:
+            print(f'DELETE    {deleted}')
+        print(f"{len(report['transfers'])} files to transfer, {len(report['deleted'])} to delete, {report['unchanged']} unchanged")
+        return
+
+    print_transfer_results(report['transfers'])
+    print_transfer_metrics(cloudstorage.scheduler.metrics())
+
+    for error in report['delete_errors']:
+        print(f"FAILED  delete {error['Key']} : {error['Message']}")
+    print(f"{len(report['deleted']) - len(report['delete_errors'])} files deleted, {report['unchanged']} unchanged")
 
 
 def info(file_path):
@@ -208,9 +497,11 @@ def info(file_path):
     if file_path is None or file_path == '':
         raise Exception('Invalid file path')
 
-    # check if absolute
-    if not os.path.isabs(file_path):
-        raise Exception('Must be an absolute path')
+    # check if absolute, the source can also be read from the cloudstorage
+    if not os.path.isabs(file_path) and not is_s3_uri(file_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+
+    from ..utils.raster import info as img_info
 
     # preview
     img_info(file_path)
@@ -231,11 +522,13 @@ def unstack_bands(file_path, out_dir):
     if file_path is None or file_path == '' or out_dir is None or out_dir == '':
         raise Exception('Invalid file path')
 
-    # check if absolute
-    if not os.path.isabs(file_path):
-        raise Exception('Must be an absolute path')
-    if not os.path.isabs(out_dir):
-        raise Exception('Must be an absolute path')
+    # check if absolute, the source can also be read from the cloudstorage
+    if not os.path.isabs(file_path) and not is_s3_uri(file_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+    if not os.path.isabs(out_dir) and not is_s3_uri(out_dir):
+        raise Exception('Must be an absolute path or a s3:// uri')
+
+    from ..utils.raster import unstack_bands as img_unstack_bands
 
     # convert
     _ = img_unstack_bands(file_path, out_dir)
@@ -262,8 +555,10 @@ def stack_bands(src_dir, out_path):
     if not os.path.isabs(out_path):
         raise Exception('Must be an absolute path')
 
+    from ..utils.raster import stack_bands as img_stack_bands
+
     # run
-    stack_bands(src_dir, out_path)
+    img_stack_bands(src_dir, out_path)
 
 
 def to_uint8(file_path, out_path):
@@ -281,11 +576,13 @@ def to_uint8(file_path, out_path):
     if file_path is None or file_path == '' or out_path is None or out_path == '':
         raise Exception('Invalid file path')
 
-    # check if absolute
-    if not os.path.isabs(file_path):
-        raise Exception('Must be an absolute path')
-    if not os.path.isabs(out_path):
-        raise Exception('Must be an absolute path')
+    # check if absolute, the source can also be read from the cloudstorage
+    if not os.path.isabs(file_path) and not is_s3_uri(file_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+    if not os.path.isabs(out_path) and not is_s3_uri(out_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+
+    from ..utils.raster import to_uint8 as img_to_uint8
 
     # convert
     img_to_uint8(file_path, out_path)
@@ -306,17 +603,19 @@ def compress(file_path, out_path):
     if file_path is None or file_path == '' or out_path is None or out_path == '':
         raise Exception('Invalid file path')
 
-    # check if absolute
-    if not os.path.isabs(file_path):
-        raise Exception('Must be an absolute path')
-    if not os.path.isabs(out_path):
-        raise Exception('Must be an absolute path')
+    # check if absolute, the source can also be read from the cloudstorage
+    if not os.path.isabs(file_path) and not is_s3_uri(file_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+    if not os.path.isabs(out_path) and not is_s3_uri(out_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+
+    from ..utils.raster import compress as img_compress
 
     # convert
     img_compress(file_path, out_path)
 
 
-def create_tiles(file_path, out_dir, tile_size_in_m=None, tile_size_in_pixels=None, tile_overlap=0.0):
+def create_tiles(file_path, out_dir, tile_size_in_m=None, tile_size_in_pixels=None, tile_overlap=0.0, register=False):
     """Tiles an image into smaller square chunks
 
     Arguments
@@ -331,26 +630,137 @@ def create_tiles(file_path, out_dir, tile_size_in_m=None, tile_size_in_pixels=No
             Tile (height,width) in pixels
         tile_overlap : float
             Amount of overlap of each tile in float format. Should range between [0.0,0.9]
+        register : bool
+            If true and out_dir is a s3://bucket/prefix/ uri, the meta data of each tile is added to the DB
     """
 
     # validate input
     if file_path is None or file_path == '' or out_dir is None or out_dir == '':
         raise Exception('Invalid inputs')
 
-    # check if absolute
-    if not os.path.isabs(file_path):
-        raise Exception('Must be an absolute path')
-    if not os.path.isabs(out_dir):
-        raise Exception('Must be an absolute path')
+    if register and not is_s3_uri(out_dir):
+        raise Exception('Only the tiles written to a s3:// uri can be registered')
+
+    # check if absolute, the source can also be read from the cloudstorage
+    if not os.path.isabs(file_path) and not is_s3_uri(file_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+    if not os.path.isabs(out_dir) and not is_s3_uri(out_dir):
+        raise Exception('Must be an absolute path or a s3:// uri')
+
+    from ..utils.raster import create_tiles as img_create_tiles
 
     # convert
     if tile_size_in_m is not None:
-        img_create_tiles(file_path, out_dir, tile_overlap=tile_overlap, tile_size_in_m=tile_size_in_m)
+        img_create_tiles(file_path, out_dir, tile_overlap=tile_overlap, tile_size_in_m=tile_size_in_m, register_in_db=register)
     else:
-        img_create_tiles(file_path, out_dir, tile_overlap=tile_overlap, tile_size_in_pixels=tile_size_in_pixels)
+        img_create_tiles(file_path, out_dir, tile_overlap=tile_overlap, tile_size_in_pixels=tile_size_in_pixels, register_in_db=register)
+
 
+def quicklook(file_path, out_path, max_size=1024):
+    """Writes a downsampled preview of an image
+
+    Arguments
+    ----------
+        file_path : str
+            Path to the .tif file or s3://bucket/key uri
+        out_path : str
+            Path to output the .tif file
+        max_size : int
+            Maximum width and height in pixels of the preview
+    """
+
+    # validate input
+    if file_path is None or file_path == '' or out_path is None or out_path == '':
+        raise Exception('Invalid file path')
+
+    # check if absolute, the source can also be read from the cloudstorage
+    if not os.path.isabs(file_path) and not is_s3_uri(file_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+    if not os.path.isabs(out_path) and not is_s3_uri(out_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+
+    from ..utils.raster import quicklook as img_quicklook
+
+    img_quicklook(file_path, out_path, max_size=max_size)
+
+
+def batch(jobs_path, manifest_path=None, max_workers=None, max_memory_gb=None, max_retries=3):
+    """Runs the jobs of a job file on a process pool, the jobs already done according to the manifest are skipped
+
+    Arguments
+    ----------
+        jobs_path : str
+            Path to the job file, one json object per line with the operation (to-uint8, compress, reproject,
+            create-tiles, quicklook, unstack-bands) and the arguments of the operation
+        manifest_path : str
+            Path to the manifest recording the status of each job, defaults to the job file path followed by .manifest
+        max_workers : int
+            Number of worker processes, defaults to the number of cpus
+        max_memory_gb : float
+            Memory the worker processes and their jobs can use, defaults to 80% of the available memory
+        max_retries : int
+            Number of times a job failing with a network or database error is retried
+    """
+
+    # check input
+    if jobs_path is None or not os.path.isfile(jobs_path):
+        raise Exception('Must provide a valid job file')
 
-def search(limit=100, taken_at_min=None, taken_at_max=None, pixel_size_m_max=None, point_contained=None):
+    from .batch import run_batch
+
+    def on_result(job_id, job, status, result):
+        if status == 'done':
+            print(f"OK      {job_id} {job['operation']} {job.get('file_path', '')} ({round(result['seconds'], 2)}s)")
+        elif status == 'retry':
+            print(f"RETRY   {job_id} {job['operation']} {job.get('file_path', '')} : {result['error']}")
+        else:
+            print(f"FAILED  {job_id} {job['operation']} {job.get('file_path', '')} : {result['error']}")
+
+    report = run_batch(
+        jobs_path,
+        manifest_path=manifest_path,
+        max_workers=max_workers,
+        max_memory=int(float(max_memory_gb) * 1024 * 1024 * 1024) if max_memory_gb is not None else None,
+        max_retries=max_retries,
+        on_result=on_result
+    )
+
+    # inform user
+    print(f"{report['done']} jobs done, {report['failed']} failed, {report['skipped']} already done")
+
+
+def parse_intersects(intersects):
+    """Parses the area of interest provided through the command line
+
+    Arguments
+    ---------
+    intersects : str
+        'min_lng,min_lat,max_lng,max_lat' bounding box, GeoJSON str or path to a GeoJSON file
+
+    Returns
+    -------
+    aoi : tuple or str
+        Bounding box tuple or GeoJSON str, as expected by the database filters
+    """
+
+    if intersects is None or intersects == '':
+        return None
+
+    # path to a geojson file
+    if os.path.isfile(intersects):
+        with open(intersects, 'r') as fh:
+            return fh.read()
+
+    # bounding box
+    components = intersects.split(',')
+    if len(components) == 4 and all([is_float(c) for c in components]):
+        return tuple([float(c) for c in components])
+
+    # geojson str
+    return intersects
+
+
+def search(limit=100, taken_at_min=None, taken_at_max=None, pixel_size_m_max=None, point_contained=None, intersects=None, min_overlap=None, offline=False):
     """Searches for raster on the database
 
     Arguments
@@ -365,18 +775,33 @@ def search(limit=100, taken_at_min=None, taken_at_max=None, pixel_size_m_max=Non
         Max pixel size in ground meters
     point_contained : tuple
         Point in the (lat,lng) format that must be contained by the geometry
+    intersects : str
+        Area of interest the geometry must intersect, as a 'min_lng,min_lat,max_lng,max_lat' bounding box,
+        a GeoJSON str or the path to a GeoJSON file
+    min_overlap : float
+        Min fraction of the area of interest covered by the geometry, ranges between ]0.0,1.0]
+    offline : bool
+        If true searches the local replica instead of the database
     """
 
-    # get database
-    database = get_database()
+    from ..database import get_database
+    from ..database.replica import get_replica
+
+    # get the local replica or the database
+    if offline:
+        catalog = get_replica()
+    else:
+        catalog = get_database()
 
     # run query
-    results = database.select(
+    results = catalog.select(
             LIMIT=limit,
             TAKEN_AT_MIN=taken_at_min,
             TAKEN_AT_MAX=taken_at_max,
             PIXEL_SIZE_M_MAX=pixel_size_m_max,
-            POINT_CONTAINED=point_contained
+            POINT_CONTAINED=point_contained,
+            INTERSECTS=parse_intersects(intersects),
+            MIN_OVERLAP=min_overlap
         )
 
     # convert to list of dicts
@@ -388,17 +813,413 @@ def search(limit=100, taken_at_min=None, taken_at_max=None, pixel_size_m_max=Non
     print(f'{len(records)} records found')
 
 
+def sync_replica(full=False):
+    """Copies the raster added to the database since the last sync into the local replica
+
+    Arguments
+    ---------
+    full : bool
+        If true the replica is emptied and rebuilt from scratch
+    """
+
+    from ..database import get_database
+    from ..database.replica import get_replica
+
+    # get database
+    database = get_database()
+
+    # get replica
+    replica = get_replica()
+
+    # sync
+    nbr_of_rows = replica.sync(database, full=full)
+
+    # inform
+    print(f'{nbr_of_rows} records synced, {replica.count()} records in the replica at {replica.replica_path}')
+
+
+def export(out_path, taken_at_min=None, taken_at_max=None, pixel_size_m_max=None, point_contained=None, intersects=None, min_overlap=None, after_index=None):
+    """Exports the raster found on the database to a .csv file, streaming the rows in constant memory
+
+    Arguments
+    ---------
+    out_path : str
+        Path to the output .csv file
+    taken_at_min : str
+        Min timestamp for when the raster was taken (ISO format)
+    taken_at_max : str
+        Max timestamp for when the raster was taken (ISO format)
+    pixel_size_m_max : int
+        Max pixel size in ground meters
+    point_contained : tuple
+        Point in the (lat,lng) format that must be contained by the geometry
+    intersects : str
+        Area of interest the geometry must intersect, as a 'min_lng,min_lat,max_lng,max_lat' bounding box,
+        a GeoJSON str or the path to a GeoJSON file
+    min_overlap : float
+        Min fraction of the area of interest covered by the geometry, ranges between ]0.0,1.0]
+    after_index : int
+        Only export the raster with an index greater than this one (to resume an export)
+    """
+
+    # check input
+    if out_path is None or out_path == '':
+        raise Exception('Must provide a valid output path')
+
+    # check if absolute
+    if not os.path.isabs(out_path):
+        raise Exception('Must be an absolute path')
+
+    from ..database import get_database
+
+    # get database
+    database = get_database()
+
+    # stream the chunks to disk
+    nbr_of_records = 0
+    with open(out_path, 'a' if after_index is not None else 'w') as fh:
+        for chunk in database.stream(
+                AFTER_INDEX=after_index,
+                TAKEN_AT_MIN=taken_at_min,
+                TAKEN_AT_MAX=taken_at_max,
+                PIXEL_SIZE_M_MAX=pixel_size_m_max,
+                POINT_CONTAINED=point_contained,
+                INTERSECTS=parse_intersects(intersects),
+                MIN_OVERLAP=min_overlap
+            ):
+
+            # only write the header once
+            chunk.to_csv(fh, header=(nbr_of_records == 0 and after_index is None), index=False)
+            nbr_of_records += len(chunk.index)
+
+            # inform
+            print(f'\r{nbr_of_records} records exported', end='')
+
+    print(f'\n{nbr_of_records} records exported to {out_path}')
+
+
+def read_manifest(manifest_path):
+    """Returns the (bucket_name, file_key) listed in a manifest
+
+    The manifest is either a .csv file with bucket_name and file_key columns (e.g. made by export)
+    or a text file with one s3://bucket/key uri per line
+    """
+
+    from ..utils.basic import parse_s3_uri
+
+    with open(manifest_path, 'r') as fh:
+        header = fh.readline()
+        fh.seek(0)
+
+        if 'bucket_name' in header and 'file_key' in header:
+            return [(row['bucket_name'], row['file_key']) for row in csv.DictReader(fh)]
+
+    return [parse_s3_uri(line) for line in read_lines(manifest_path)]
+
+
+def delete_files(manifest_path=None, taken_at_min=None, taken_at_max=None, pixel_size_m_max=None, point_contained=None, intersects=None, min_overlap=None, dry_run=False, max_workers=None):
+    """Deletes many raster from the AWS S3 Bucket and their meta data from the DB
+
+    The raster are selected with the search filters or listed in a manifest. They are deleted in batches
+    of 1000 sent in parallel, each batch is removed from the cloudstorage with a single delete_objects
+    request then, for the files actually deleted, from the DB in a single transaction.
+
+    Arguments
+    ---------
+    manifest_path : str
+        Path to a .csv file with bucket_name and file_key columns, or to a text file with one s3://bucket/key uri per line
+    taken_at_min : str
+        Min timestamp for when the raster was taken (ISO format)
+    taken_at_max : str
+        Max timestamp for when the raster was taken (ISO format)
+    pixel_size_m_max : int
+        Max pixel size in ground meters
+    point_contained : tuple
+        Point in the (lat,lng) format that must be contained by the geometry
+    intersects : str
+        Area of interest the geometry must intersect, see parse_intersects
+    min_overlap : float
+        Min fraction of the area of interest covered by the geometry, ranges between ]0.0,1.0]
+    dry_run : bool
+        If true only prints the raster that would be deleted
+    max_workers : int
+        Number of batches deleted at the same time
+    """
+
+    filters = {
+        'TAKEN_AT_MIN': taken_at_min,
+        'TAKEN_AT_MAX': taken_at_max,
+        'PIXEL_SIZE_M_MAX': pixel_size_m_max,
+        'POINT_CONTAINED': point_contained,
+        'INTERSECTS': parse_intersects(intersects),
+        'MIN_OVERLAP': min_overlap
+    }
+    has_filters = any([v is not None for v in filters.values()])
+
+    # never delete the whole catalog by mistake
+    if manifest_path is None and not has_filters:
+        raise Exception('Must provide a manifest or at least one search filter')
+
+    if manifest_path is not None and has_filters:
+        raise Exception('Must provide either a manifest or search filters')
+
+    from ..cloudstorage import get_cloudstorage, DELETE_BATCH_SIZE
+    from ..database import get_database
+
+    # grab cloud storage and database
+    cloudstorage = get_cloudstorage()
+    database = get_database()
+
+    if max_workers is None:
+        max_workers = cloudstorage.max_workers
+
+    # select the raster
+    if manifest_path is not None:
+        keys = read_manifest(manifest_path)
+    else:
+        keys = [(row['bucket_name'], row['file_key']) for row in database.stream(AS_GDF=False, **filters)]
+
+    # batches of a single bucket
+    keys_by_bucket = {}
+    for bucket_name, file_key in keys:
+        keys_by_bucket.setdefault(bucket_name, []).append(file_key)
+
+    batches = []
+    for bucket_name, file_keys in keys_by_bucket.items():
+        for i in range(0, len(file_keys), DELETE_BATCH_SIZE):
+            batches.append((bucket_name, file_keys[i:i+DELETE_BATCH_SIZE]))
+
+    # report
+    if dry_run:
+        for bucket_name, file_key in keys:
+            print(f'DELETE  {bucket_name}/{file_key}')
+        for bucket_name, file_keys in keys_by_bucket.items():
+            print(f'{len(file_keys)} raster to delete from {bucket_name}')
+        print(f'{len(keys)} raster to delete in {len(batches)} batches')
+        return
+
+    def delete_batch(batch):
+
+        bucket_name, file_keys = batch
+        result = {'bucket_name': bucket_name, 'deleted': 0, 'rows': 0, 'errors': []}
+
+        # files first, the rows of the files that could not be deleted are kept
+        result['errors'] = cloudstorage.delete_keys(bucket_name, file_keys, max_workers=1)
+        failed_keys = set([e['Key'] for e in result['errors']])
+        deleted_keys = [k for k in file_keys if k not in failed_keys]
+        result['deleted'] = len(deleted_keys)
+
+        try:
+            result['rows'] = database.delete_many([(bucket_name, k) for k in deleted_keys])
+        except Exception as e:
+            result['errors'].append({'Key': f'{len(deleted_keys)} rows', 'Code': 'DatabaseError', 'Message': str(e)})
+
+        return result
+
+    nbr_deleted = 0
+    nbr_rows = 0
+    nbr_errors = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(delete_batch, batches):
+            nbr_deleted += result['deleted']
+            nbr_rows += result['rows']
+            nbr_errors += len(result['errors'])
+            for error in result['errors']:
+                print(f"FAILED  {result['bucket_name']}/{error['Key']} : {error['Message']}")
+            print(f'\r{nbr_deleted}/{len(keys)} files deleted', end='')
+
+    print(f'\n{nbr_deleted} files and {nbr_rows} rows deleted, {nbr_errors} errors')
+
+
+# mismatches found by reconcile
+ROW_WITHOUT_OBJECT = 'row_without_object'
+OBJECT_WITHOUT_ROW = 'object_without_row'
+
+
+def merge_sorted_keys(rows, objects):
+    """Walks two streams of keys sorted in the same order and yields the keys found in only one of them
+
+    Arguments
+    ---------
+    rows : iterable
+        (file_key, age_s) of the rows of the DB
+    objects : iterable
+        (file_key, age_s, obj) of the objects of the cloudstorage, obj being their listing entry
+
+    Returns
+    -------
+    generator of tuple
+        (status, file_key, age_s, obj) where status is ROW_WITHOUT_OBJECT or OBJECT_WITHOUT_ROW
+    """
+
+    rows = iter(rows)
+    objects = iter(objects)
+    row = next(rows, None)
+    obj = next(objects, None)
+
+    while row is not None or obj is not None:
+
+        if obj is None or (row is not None and row[0] < obj[0]):
+            yield ROW_WITHOUT_OBJECT, row[0], row[1], None
+            row = next(rows, None)
+
+        elif row is None or obj[0] < row[0]:
+            yield OBJECT_WITHOUT_ROW, obj[0], obj[1], obj[2]
+            obj = next(objects, None)
+
+        else:
+            row = next(rows, None)
+            obj = next(objects, None)
+
+
+def reconcile(bucket_name, prefix='', out_path=None, fix=False, register_orphans=False, delete_orphan_files=False, min_age_s=3600):
+    """Finds the DB rows without a file in the AWS S3 Bucket and the files without a row, optionally fixes them
+
+    The rows (keyset pagination in byte order) and the bucket listing (returned in byte order by S3) are
+    streamed in two background threads and merged like two sorted lists, so the memory used does not
+    depend on the number of keys.
+
+    Arguments
+    ---------
+    bucket_name : str
+        Name of the AWS S3 bucket
+    prefix : str
+        Only reconcile the file keys starting with this prefix
+    out_path : str
+        Path to a .csv file where to write the mismatches (status, bucket_name, file_key)
+    fix : bool
+        If true the rows without a file are deleted, the files without a row are left alone unless
+        register_orphans or delete_orphan_files is true
+    register_orphans : bool
+        If true (with fix) the files without a row are added to the DB
+    delete_orphan_files : bool
+        If true (with fix) the files without a row are deleted from the bucket. Files can be uploaded on purpose
+        without a row (sync, post-files, tiles written without --register), so this is never the default
+    min_age_s : int
+        Only the rows and files older than this are considered, to leave alone the uploads in progress
+    """
+
+    # check input
+    if bucket_name is None or bucket_name == '':
+        raise Exception('Must provide a bucket name')
+
+    if out_path is not None and not os.path.isabs(out_path):
+        raise Exception('Must be an absolute path')
+
+    if prefix is None:
+        prefix = ''
+
+    if register_orphans and delete_orphan_files:
+        raise Exception('The files without a row can either be registered or deleted, not both')
+
+    import time
+    from ..cloudstorage import get_cloudstorage, DELETE_BATCH_SIZE
+    from ..database import get_database
+    from ..utils.basic import prefetch
+
+    # grab cloud storage and database
+    cloudstorage = get_cloudstorage()
+    database = get_database()
+
+    # the ETag is only read for the files registered, a local bucket hashes the file to compute it
+    def list_objects():
+        for obj in cloudstorage.list(bucket_name, prefix=prefix):
+            yield obj['Key'], time.time() - obj['LastModified'].timestamp(), obj
+
+    def register(file_key, obj):
+        from ..utils.raster import get_attributes
+        attributes = get_attributes(f's3://{bucket_name}/{file_key}')
+        database.insert(
+            attributes['taken_at'],
+            bucket_name,
+            file_key,
+            attributes['pixel_size_m'],
+            attributes['geometry'],
+            attributes['bands'],
+            attributes['profile'],
+            content_hash=obj['ETag'].strip('"')
+        )
+
+    counts = {ROW_WITHOUT_OBJECT: 0, OBJECT_WITHOUT_ROW: 0, 'fixed': 0, 'errors': 0}
+    batches = {ROW_WITHOUT_OBJECT: [], OBJECT_WITHOUT_ROW: []}
+
+    def apply_fixes(status):
+
+        batch = batches[status]
+        batches[status] = []
+        if len(batch) == 0:
+            return
+
+        if status == ROW_WITHOUT_OBJECT:
+            counts['fixed'] += database.delete_many([(bucket_name, k) for k, _ in batch])
+
+        elif register_orphans:
+            for file_key, obj in batch:
+                try:
+                    register(file_key, obj)
+                    counts['fixed'] += 1
+                except Exception as e:
+                    counts['errors'] += 1
+                    print(f'FAILED  register {bucket_name}/{file_key} : {e}')
+
+        elif delete_orphan_files:
+            errors = cloudstorage.delete_keys(bucket_name, [k for k, _ in batch])
+            for error in errors:
+                print(f"FAILED  delete {bucket_name}/{error['Key']} : {error['Message']}")
+            counts['fixed'] += len(batch) - len(errors)
+            counts['errors'] += len(errors)
+
+    fh = open(out_path, 'w', newline='') if out_path is not None else None
+    try:
+        if fh is not None:
+            writer = csv.writer(fh)
+            writer.writerow(['status', 'bucket_name', 'file_key'])
+
+        for status, file_key, age_s, obj in merge_sorted_keys(
+                prefetch(database.stream_keys(bucket_name, prefix=prefix)),
+                prefetch(list_objects())
+            ):
+
+            # uploads in progress
+            if age_s < min_age_s:
+                continue
+
+            counts[status] += 1
+            if fh is not None:
+                writer.writerow([status, bucket_name, file_key])
+            else:
+                print(f'{status}  {bucket_name}/{file_key}')
+
+            if fix and (status == ROW_WITHOUT_OBJECT or register_orphans or delete_orphan_files):
+                batches[status].append((file_key, obj))
+                if len(batches[status]) >= DELETE_BATCH_SIZE:
+                    apply_fixes(status)
+
+        if fix:
+            apply_fixes(ROW_WITHOUT_OBJECT)
+            apply_fixes(OBJECT_WITHOUT_ROW)
+
+    finally:
+        if fh is not None:
+            fh.close()
+
+    # inform
+    print(f'{counts[ROW_WITHOUT_OBJECT]} rows without a file, {counts[OBJECT_WITHOUT_ROW]} files without a row')
+    if fix:
+        print(f"{counts['fixed']} fixed, {counts['errors']} errors")
+
+
 def autotest(module_name=None):
     """Runs the unit tests on the modules
 
     Arguments
     ---------
     module_name : str
-        If you want to run the unit tests of a single module, specify the name here (cloudstorage, utils, database)
+        If you want to run the unit tests of a single module, specify the name here (cloudstorage, utils, database, worker, cli)
     """
 
     # validate input
-    valid_module_names = ['cloudstorage', 'utils', 'database', 'config']
+    valid_module_names = ['cloudstorage', 'utils', 'database', 'worker', 'cli', 'config']
     if module_name is not None:
         if not isinstance(module_name, str):
             raise Exception('Module Name must be a string')
@@ -424,10 +1245,24 @@ def autotest(module_name=None):
         os.system('python3 -m gis-packer.tests.database')
 
 
+    def test_worker():
+        # test the worker daemon
+
+        os.system('python3 -m gis-packer.tests.worker')
+
+
+    def test_cli():
+        # test the cli commands
+
+        os.system('python3 -m gis-packer.tests.cli')
+
+
     if module_name is None:
         test_cloudstorage()
         test_utils()
         test_database()
+        test_worker()
+        test_cli()
 
     elif module_name == 'cloudstorage':
         test_cloudstorage()
@@ -438,6 +1273,12 @@ def autotest(module_name=None):
     elif module_name == 'database':
         test_database()
 
+    elif module_name == 'worker':
+        test_worker()
+
+    elif module_name == 'cli':
+        test_cli()
+
     else:
         raise Exception('Invalid module name')
 
@@ -459,11 +1300,13 @@ def reproject(file_path, out_path, target_crs=4326):
     if file_path is None or file_path == '' or out_path is None or out_path == '':
         raise Exception('Invalid file path')
 
-    # check if absolute
-    if not os.path.isabs(file_path):
-        raise Exception('Must be an absolute path')
-    if not os.path.isabs(out_path):
-        raise Exception('Must be an absolute path')
+    # check if absolute, the source can also be read from the cloudstorage
+    if not os.path.isabs(file_path) and not is_s3_uri(file_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+    if not os.path.isabs(out_path) and not is_s3_uri(out_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+
+    from ..utils.raster import reproject as img_reproject
 
     img_reproject(file_path, out_path, target_crs=target_crs)
 
@@ -485,11 +1328,13 @@ def select_bands(file_path, out_path):
     if file_path is None or file_path == '' or out_path is None or out_path == '':
         raise Exception('Invalid file path')
 
-    # check if absolute
-    if not os.path.isabs(file_path):
-        raise Exception('Must be an absolute path')
-    if not os.path.isabs(out_path):
-        raise Exception('Must be an absolute path')
+    # check if absolute, the source can also be read from the cloudstorage
+    if not os.path.isabs(file_path) and not is_s3_uri(file_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+    if not os.path.isabs(out_path) and not is_s3_uri(out_path):
+        raise Exception('Must be an absolute path or a s3:// uri')
+
+    from ..utils.raster import bands_info, select_bands as img_select_bands
 
     # grab bands info
     bands_dict = bands_info(file_path)
@@ -540,5 +1385,7 @@ def create_aws_lambda_layer(req_path, out_path, bucket_name=None, file_key=None)
     if not os.path.isabs(out_path):
         raise Exception('Must be an absolute path')
 
+    from ..aws.Lambda.layers import create as create_lambda_layer
+
     # run
     create_lambda_layer(req_path, out_path, bucket_name=bucket_name, file_key=file_key)
@@ -0,0 +1,399 @@
+"""
+    Runs the jobs of a job file on a process pool, with retries and a manifest of the completed jobs
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+import traceback
+import multiprocessing
+from collections import deque
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# available memory, capped by the container limit
+from ..utils.basic import get_available_memory, get_iso_timestamp
+
+
+# operation of a job -> api function, the other keys of the job are the arguments of the function
+OPERATIONS = {
+    'to-uint8': 'to_uint8',
+    'compress': 'compress',
+    'reproject': 'reproject',
+    'create-tiles': 'create_tiles',
+    'quicklook': 'quicklook',
+    'unstack-bands': 'unstack_bands'
+}
+
+# job statuses in the manifest
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# reported to on_result when a job is queued again, never recorded
+STATUS_RETRY = 'retry'
+
+# a job holds about the input array, an intermediate array and the output buffer
+MEMORY_FACTOR = 3
+
+# share of the available memory the batch can use
+MEMORY_FRACTION = 0.8
+
+# memory a worker process holds once rasterio, geopandas, boto3, ... are imported, whatever its job
+WORKER_BASELINE_MEMORY = 300 * 1024 * 1024
+
+# errors worth a retry, by class name since boto3, SQLAlchemy and rasterio are not imported here
+TRANSIENT_ERROR_NAMES = set([
+    'EndpointConnectionError',
+    'ConnectTimeoutError',
+    'ReadTimeoutError',
+    'ConnectionClosedError',
+    'IncompleteReadError',
+    'OperationalError',
+    'CPLE_HttpResponseError',
+    'CPLE_AWSError'
+])
+TRANSIENT_ERROR_CODES = set(['SlowDown', 'RequestTimeout', 'InternalError', 'ServiceUnavailable', 'Throttling', '500', '503'])
+
+# errors of the inputs, never transient
+PERMANENT_OS_ERRORS = (FileNotFoundError, FileExistsError, PermissionError, IsADirectoryError, NotADirectoryError)
+
+
+def get_job_id(job):
+    """
+        Returns the id of a job, its 'id' key or a hash of its content
+    """
+
+    if 'id' in job:
+        return str(job['id'])
+
+    return hashlib.sha256(json.dumps(job, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def load_jobs(jobs_path):
+    """Reads a job file, one json object per line with the operation and the arguments of the api function
+
+    e.g. {"operation": "reproject", "file_path": "/data/a.tif", "out_path": "/data/a_4326.tif", "target_crs": 4326}
+
+    Arguments
+    ---------
+    jobs_path : str
+        Path to the job file
+
+    Returns
+    -------
+    jobs : list
+        List of (job_id, job) tuples, in the order of the file
+    """
+
+    jobs = []
+    job_ids = set()
+    with open(jobs_path, 'r') as fh:
+        for i, line in enumerate(fh):
+
+            if line.strip() == '':
+                continue
+
+            try:
+                job = json.loads(line)
+            except ValueError:
+                raise Exception(f'Invalid json on line {i+1} of {jobs_path}')
+
+            if not isinstance(job, dict) or job.get('operation') not in OPERATIONS:
+                raise Exception(f'Invalid operation on line {i+1}, must be one of : {list(OPERATIONS.keys())}')
+
+            job_id = get_job_id(job)
+            if job_id in job_ids:
+                raise Exception(f'Duplicate job {job_id} on line {i+1}')
+
+            job_ids.add(job_id)
+            jobs.append((job_id, job))
+
+    return jobs
+
+
+def load_manifest(manifest_path):
+    """
+        Returns the last status of each job recorded in the manifest, a line cut by a crash is ignored
+    """
+
+    statuses = {}
+    if not os.path.exists(manifest_path):
+        return statuses
+
+    with open(manifest_path, 'r') as fh:
+        for line in fh:
+            try:
+                entry = json.loads(line)
+                statuses[entry['id']] = entry['status']
+            except (ValueError, KeyError):
+                continue
+
+    return statuses
+
+
+class Manifest:
+    """
+        Append-only json lines file recording the status of each finished job, every entry is synced to disk
+    """
+
+    def __init__(self, manifest_path):
+        self._fh = open(manifest_path, 'a')
+
+
+    def record(self, job_id, status, attempts, seconds, error=None):
+        entry = {
+            'id': job_id,
+            'status': status,
+            'attempts': attempts,
+            'seconds': round(seconds, 3),
+            'error': error,
+            'timestamp': get_iso_timestamp()
+        }
+        self._fh.write(json.dumps(entry) + '\n')
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+
+    def close(self):
+        self._fh.close()
+
+
+def is_transient(e):
+    """
+        Returns true if an exception, or the exception it was raised from, is a network or database error worth a retry
+    """
+
+    while e is not None:
+
+        if isinstance(e, PERMANENT_OS_ERRORS):
+            return False
+
+        if isinstance(e, (ConnectionError, TimeoutError)):
+            return True
+
+        if type(e).__name__ in TRANSIENT_ERROR_NAMES:
+            return True
+
+        # botocore ClientError
+        response = getattr(e, 'response', None)
+        if isinstance(response, dict) and str(response.get('Error', {}).get('Code')) in TRANSIENT_ERROR_CODES:
+            return True
+
+        e = e.__cause__ or e.__context__
+
+    return False
+
+
+def run_job(operation, kwargs):
+    """Runs one job in a worker process
+
+    Arguments
+    ---------
+    operation : str
+        Operation of the job, see OPERATIONS
+    kwargs : dict
+        Arguments of the api function
+
+    Returns
+    -------
+    result : dict
+        success, error, whether the error is transient, and the duration in seconds
+    """
+
+    from . import api
+
+    start = time.time()
+    result = {'success': False, 'error': None, 'transient': False, 'seconds': 0.0}
+
+    try:
+        # the output of the operations would interleave
+        with redirect_stdout(io.StringIO()):
+            getattr(api, OPERATIONS[operation])(**kwargs)
+        result['success'] = True
+
+    except Exception as e:
+        result['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        result['transient'] = is_transient(e)
+
+    result['seconds'] = time.time() - start
+
+    return result
+
+
+def to_kwargs(job):
+    """
+        Returns the arguments of the api function of a job, json lists are given as tuples
+    """
+    return {k: tuple(v) if isinstance(v, list) else v for k, v in job.items() if k not in ('id', 'operation')}
+
+
+def estimate_memory(job):
+    """
+        Returns the memory in bytes a job is expected to use, 0 if its input cannot be read
+    """
+
+    from ..utils.raster import get_array_size
+
+    try:
+        return MEMORY_FACTOR * get_array_size(job['file_path'])
+    except Exception:
+        return 0
+
+
+def run_batch(jobs_path, manifest_path=None, max_workers=None, max_memory=None, max_retries=3, on_result=None):
+    """Runs the jobs of a job file that are not done yet according to the manifest
+
+    Jobs are started in the order of the file while the memory they are expected to use fits in the
+    budget left by the worker processes themselves (a job is always started if nothing is running), the
+    memory of a job is estimated when it is about to start. Transient failures (network, database, or a
+    worker process killed, e.g. out of memory) are retried with an exponential backoff, the other failures
+    are final.
+
+    Arguments
+    ---------
+    jobs_path : str
+        Path to the job file, see load_jobs
+    manifest_path : str
+        Path to the manifest, defaults to the job file path followed by .manifest
+    max_workers : int
+        Number of worker processes, defaults to the number of cpus, fewer if their imports would take
+        more than half of max_memory
+    max_memory : int
+        Memory budget in bytes of the worker processes and their jobs, defaults to 80% of the available memory
+    max_retries : int
+        Number of times a transient failure is retried
+    on_result : function
+        Called as on_result(job_id, job, status, result) after each attempt, status is 'done', 'failed' or 'retry'
+
+    Returns
+    -------
+    report : dict
+        Number of jobs done, failed and skipped (already done)
+    """
+
+    jobs = load_jobs(jobs_path)
+
+    if manifest_path is None:
+        manifest_path = f'{jobs_path}.manifest'
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_memory is None:
+        max_memory = int(MEMORY_FRACTION * get_available_memory())
+
+    if max_workers < 1 or max_memory < 0 or max_retries < 0:
+        raise Exception('Invalid batch limits')
+
+    # the worker processes hold their imports whatever the jobs
+    max_workers = max(1, min(max_workers, max_memory // (2 * WORKER_BASELINE_MEMORY)))
+    max_memory = max(0, max_memory - max_workers * WORKER_BASELINE_MEMORY)
+
+    # skip the completed jobs
+    statuses = load_manifest(manifest_path)
+    report = {'done': 0, 'failed': 0, 'skipped': 0}
+
+    # job id, job, memory estimate (None until the job is about to start), attempt, time before which it must not start
+    pending = deque()
+    for job_id, job in jobs:
+        if statuses.get(job_id) == STATUS_DONE:
+            report['skipped'] += 1
+        else:
+            pending.append((job_id, job, None, 1, 0.0))
+
+    if len(pending) == 0:
+        return report
+
+    # the workers import rasterio, boto3, ... themselves, a fork would share the connections of this process
+    mp_context = multiprocessing.get_context('spawn')
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context)
+    manifest = Manifest(manifest_path)
+
+    running = {}
+    used_memory = 0
+
+    def finish(entry, result):
+
+        job_id, job, memory, attempt, _ = entry
+
+        if result['success']:
+            status = STATUS_DONE
+        elif result['transient'] and attempt <= max_retries:
+            status = STATUS_RETRY
+            pending.append((job_id, job, memory, attempt + 1, time.time() + min(2 ** attempt, 60)))
+        else:
+            status = STATUS_FAILED
+
+        if status != STATUS_RETRY:
+            manifest.record(job_id, status, attempt, result['seconds'], error=result['error'])
+            report[status] += 1
+
+        if on_result is not None:
+            on_result(job_id, job, status, result)
+
+    try:
+        while len(pending) > 0 or len(running) > 0:
+
+            # start the jobs that fit
+            now = time.time()
+            for _ in range(0, len(pending)):
+                if len(running) >= max_workers:
+                    break
+
+                entry = pending.popleft()
+                if entry[4] > now:
+                    pending.append(entry)
+                    continue
+
+                # opening the input can take a request, only done once per job
+                if entry[2] is None:
+                    entry = (entry[0], entry[1], estimate_memory(entry[1]), entry[3], entry[4])
+
+                # wait for memory, the jobs behind do not overtake this one
+                memory = entry[2]
+                if len(running) > 0 and used_memory + memory > max_memory:
+                    pending.appendleft(entry)
+                    break
+
+                future = executor.submit(run_job, entry[1]['operation'], to_kwargs(entry[1]))
+                running[future] = entry
+                used_memory += memory
+
+            # only jobs waiting for a retry
+            if len(running) == 0:
+                time.sleep(max(0.0, min([e[4] for e in pending]) - time.time()))
+                continue
+
+            done, _ = wait(list(running.keys()), timeout=1.0, return_when=FIRST_COMPLETED)
+
+            broken = False
+            for future in done:
+                entry = running.pop(future)
+                used_memory -= entry[2]
+
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    result = {'success': False, 'error': 'Worker process died, out of memory?', 'transient': True, 'seconds': 0.0}
+
+                finish(entry, result)
+
+            # a dead worker breaks the whole pool, its jobs are retried on a new one
+            if broken:
+                for future, entry in list(running.items()):
+                    running.pop(future)
+                    used_memory -= entry[2]
+                    finish(entry, {'success': False, 'error': 'Worker process died, out of memory?', 'transient': True, 'seconds': 0.0})
+
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context)
+
+    finally:
+        executor.shutdown(wait=True)
+        manifest.close()
+
+    return report
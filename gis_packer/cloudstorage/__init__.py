@@ -1,13 +1,46 @@
 import sys
 import os
+import math
+import time
+import threading
+import functools
 import boto3
 
-import numpy as np
-import pandas as pd
-import geopandas as gpd
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig, create_transfer_manager, ProgressCallbackInvoker
+from s3transfer.subscribers import BaseSubscriber
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 # config file interface
-from ..config import get_config, AWS_ACCESS_ID_KEY, AWS_ACCESS_SECRET_KEY, AWS_REGION_KEY
+from ..config import get_config, to_bool, AWS_ACCESS_ID_KEY, AWS_ACCESS_SECRET_KEY, AWS_REGION_KEY
+from ..config import S3_MULTIPART_THRESHOLD_MB_KEY, S3_MULTIPART_CHUNKSIZE_MB_KEY, S3_MAX_CONCURRENCY_KEY, S3_USE_THREADS_KEY, S3_MAX_WORKERS_KEY
+from ..config import DOWNLOAD_CACHE_DIR_KEY, DOWNLOAD_CACHE_MAX_GB_KEY, TRANSFER_CHECKPOINT_DIR_KEY, S3_ENDPOINT_URL_KEY, LOCAL_BUCKETS_KEY
+from ..config import TRANSFER_MAX_MB_PER_S_KEY, TRANSFER_BURST_MB_KEY, TRANSFER_BANDWIDTH_STATE_PATH_KEY, TRANSFER_ORDER_KEY
+
+from ..utils.basic import get_uuid, get_bytes_content_hash
+
+# local cache of the downloaded files
+from .cache import DownloadCache
+
+# diff of a local directory and a prefix
+from .sync import list_local_files, is_different, SYNC_UPLOAD, SYNC_DIRECTIONS, COMPARE_SIZE, COMPARE_ETAG, COMPARE_MODES
+
+# state of the resumable transfers
+from .checkpoint import Checkpoint, get_part_size, get_upload_checkpoint_path, get_download_checkpoint_paths
+
+# buckets stored on the filesystem
+from .local import LocalStorage
+
+# bandwidth limit, priorities and ordering of the transfers
+from .scheduler import TransferScheduler, get_order, PRIORITY_INTERACTIVE, PRIORITY_BATCH, ORDER_FIFO, ORDERS
+
+# bytes in a megabyte
+MB = 1024 * 1024
+
+# max number of keys in a delete_objects request
+DELETE_BATCH_SIZE = 1000
 
 
 __cloudstorage = None
@@ -20,9 +53,116 @@ def get_cloudstorage():
     return __cloudstorage
 
 
+def route_local_buckets(func):
+    """
+        Decorator sending the call of a CloudStorage method to the LocalStorage method of the same name
+        when the bucket, first argument of the method, is a local bucket
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, bucket_name, *args, **kwargs):
+        if self.local_storage.is_local(bucket_name):
+            return getattr(self.local_storage, func.__name__)(bucket_name, *args, **kwargs)
+        return func(self, bucket_name, *args, **kwargs)
+
+    return wrapper
+
+
+def scheduled(func):
+    """
+        Decorator counting a call of a CloudStorage transfer method in the scheduler metrics of its priority class,
+        given by the priority keyword argument (interactive by default)
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.scheduler.transfer(kwargs.get('priority', PRIORITY_INTERACTIVE)):
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+class TransferSize(BaseSubscriber):
+    """
+        Subscriber giving the size of the object to a transfer, so s3transfer does not request it with its own HEAD
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+
+    def on_queued(self, future, **kwargs):
+        future.meta.provide_transfer_size(self.size)
+
+
+class TransferProgress:
+    """
+        Thread-safe progress bar of a transfer, redrawn at most every min_interval_s seconds (never if out is None)
+    """
+
+    def __init__(self, filesize, min_interval_s=0.2, out=sys.stdout):
+
+        self.filesize = filesize
+        self.min_interval_s = min_interval_s
+        self.out = out
+
+        # runtime var
+        self.transferred = 0
+        self.start = time.time()
+        self._last_render = 0
+        self._lock = threading.Lock()
+
+
+    def __call__(self, chunk):
+        """ Callback called by boto3's transfer threads with the number of bytes transferred """
+
+        with self._lock:
+            self.transferred += chunk
+
+            now = time.time()
+            if now - self._last_render < self.min_interval_s and self.transferred < self.filesize:
+                return
+
+            self._last_render = now
+            if self.out is not None:
+                self.render()
+
+
+    def elapsed(self):
+        """ Returns the seconds since the transfer started """
+        return time.time() - self.start
+
+
+    def throughput(self):
+        """ Returns the average throughput in MB/s """
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return self.transferred / MB / elapsed
+
+
+    def render(self):
+        """ Draws the progress bar """
+
+        done = int(50 * self.transferred / self.filesize) if self.filesize > 0 else 50
+        bytes_done = f'{round(self.transferred/MB, 2)}/{round(self.filesize/MB, 2)} mb'
+        self.out.write("\r[%s%s] %s %.2f MB/s" % ('=' * done, ' ' * (50-done), bytes_done, self.throughput()))
+        self.out.flush()
+
+
+    def stats(self):
+        """ Returns the number of bytes transferred, the duration and the throughput """
+        return {
+            'bytes': self.transferred,
+            'seconds': self.elapsed(),
+            'mb_per_s': self.throughput()
+        }
+
+
 class CloudStorage:
     """
-        Class to interact with our AWS S3 cloud storage
+        Class to interact with our AWS S3 cloud storage, the buckets listed in the LOCAL_BUCKETS config
+        (bucket name -> root directory) are stored on the filesystem by a LocalStorage instead
     """
 
     def __init__(self):
@@ -33,16 +173,59 @@ class CloudStorage:
         AWS_ACCESS_SECRET = config[AWS_ACCESS_SECRET_KEY]
         AWS_REGION = config[AWS_REGION_KEY]
 
-        # runtime var
-        self._downloaded = 0
-        self._uploaded = 0
+        # multipart transfers settings
+        self.transfer_config = TransferConfig(
+            multipart_threshold=int(float(config[S3_MULTIPART_THRESHOLD_MB_KEY]) * MB),
+            multipart_chunksize=int(float(config[S3_MULTIPART_CHUNKSIZE_MB_KEY]) * MB),
+            max_concurrency=int(config[S3_MAX_CONCURRENCY_KEY]),
+            use_threads=to_bool(config[S3_USE_THREADS_KEY])
+        )
 
-        # init s3 bucket
+        # number of objects transferred at the same time by get_many/post_many
+        self.max_workers = int(config[S3_MAX_WORKERS_KEY])
+
+        # local cache of the downloaded files, disabled if no directory is configured
+        self.download_cache = None
+        if config[DOWNLOAD_CACHE_DIR_KEY] is not None:
+            self.download_cache = DownloadCache(
+                config[DOWNLOAD_CACHE_DIR_KEY],
+                int(float(config[DOWNLOAD_CACHE_MAX_GB_KEY]) * 1024 * MB)
+            )
+
+        # where the state of the resumable uploads is saved
+        self.checkpoint_dir = config[TRANSFER_CHECKPOINT_DIR_KEY]
+
+        # every transfer goes through the scheduler, the bandwidth is unlimited if no limit is configured,
+        # the limit is shared with the other processes of the host through the state file
+        max_mb_per_s = config[TRANSFER_MAX_MB_PER_S_KEY]
+        burst_mb = config[TRANSFER_BURST_MB_KEY]
+        self.scheduler = TransferScheduler(
+            max_bytes_per_s=int(float(max_mb_per_s) * MB) if max_mb_per_s is not None else None,
+            burst_bytes=int(float(burst_mb) * MB) if burst_mb is not None else None,
+            state_path=config[TRANSFER_BANDWIDTH_STATE_PATH_KEY] if max_mb_per_s is not None else None
+        )
+
+        # order in which the files of get_many/post_many/sync are started
+        self.order = config[TRANSFER_ORDER_KEY]
+        if self.order not in ORDERS:
+            raise Exception(f'{TRANSFER_ORDER_KEY} must be one of : {ORDERS}')
+
+        # buckets on a local or shared filesystem
+        self.local_storage = LocalStorage(
+            config[LOCAL_BUCKETS_KEY] or {},
+            self.transfer_config.multipart_threshold,
+            self.transfer_config.multipart_chunksize
+        )
+
+        # init s3 bucket, with enough connections for every transfer thread: get_many/post_many run
+        # max_workers transfers, each with up to max_concurrency threads
         self._cloudstorage = boto3.client(
             's3',
             aws_access_key_id = AWS_ACCESS_ID,
             aws_secret_access_key = AWS_ACCESS_SECRET,
             region_name = AWS_REGION,
+            endpoint_url = config[S3_ENDPOINT_URL_KEY],
+            config = Config(max_pool_connections=max(10, self.max_workers * self.transfer_config.max_concurrency))
         )
 
 
@@ -52,8 +235,20 @@ class CloudStorage:
             raise Exception('invalid input')
 
 
-    def does_file_exists_in_cloudstorage(self, bucket_name, file_key):
-        """ Checks if file exists in the cloudstorage
+    def get_local_path(self, bucket_name, file_key):
+        """
+            Returns the path of a file of a local bucket, None if the bucket is in S3
+        """
+
+        if not self.local_storage.is_local(bucket_name):
+            return None
+
+        return self.local_storage.get_path(bucket_name, file_key)
+
+
+    @route_local_buckets
+    def head(self, bucket_name, file_key):
+        """Returns the metadata of a file in the cloudstorage
 
         Arguments
         ---------
@@ -64,31 +259,147 @@ class CloudStorage:
 
         Returns
         -------
-        success : bool
-            Returns true if the file exists
+        metadata : dict
+            Response of the HEAD request (ContentLength, ETag, ...), None if the file does not exist
         """
 
         # validate input
         self.validate_input(bucket_name, file_key)
 
-        # init
-        filesize = None
-
-        # check if file already exists in the bucket
         try:
-            filesize = self._cloudstorage.head_object(
+            return self._cloudstorage.head_object(
                 Bucket=bucket_name,
                 Key=file_key
-            ).get('ContentLength', 0)
+            )
 
         except:
+            return None
+
+
+    def does_file_exists_in_cloudstorage(self, bucket_name, file_key):
+        """ Checks if file exists in the cloudstorage
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        file_key : str
+            Key of the file
+
+        Returns
+        -------
+        success : bool
+            Returns true if the file exists
+        """
+
+        # check if file already exists in the bucket
+        metadata = self.head(bucket_name, file_key)
+        if metadata is None:
             return False
 
-        return isinstance(filesize, int)
+        return isinstance(metadata.get('ContentLength', 0), int)
 
 
-    def get(self, bucket_name, file_key, out_path):
-        """Downloads a file on the host machine
+    @route_local_buckets
+    def list(self, bucket_name, prefix=''):
+        """Lists the files of a bucket whose key starts with a prefix
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        prefix : str
+            Prefix of the file keys
+
+        Returns
+        -------
+        generator of dict
+            Key, Size, ETag and LastModified of each file
+        """
+
+        if bucket_name is None or not isinstance(bucket_name, str) or bucket_name == '':
+            raise Exception('invalid input')
+
+        paginator = self._cloudstorage.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj
+
+
+    @route_local_buckets
+    def list_parallel(self, bucket_name, prefix='', max_workers=None):
+        """Lists the files of a bucket whose key starts with a prefix, the sub-prefixes are listed concurrently
+
+        The prefix is first listed with a / delimiter, then each sub-prefix (e.g. each scene of a tiles
+        prefix) is paginated in its own thread
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        prefix : str
+            Prefix of the file keys
+        max_workers : int
+            Number of sub-prefixes listed at the same time, defaults to the S3_MAX_WORKERS config
+
+        Returns
+        -------
+        files : dict
+            Key -> (size, LastModified timestamp, ETag without quotes)
+        """
+
+        if bucket_name is None or not isinstance(bucket_name, str) or bucket_name == '':
+            raise Exception('invalid input')
+
+        if max_workers is None:
+            max_workers = self.max_workers
+
+        def to_tuple(obj):
+            return (obj['Size'], obj['LastModified'].timestamp(), obj['ETag'].strip('"'))
+
+        # files directly under the prefix and sub-prefixes
+        files = {}
+        sub_prefixes = []
+        paginator = self._cloudstorage.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter='/'):
+            for obj in page.get('Contents', []):
+                files[obj['Key']] = to_tuple(obj)
+            for common_prefix in page.get('CommonPrefixes', []):
+                sub_prefixes.append(common_prefix['Prefix'])
+
+        def list_sub_prefix(sub_prefix):
+            return {obj['Key']: to_tuple(obj) for obj in self.list(bucket_name, prefix=sub_prefix)}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for sub_files in executor.map(list_sub_prefix, sub_prefixes):
+                files.update(sub_files)
+
+        return files
+
+
+    def download_fileobj(self, bucket_name, file_key, fh, filesize, callback):
+        """
+            Downloads an S3 object into a file object like the client's download_fileobj, without
+            the HEAD request s3transfer would send to find the size of the object
+        """
+
+        with create_transfer_manager(self._cloudstorage, self.transfer_config) as manager:
+            future = manager.download(
+                bucket_name,
+                file_key,
+                fh,
+                subscribers=[TransferSize(filesize), ProgressCallbackInvoker(callback)]
+            )
+            future.result()
+
+
+    @route_local_buckets
+    @scheduled
+    def get(self, bucket_name, file_key, out_path, show_progress=True, use_cache=True, priority=PRIORITY_INTERACTIVE, metadata=None):
+        """Downloads a file on the host machine, with a single HEAD request (none if metadata is given)
+
+        If the download cache is configured, a file whose cached copy still has the same ETag
+        (checked with a conditional HEAD) is copied to out_path instead of being downloaded
 
         Arguments
         ---------
@@ -98,50 +409,120 @@ class CloudStorage:
             Key of the file
         out_path : str
             Path where to save the file
+        show_progress : bool
+            If true draws a progress bar on stdout
+        use_cache : bool
+            If false the download cache is bypassed
+        priority : str
+            'interactive' or 'batch', the batch transfers give the bandwidth to the interactive ones
+        metadata : dict
+            Response of a HEAD of the file already made by the caller, see head
+
+        Returns
+        -------
+        stats : dict
+            Bytes transferred, duration in seconds, throughput in MB/s and whether the cache was hit
         """
 
         # validate input
         self.validate_input(bucket_name, file_key)
 
-        # reset
-        self._downloaded = 0
-
         # check if we already have this file
         if os.path.exists(out_path):
             raise Exception('File already in local storage')
 
-        # check if the file exists in the cloudstorage
-        if not self.does_file_exists_in_cloudstorage(bucket_name, file_key):
+        start = time.time()
+        cache = self.download_cache if use_cache else None
+
+        # check if the file exists in the cloudstorage and grab its size,
+        # the HEAD is conditional on the ETag of the cached copy if any
+        cached_etag = None
+        if cache is not None:
+            cached_etag = cache.get_etag(bucket_name, file_key)
+
+        # the caller already has the ETag
+        if metadata is not None:
+            if cached_etag is not None and metadata.get('ETag', None) == cached_etag and cache.fetch(bucket_name, file_key, cached_etag, out_path):
+                return {
+                    'bytes': 0,
+                    'seconds': time.time() - start,
+                    'mb_per_s': 0.0,
+                    'cached': True
+                }
+
+        elif cached_etag is not None:
+            try:
+                metadata = self._cloudstorage.head_object(Bucket=bucket_name, Key=file_key, IfNoneMatch=cached_etag)
+
+            except ClientError as e:
+
+                if e.response.get('Error', {}).get('Code') != '304':
+                    metadata = None
+
+                # the cached copy is up to date
+                elif cache.fetch(bucket_name, file_key, cached_etag, out_path):
+                    return {
+                        'bytes': 0,
+                        'seconds': time.time() - start,
+                        'mb_per_s': 0.0,
+                        'cached': True
+                    }
+
+                # evicted since, download it again
+                else:
+                    metadata = self.head(bucket_name, file_key)
+
+            except:
+                metadata = None
+
+        else:
+            metadata = self.head(bucket_name, file_key)
+
+        if metadata is None:
             raise Exception('File does not exists in the cloudstorage')
 
-        # grab file size
-        filesize = self._cloudstorage.head_object(
-            Bucket=bucket_name,
-            Key=file_key
-        ).get('ContentLength', 0)
+        filesize = metadata.get('ContentLength', 0)
+        etag = metadata.get('ETag', None)
+
+        # download into the cache when possible
+        download_path = out_path
+        if cache is not None and etag is not None:
+            download_path = cache.tmp_path()
 
         # init progress func
-        def progress(chunk):
-            self._downloaded += chunk
-            done = int(50 * self._downloaded / filesize)
-            bytes_done = f'{round((self._downloaded)/(1024.0*1024.0), 2)}/{round((filesize)/(1024.0*1024.0), 2)} mb'
-            sys.stdout.write("\r[%s%s] %s" % ('=' * done, ' ' * (50-done), bytes_done))
-            sys.stdout.flush()
+        progress = TransferProgress(filesize, out=sys.stdout if show_progress else None)
 
         # save file to root dir
-        with open(out_path, 'wb') as fh:
-            self._cloudstorage.download_fileobj(
-                bucket_name,
-                file_key,
-                fh,
-                Callback=progress
-            )
+        try:
+            with open(download_path, 'wb') as fh:
+                self.download_fileobj(bucket_name, file_key, fh, filesize, self.scheduler.callback(priority, progress))
+
+        except:
+            if download_path != out_path and os.path.exists(download_path):
+                os.remove(download_path)
+            raise
+
+        # copy to the output path and add to the cache
+        if download_path != out_path:
+            try:
+                cache.add(bucket_name, file_key, etag, download_path, out_path=out_path)
+            finally:
+                if os.path.exists(download_path):
+                    os.remove(download_path)
 
         # skip line
-        print('\n')
+        if show_progress:
+            print('\n')
+
+        stats = progress.stats()
+        stats['cached'] = False
+
+        return stats
 
 
-    def post(self, bucket_name, file_key, src_path):
+    @route_local_buckets
+    @scheduled
+    def post(self, bucket_name, file_key, src_path, show_progress=True, overwrite=False, priority=PRIORITY_INTERACTIVE):
         """Uploads a file from the host machine to the cloudstorage
 
         Arguments
@@ -152,6 +533,17 @@ class CloudStorage:
             Key we want to give to the file
         src_path : str
             Path to the file we want to upload
+        show_progress : bool
+            If true draws a progress bar on stdout
+        overwrite : bool
+            If true an existing file with the same key is replaced instead of raising
+        priority : str
+            'interactive' or 'batch', see get
+
+        Returns
+        -------
+        stats : dict
+            Bytes transferred, duration in seconds and throughput in MB/s
         """
 
         # validate input
@@ -165,36 +557,736 @@ class CloudStorage:
         if not os.path.exists(src_path):
             raise Exception(f'File not found at {src_path}')
 
-        # reset
-        self._uploaded = 0
-
         # grab file size in bytes
         filesize = os.path.getsize(src_path)
 
         # check if the file exists in the cloudstorage
-        if self.does_file_exists_in_cloudstorage(bucket_name, file_key):
+        if not overwrite and self.does_file_exists_in_cloudstorage(bucket_name, file_key):
             raise Exception('File already exists in the cloudstorage')
 
         # init progress func
-        def progress(chunk):
-            self._uploaded += chunk
-            done = int(50 * self._uploaded / filesize)
-            bytes_done = f'{round((self._uploaded)/(1024.0*1024.0), 2)}/{round((filesize)/(1024.0*1024.0), 2)} mb'
-            sys.stdout.write("\r[%s%s] %s" % ('=' * done, ' ' * (50-done), bytes_done))
-            sys.stdout.flush()
+        progress = TransferProgress(filesize, out=sys.stdout if show_progress else None)
 
         # save file to root dir
         self._cloudstorage.upload_file(
             src_path,
             bucket_name,
             file_key,
-            Callback=progress
+            Callback=self.scheduler.callback(priority, progress),
+            Config=self.transfer_config
         )
 
         # skip line
-        print('\n')
+        if show_progress:
+            print('\n')
+
+        return progress.stats()
+
+
+    @route_local_buckets
+    @scheduled
+    def post_bytes(self, bucket_name, file_key, content, priority=PRIORITY_INTERACTIVE):
+        """Uploads an in-memory file to the cloudstorage, in a single request
+
+        Unlike post, an existing file is overwritten, like a local file written by utils.raster
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket we want to upload to
+        file_key : str
+            Key we want to give to the file
+        content : bytes
+            Content of the file
+        priority : str
+            'interactive' or 'batch', see get
+
+        Returns
+        -------
+        stats : dict
+            Bytes transferred, duration in seconds, throughput in MB/s, ETag of the file and its content hash,
+            see utils.basic.get_content_hash (the ETag of a single request upload is always a plain md5)
+        """
+
+        # validate input
+        self.validate_input(bucket_name, file_key)
+
+        if not isinstance(content, (bytes, bytearray)):
+            raise Exception('Content must be bytes')
+
+        start = time.time()
+
+        # wait for the bandwidth
+        self.scheduler.throttle(len(content), priority)
+
+        response = self._cloudstorage.put_object(
+            Bucket=bucket_name,
+            Key=file_key,
+            Body=content
+        )
+
+        seconds = time.time() - start
+        return {
+            'bytes': len(content),
+            'seconds': seconds,
+            'mb_per_s': len(content) / MB / seconds if seconds > 0 else 0.0,
+            'etag': response['ETag'].strip('"'),
+            'content_hash': get_bytes_content_hash(
+                content,
+                multipart_threshold=self.transfer_config.multipart_threshold,
+                multipart_chunksize=self.transfer_config.multipart_chunksize
+            )
+        }
+
+
+    @route_local_buckets
+    @scheduled
+    def get_resumable(self, bucket_name, file_key, out_path, show_progress=True, max_retries=5, priority=PRIORITY_INTERACTIVE):
+        """Downloads a file with ranged requests, resuming an interrupted download of the same file
+
+        The file is written to out_path.part and the number of bytes safely on disk is saved in
+        out_path.part.json. A download interrupted (or still failing after max_retries retries)
+        continues from there when started again, unless the file changed in the cloudstorage.
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        file_key : str
+            Key of the file
+        out_path : str
+            Path where to save the file
+        show_progress : bool
+            If true draws a progress bar on stdout
+        max_retries : int
+            Number of times the download is continued after a network error before giving up
+        priority : str
+            'interactive' or 'batch', see get
+
+        Returns
+        -------
+        stats : dict
+            Bytes transferred, duration in seconds, throughput in MB/s and the offset the download resumed from
+        """
+
+        # validate input
+        self.validate_input(bucket_name, file_key)
+
+        # check if we already have this file
+        if os.path.exists(out_path):
+            raise Exception('File already in local storage')
+
+        # check if the file exists in the cloudstorage and grab its version
+        metadata = self.head(bucket_name, file_key)
+        if metadata is None:
+            raise Exception('File does not exists in the cloudstorage')
+
+        filesize = metadata['ContentLength']
+        etag = metadata['ETag']
+
+        partial_path, checkpoint_path = get_download_checkpoint_paths(out_path)
+        checkpoint = Checkpoint(checkpoint_path)
+
+        # continue from the checkpoint if it is for the same version of the file
+        offset = 0
+        state = checkpoint.load()
+        if state is not None and os.path.exists(partial_path) and \
+                (state.get('bucket_name'), state.get('file_key'), state.get('etag')) == (bucket_name, file_key, etag):
+            offset = min(int(state['offset']), os.path.getsize(partial_path))
+
+        resumed_from = offset
+        state = {
+            'bucket_name': bucket_name,
+            'file_key': file_key,
+            'etag': etag,
+            'size': filesize,
+            'offset': offset
+        }
+        checkpoint.save(state)
+
+        # drop the bytes written after the checkpoint
+        with open(partial_path, 'ab') as fh:
+            fh.truncate(offset)
+
+        # init progress func
+        progress = TransferProgress(filesize - offset, out=sys.stdout if show_progress else None)
+
+        # the progress is saved every part
+        checkpoint_interval = self.transfer_config.multipart_chunksize
+
+        nbr_of_retries = 0
+        with open(partial_path, 'r+b') as fh:
+            fh.seek(offset)
+
+            try:
+                while offset < filesize:
+                    try:
+                        response = self._cloudstorage.get_object(
+                            Bucket=bucket_name,
+                            Key=file_key,
+                            Range=f'bytes={offset}-',
+                            IfMatch=etag
+                        )
+
+                        unsaved = 0
+                        for chunk in response['Body'].iter_chunks(chunk_size=MB):
+                            fh.write(chunk)
+                            offset += len(chunk)
+                            unsaved += len(chunk)
+                            progress(len(chunk))
+                            self.scheduler.throttle(len(chunk), priority)
+
+                            if unsaved >= checkpoint_interval:
+                                fh.flush()
+                                os.fsync(fh.fileno())
+                                state['offset'] = offset
+                                checkpoint.save(state)
+                                unsaved = 0
+
+                    except ClientError as e:
+
+                        # the file was replaced since the download started, the partial file is useless
+                        if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', '412'):
+                            state['offset'] = offset = 0
+                            raise Exception('File changed in the cloudstorage during the download, run it again to restart it')
+
+                        nbr_of_retries += 1
+                        if nbr_of_retries > max_retries:
+                            raise Exception(f'Download interrupted at {offset}/{filesize} bytes, run it again to resume : {e}')
+                        time.sleep(min(2 ** nbr_of_retries, 30))
+
+                    except Exception as e:
+                        nbr_of_retries += 1
+                        if nbr_of_retries > max_retries:
+                            raise Exception(f'Download interrupted at {offset}/{filesize} bytes, run it again to resume : {e}')
+                        time.sleep(min(2 ** nbr_of_retries, 30))
+
+            finally:
+                # save what is on disk, also when interrupted by the user
+                fh.flush()
+                os.fsync(fh.fileno())
+                state['offset'] = offset
+                checkpoint.save(state)
+
+        # move to the output path
+        os.replace(partial_path, out_path)
+        checkpoint.delete()
+
+        # skip line
+        if show_progress:
+            print('\n')
+
+        stats = progress.stats()
+        stats['cached'] = False
+        stats['resumed_from'] = resumed_from
+
+        return stats
+
+
+    @route_local_buckets
+    def list_parts(self, bucket_name, file_key, upload_id):
+        """
+            Returns the parts already uploaded in a multipart upload as a dict part number -> (ETag, size)
+        """
+
+        parts = {}
+        paginator = self._cloudstorage.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=bucket_name, Key=file_key, UploadId=upload_id):
+            for part in page.get('Parts', []):
+                parts[part['PartNumber']] = (part['ETag'], part['Size'])
+
+        return parts
+
+
+    @route_local_buckets
+    @scheduled
+    def post_resumable(self, bucket_name, file_key, src_path, show_progress=True, max_retries=5, priority=PRIORITY_INTERACTIVE):
+        """Uploads a file in parts, resuming an interrupted upload of the same file
+
+        The id of the multipart upload is saved in a checkpoint in the TRANSFER_CHECKPOINT_DIR directory.
+        When started again, the parts already in the cloudstorage are listed and only the missing ones
+        are sent. Files smaller than the multipart threshold are uploaded with post.
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket we want to upload to
+        file_key : str
+            Key we want to give to the file
+        src_path : str
+            Path to the file we want to upload
+        show_progress : bool
+            If true draws a progress bar on stdout
+        max_retries : int
+            Number of times a part is sent again after an error before giving up
+        priority : str
+            'interactive' or 'batch', see get
+
+        Returns
+        -------
+        stats : dict
+            Bytes transferred, duration in seconds, throughput in MB/s and the number of bytes already uploaded
+        """
+
+        # validate input
+        self.validate_input(bucket_name, file_key)
+
+        # validate input
+        if src_path is None or src_path == '':
+            raise Exception('Invalid file path')
+
+        # check if on disk
+        if not os.path.exists(src_path):
+            raise Exception(f'File not found at {src_path}')
+
+        # grab file size in bytes
+        src_stat = os.stat(src_path)
+        filesize = src_stat.st_size
+
+        # nothing worth resuming
+        if filesize < self.transfer_config.multipart_threshold:
+            stats = self.post(bucket_name, file_key, src_path, show_progress=show_progress, priority=priority)
+            stats['resumed_from'] = 0
+            return stats
+
+        # check if the file exists in the cloudstorage
+        if self.does_file_exists_in_cloudstorage(bucket_name, file_key):
+            raise Exception('File already exists in the cloudstorage')
+
+        # same part size as boto3, so the ETag matches utils.basic.get_content_hash
+        part_size = get_part_size(filesize, self.transfer_config.multipart_chunksize)
+        nbr_of_parts = int(math.ceil(filesize / float(part_size)))
+
+        checkpoint = Checkpoint(get_upload_checkpoint_path(self.checkpoint_dir, bucket_name, file_key))
+
+        # continue from the checkpoint if it is for the same, unmodified, file
+        uploaded = {}
+        state = checkpoint.load()
+        if state is not None:
+            same_file = (state.get('src_path'), state.get('size'), state.get('mtime'), state.get('part_size')) == \
+                (os.path.abspath(src_path), filesize, src_stat.st_mtime, part_size)
+
+            try:
+                if same_file:
+                    uploaded = self.list_parts(bucket_name, file_key, state['upload_id'])
+                else:
+                    self._cloudstorage.abort_multipart_upload(Bucket=bucket_name, Key=file_key, UploadId=state['upload_id'])
+                    state = None
+
+            # the upload was aborted or completed
+            except ClientError:
+                state = None
+
+        if state is None:
+            response = self._cloudstorage.create_multipart_upload(Bucket=bucket_name, Key=file_key)
+            state = {
+                'bucket_name': bucket_name,
+                'file_key': file_key,
+                'src_path': os.path.abspath(src_path),
+                'size': filesize,
+                'mtime': src_stat.st_mtime,
+                'part_size': part_size,
+                'upload_id': response['UploadId']
+            }
+            checkpoint.save(state)
+
+        def get_part_length(part_number):
+            return min(part_size, filesize - (part_number - 1) * part_size)
+
+        # keep the parts fully uploaded
+        parts = {n: etag for n, (etag, size) in uploaded.items() if n <= nbr_of_parts and size == get_part_length(n)}
+        missing_parts = [n for n in range(1, nbr_of_parts + 1) if n not in parts]
+        resumed_from = filesize - sum([get_part_length(n) for n in missing_parts])
+
+        # init progress func
+        progress = TransferProgress(filesize - resumed_from, out=sys.stdout if show_progress else None)
+
+        def upload_part(part_number):
+
+            for attempt in range(0, max_retries + 1):
+                try:
+                    with open(src_path, 'rb') as fh:
+                        fh.seek((part_number - 1) * part_size)
+                        body = fh.read(part_size)
+
+                    # wait for the bandwidth
+                    self.scheduler.throttle(len(body), priority)
+
+                    response = self._cloudstorage.upload_part(
+                        Bucket=bucket_name,
+                        Key=file_key,
+                        UploadId=state['upload_id'],
+                        PartNumber=part_number,
+                        Body=body
+                    )
+                    progress(len(body))
+
+                    return part_number, response['ETag']
+
+                except Exception:
+                    if attempt == max_retries:
+                        raise
+                    time.sleep(min(2 ** (attempt + 1), 30))
+
+        # send the missing parts
+        try:
+            with ThreadPoolExecutor(max_workers=self.transfer_config.max_concurrency) as executor:
+                for part_number, etag in executor.map(upload_part, missing_parts):
+                    parts[part_number] = etag
+
+        except Exception as e:
+            raise Exception(f'Upload interrupted with {len(parts)}/{nbr_of_parts} parts sent, run it again to resume : {e}')
+
+        # assemble the file
+        self._cloudstorage.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=file_key,
+            UploadId=state['upload_id'],
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': parts[n]} for n in sorted(parts.keys())]}
+        )
+        checkpoint.delete()
+
+        # skip line
+        if show_progress:
+            print('\n')
+
+        stats = progress.stats()
+        stats['resumed_from'] = resumed_from
+
+        return stats
+
+
+    def run_many(self, func, items, max_workers=None, priority=PRIORITY_BATCH, order=None, sizes=None):
+        """Runs a transfer function on many objects with a bounded thread pool sharing this client
+
+        Arguments
+        ---------
+        func : function
+            Transfer function called as func(bucket_name, file_key, path, show_progress=False, priority=priority)
+        items : list
+            List of (bucket_name, file_key, path) tuples
+        max_workers : int
+            Number of objects transferred at the same time, defaults to the S3_MAX_WORKERS config
+        priority : str
+            'interactive' or 'batch', see get
+        order : str
+            Order in which the objects are started, 'fifo', 'smallest' (first) or 'largest' (first),
+            defaults to the TRANSFER_ORDER config
+        sizes : list
+            Size in bytes of each object, required unless the order is 'fifo'
+
+        Returns
+        -------
+        results : list
+            One dict per item, in the same order, with the bucket_name, file_key, path, success, error and stats
+        """
+
+        if not isinstance(items, list):
+            raise Exception('items must be a list')
+
+        if max_workers is None:
+            max_workers = self.max_workers
+
+        if order is None:
+            order = self.order
+
+        self.scheduler.validate_priority(priority)
+
+        if order != ORDER_FIFO and (sizes is None or len(sizes) != len(items)):
+            raise Exception('sizes must be given for each item to order the transfers')
+
+        def run_one(item):
+
+            bucket_name, file_key, path = item
+            result = {
+                'bucket_name': bucket_name,
+                'file_key': file_key,
+                'path': path,
+                'success': False,
+                'error': None,
+                'stats': None
+            }
+
+            try:
+                result['stats'] = func(bucket_name, file_key, path, show_progress=False, priority=priority)
+                result['success'] = True
+            except Exception as e:
+                result['error'] = str(e)
+
+            return result
+
+        # the pool starts the objects in submission order
+        indices = get_order(sizes, order) if order != ORDER_FIFO else list(range(0, len(items)))
+
+        results = [None] * len(items)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for i, result in zip(indices, executor.map(run_one, [items[i] for i in indices])):
+                results[i] = result
+
+        return results
+
+
+    def get_many(self, items, max_workers=None, priority=PRIORITY_BATCH, order=None, sizes=None):
+        """Downloads many files concurrently, see get and run_many
+
+        Arguments
+        ---------
+        items : list
+            List of (bucket_name, file_key, out_path) tuples
+        max_workers : int
+            Number of files downloaded at the same time
+        priority : str
+            'interactive' or 'batch'
+        order : str
+            'fifo', 'smallest' or 'largest', defaults to the TRANSFER_ORDER config
+        sizes : list
+            Size in bytes of each file, if not given and needed to order the files they are requested with HEAD
+
+        Returns
+        -------
+        results : list
+            One result dict per file
+        """
+
+        if order is None:
+            order = self.order
+
+        if sizes is None and order != ORDER_FIFO:
+            with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+                metadata = list(executor.map(lambda item: self.head(item[0], item[1]), items))
+            sizes = [m['ContentLength'] if m is not None else 0 for m in metadata]
+
+            # get reuses the HEAD responses instead of sending its own
+            metadata = {(item[0], item[1]): m for item, m in zip(items, metadata)}
+            def get(bucket_name, file_key, out_path, **kwargs):
+                return self.get(bucket_name, file_key, out_path, metadata=metadata[(bucket_name, file_key)], **kwargs)
+
+            return self.run_many(get, items, max_workers=max_workers, priority=priority, order=order, sizes=sizes)
+
+        return self.run_many(self.get, items, max_workers=max_workers, priority=priority, order=order, sizes=sizes)
+
+
+    def post_many(self, items, max_workers=None, priority=PRIORITY_BATCH, order=None):
+        """Uploads many files concurrently, see post and run_many
+
+        Arguments
+        ---------
+        items : list
+            List of (bucket_name, file_key, src_path) tuples
+        max_workers : int
+            Number of files uploaded at the same time
+        priority : str
+            'interactive' or 'batch'
+        order : str
+            'fifo', 'smallest' or 'largest', defaults to the TRANSFER_ORDER config
+
+        Returns
+        -------
+        results : list
+            One result dict per file
+        """
+
+        # missing files fail in post
+        sizes = [os.path.getsize(path) if os.path.exists(path) else 0 for _, _, path in items]
+
+        return self.run_many(self.post, items, max_workers=max_workers, priority=priority, order=order, sizes=sizes)
+
+
+    @route_local_buckets
+    def delete_keys(self, bucket_name, file_keys, max_workers=None):
+        """Deletes files from the S3 bucket with delete_objects, 1000 keys per request, requests sent in parallel
+
+        Keys that do not exist are not reported as errors
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        file_keys : list
+            Keys of the files
+        max_workers : int
+            Number of requests sent at the same time, defaults to the S3_MAX_WORKERS config
+
+        Returns
+        -------
+        errors : list
+            Key, Code and Message of each file that could not be deleted
+        """
+
+        if max_workers is None:
+            max_workers = self.max_workers
+
+        def delete_batch(batch):
+
+            try:
+                response = self._cloudstorage.delete_objects(
+                    Bucket=bucket_name,
+                    Delete={'Objects': [{'Key': k} for k in batch], 'Quiet': True}
+                )
+            except Exception as e:
+                return [{'Key': k, 'Code': 'RequestFailed', 'Message': str(e)} for k in batch]
+
+            return response.get('Errors', [])
+
+        batches = [file_keys[i:i+DELETE_BATCH_SIZE] for i in range(0, len(file_keys), DELETE_BATCH_SIZE)]
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch_errors in executor.map(delete_batch, batches):
+                errors += batch_errors
+
+        return errors
+
+
+    def sync(self, local_dir, bucket_name, prefix='', direction=SYNC_UPLOAD, compare=COMPARE_SIZE, delete=False, dry_run=False, max_workers=None, order=None):
+        """Transfers only the files that differ between a local directory and a prefix of the cloudstorage
+
+        The file keys are the prefix followed by the relative paths of the files. Both sides are listed
+        (the cloudstorage with list_parallel), the files missing or different on the destination are
+        transferred concurrently and, if delete is true, the files missing from the source are deleted
+        from the destination. The downloaded files get the LastModified time of their remote copy.
+
+        Arguments
+        ---------
+        local_dir : str
+            Path to the local directory
+        bucket_name : str
+            Name of the AWS S3 bucket
+        prefix : str
+            Prefix of the file keys, empty or ending with /
+        direction : str
+            'upload' (local -> cloudstorage) or 'download' (cloudstorage -> local)
+        compare : str
+            'size', 'mtime' (size and modification time) or 'etag' (content hash), see sync.is_different
+        delete : bool
+            If true the files missing from the source are deleted from the destination
+        dry_run : bool
+            If true nothing is transferred or deleted, the report lists what would be done
+        max_workers : int
+            Number of files transferred at the same time, defaults to the S3_MAX_WORKERS config
+        order : str
+            'fifo', 'smallest' or 'largest', defaults to the TRANSFER_ORDER config
+
+        Returns
+        -------
+        report : dict
+            The transfers (results of run_many, or keys if dry_run), the deleted keys or paths,
+            the delete errors and the number of unchanged files
+        """
+
+        # validate input
+        if direction not in SYNC_DIRECTIONS:
+            raise Exception(f'direction must be one of : {SYNC_DIRECTIONS}')
+
+        if compare not in COMPARE_MODES:
+            raise Exception(f'compare must be one of : {COMPARE_MODES}')
+
+        if prefix != '' and not prefix.endswith('/'):
+            raise Exception('prefix must be empty or end with /')
+
+        if not os.path.isdir(local_dir):
+            if direction == SYNC_UPLOAD:
+                raise Exception(f'Invalid local dir {local_dir}')
+            os.makedirs(local_dir, exist_ok=True)
+
+        # list both sides
+        local_files = {prefix + rel_path: f for rel_path, f in list_local_files(local_dir).items()}
+        remote_files = self.list_parallel(bucket_name, prefix=prefix, max_workers=max_workers)
+
+        # folder placeholders (keys ending with /) are not files
+        if direction != SYNC_UPLOAD:
+            remote_files = {k: f for k, f in remote_files.items() if not k.endswith('/')}
+
+        def to_local_path(file_key):
+
+            # the key must stay inside the local directory
+            parts = file_key[len(prefix):].split('/')
+            if any([p in ('', '.', '..') for p in parts]):
+                raise Exception(f'Invalid file key {file_key}')
+
+            return os.path.join(local_dir, *parts)
+
+        src_files, dst_files = (local_files, remote_files) if direction == SYNC_UPLOAD else (remote_files, local_files)
+
+        # diff
+        to_transfer = []
+        nbr_unchanged = 0
+        for file_key in src_files:
+            if file_key not in dst_files:
+                to_transfer.append(file_key)
+                continue
+
+            # the local buckets only hash a file when its ETag is compared
+            remote_file = remote_files[file_key]
+            if compare == COMPARE_ETAG and remote_file[2] is None and remote_file[0] == local_files[file_key][0]:
+                remote_file = remote_file[:2] + (self.local_storage.get_etag(self.get_local_path(bucket_name, file_key)),)
+
+            if is_different(
+                    to_local_path(file_key),
+                    local_files[file_key],
+                    remote_file,
+                    direction,
+                    compare,
+                    self.transfer_config.multipart_threshold,
+                    self.transfer_config.multipart_chunksize
+                ):
+                to_transfer.append(file_key)
+            else:
+                nbr_unchanged += 1
+
+        to_delete = []
+        if delete:
+            to_delete = sorted([k for k in dst_files if k not in src_files])
+
+        report = {
+            'transfers': sorted(to_transfer),
+            'deleted': to_delete if direction == SYNC_UPLOAD else [to_local_path(k) for k in to_delete],
+            'delete_errors': [],
+            'unchanged': nbr_unchanged
+        }
+
+        if dry_run:
+            return report
+
+        # transfer
+        if direction == SYNC_UPLOAD:
+
+            def transfer(bucket_name, file_key, src_path, show_progress=False, priority=PRIORITY_BATCH):
+                return self.post(bucket_name, file_key, src_path, show_progress=show_progress, overwrite=True, priority=priority)
+
+        else:
+
+            def transfer(bucket_name, file_key, out_path, show_progress=False, priority=PRIORITY_BATCH):
+
+                # replace the local file only once the new one is fully downloaded
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                tmp_path = f'{out_path}.{get_uuid()}.tmp'
+                try:
+                    stats = self.get(bucket_name, file_key, tmp_path, show_progress=show_progress, use_cache=False, priority=priority)
+                    mtime = remote_files[file_key][1]
+                    os.utime(tmp_path, (mtime, mtime))
+                    os.replace(tmp_path, out_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+
+                return stats
+
+        items = [(bucket_name, file_key, to_local_path(file_key)) for file_key in report['transfers']]
+        sizes = [src_files[file_key][0] for file_key in report['transfers']]
+        report['transfers'] = self.run_many(transfer, items, max_workers=max_workers, order=order, sizes=sizes)
+
+        # delete
+        if direction == SYNC_UPLOAD:
+            report['delete_errors'] = self.delete_keys(bucket_name, to_delete)
+        else:
+            for path in report['deleted']:
+                os.remove(path)
+
+        return report
 
 
+    @route_local_buckets
     def delete(self, bucket_name, file_key):
         """Deletes a file from the S3 bucket
 
@@ -0,0 +1,405 @@
+"""
+    Asyncio interface to the cloudstorage, built on aiobotocore
+"""
+
+import os
+import math
+import time
+import asyncio
+from contextlib import AsyncExitStack
+
+from botocore.exceptions import ClientError
+
+# config file interface
+from ..config import get_config, AWS_ACCESS_ID_KEY, AWS_ACCESS_SECRET_KEY, AWS_REGION_KEY
+from ..config import S3_MULTIPART_THRESHOLD_MB_KEY, S3_MULTIPART_CHUNKSIZE_MB_KEY, S3_ENDPOINT_URL_KEY, S3_ASYNC_MAX_CONCURRENCY_KEY
+
+from ..utils.basic import get_uuid
+
+# same part size as the synchronous interface
+from .checkpoint import get_part_size
+
+# bytes in a megabyte
+MB = 1024 * 1024
+
+
+async def run_blocking(func, *args):
+    """
+        Runs a blocking call (file io) in the default thread pool, so the event loop keeps running
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def read_file(path, offset=0, length=-1):
+    """ Returns length bytes of a file starting at offset, the whole file by default """
+    with open(path, 'rb') as fh:
+        fh.seek(offset)
+        return fh.read(length)
+
+
+class AsyncCloudStorage:
+    """
+        Class to interact with the cloudstorage from asyncio code, every request waits on a semaphore
+        so at most max_concurrency requests are in flight
+
+        Usage
+        -----
+            async with AsyncCloudStorage() as cloudstorage:
+                exists = await cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key)
+    """
+
+    def __init__(self, max_concurrency=None):
+
+        # grab config
+        config = get_config()
+        self._credentials = {
+            'aws_access_key_id': config[AWS_ACCESS_ID_KEY],
+            'aws_secret_access_key': config[AWS_ACCESS_SECRET_KEY],
+            'region_name': config[AWS_REGION_KEY],
+            'endpoint_url': config[S3_ENDPOINT_URL_KEY]
+        }
+        self.multipart_threshold = int(float(config[S3_MULTIPART_THRESHOLD_MB_KEY]) * MB)
+        self.multipart_chunksize = int(float(config[S3_MULTIPART_CHUNKSIZE_MB_KEY]) * MB)
+
+        if max_concurrency is None:
+            max_concurrency = int(config[S3_ASYNC_MAX_CONCURRENCY_KEY])
+
+        if max_concurrency < 1:
+            raise Exception('Invalid max concurrency')
+
+        self.max_concurrency = max_concurrency
+
+        # runtime var
+        self._client = None
+        self._exit_stack = None
+        self._semaphore = None
+
+
+    async def connect(self):
+        """
+            Creates the client
+        """
+
+        # optional dependency
+        try:
+            from aiobotocore.session import get_session
+            from aiobotocore.config import AioConfig
+        except ImportError:
+            raise Exception('aiobotocore must be installed to use the asyncio cloudstorage interface')
+
+        if self._client is None:
+            self._exit_stack = AsyncExitStack()
+            self._client = await self._exit_stack.enter_async_context(get_session().create_client(
+                's3',
+                config=AioConfig(max_pool_connections=self.max_concurrency),
+                **self._credentials
+            ))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        return self
+
+
+    async def close(self):
+        """
+            Closes the client and its connections
+        """
+
+        if self._client is not None:
+            await self._exit_stack.aclose()
+            self._client = None
+            self._exit_stack = None
+
+
+    async def __aenter__(self):
+        return await self.connect()
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+    def validate_input(self, bucket_name, file_key):
+        """ Checks the bucket name and file key input """
+        if bucket_name is None or file_key is None or not isinstance(bucket_name, str) or not isinstance(file_key, str) or bucket_name == '' or file_key == '':
+            raise Exception('invalid input')
+
+
+    async def head(self, bucket_name, file_key):
+        """
+            Returns the metadata of a file in the cloudstorage, None if the file does not exist, see CloudStorage.head
+        """
+
+        # validate input
+        self.validate_input(bucket_name, file_key)
+
+        try:
+            async with self._semaphore:
+                return await self._client.head_object(Bucket=bucket_name, Key=file_key)
+
+        except ClientError as e:
+            # any other error (forbidden, throttled, ...) must not pass for a missing file
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+
+    async def does_file_exists_in_cloudstorage(self, bucket_name, file_key):
+        """
+            Checks if file exists in the cloudstorage
+        """
+
+        metadata = await self.head(bucket_name, file_key)
+        if metadata is None:
+            return False
+
+        return isinstance(metadata.get('ContentLength', 0), int)
+
+
+    async def list(self, bucket_name, prefix=''):
+        """
+            Lists the files of a bucket whose key starts with a prefix, as an async generator, see CloudStorage.list
+        """
+
+        if bucket_name is None or not isinstance(bucket_name, str) or bucket_name == '':
+            raise Exception('invalid input')
+
+        paginator = self._client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=bucket_name, Prefix=prefix).__aiter__()
+
+        while True:
+
+            # the semaphore is only held while a page is requested
+            async with self._semaphore:
+                try:
+                    page = await pages.__anext__()
+                except StopAsyncIteration:
+                    return
+
+            for obj in page.get('Contents', []):
+                yield obj
+
+
+    async def get(self, bucket_name, file_key, out_path, chunk_size=MB):
+        """Downloads a file on the host machine
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        file_key : str
+            Key of the file
+        out_path : str
+            Path where to save the file
+        chunk_size : int
+            Number of bytes read from the response at a time
+
+        Returns
+        -------
+        stats : dict
+            Bytes transferred, duration in seconds and throughput in MB/s
+        """
+
+        # validate input
+        self.validate_input(bucket_name, file_key)
+
+        # check if we already have this file
+        if os.path.exists(out_path):
+            raise Exception('File already in local storage')
+
+        start = time.time()
+        tmp_path = f'{out_path}.{get_uuid()}.tmp'
+        nbr_of_bytes = 0
+
+        try:
+            async with self._semaphore:
+
+                try:
+                    response = await self._client.get_object(Bucket=bucket_name, Key=file_key)
+                except self._client.exceptions.NoSuchKey:
+                    raise Exception('File does not exists in the cloudstorage')
+
+                # the writes run in the thread pool, a slow disk must not block the event loop
+                async with response['Body'] as stream:
+                    fh = await run_blocking(open, tmp_path, 'wb')
+                    try:
+                        while True:
+                            chunk = await stream.read(chunk_size)
+                            if len(chunk) == 0:
+                                break
+                            await run_blocking(fh.write, chunk)
+                            nbr_of_bytes += len(chunk)
+                    finally:
+                        await run_blocking(fh.close)
+
+            os.replace(tmp_path, out_path)
+
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        seconds = time.time() - start
+        return {
+            'bytes': nbr_of_bytes,
+            'seconds': seconds,
+            'mb_per_s': nbr_of_bytes / MB / seconds if seconds > 0 else 0.0
+        }
+
+
+    async def post(self, bucket_name, file_key, src_path, overwrite=False):
+        """Uploads a file from the host machine to the cloudstorage
+
+        Files larger than the multipart threshold are uploaded in parts sent concurrently, with the
+        part size of CloudStorage.post so the ETag is the same
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket we want to upload to
+        file_key : str
+            Key we want to give to the file
+        src_path : str
+            Path to the file we want to upload
+        overwrite : bool
+            If true an existing file with the same key is replaced instead of raising
+
+        Returns
+        -------
+        stats : dict
+            Bytes transferred, duration in seconds and throughput in MB/s
+        """
+
+        # validate input
+        self.validate_input(bucket_name, file_key)
+
+        # validate input
+        if src_path is None or src_path == '':
+            raise Exception('Invalid file path')
+
+        # check if on disk
+        if not os.path.exists(src_path):
+            raise Exception(f'File not found at {src_path}')
+
+        # check if the file exists in the cloudstorage
+        if not overwrite and await self.does_file_exists_in_cloudstorage(bucket_name, file_key):
+            raise Exception('File already exists in the cloudstorage')
+
+        start = time.time()
+        filesize = os.path.getsize(src_path)
+
+        # single request
+        if filesize < self.multipart_threshold:
+            async with self._semaphore:
+                body = await run_blocking(read_file, src_path)
+                await self._client.put_object(Bucket=bucket_name, Key=file_key, Body=body)
+
+        # multipart
+        else:
+            part_size = get_part_size(filesize, self.multipart_chunksize)
+            nbr_of_parts = int(math.ceil(filesize / float(part_size)))
+
+            async with self._semaphore:
+                response = await self._client.create_multipart_upload(Bucket=bucket_name, Key=file_key)
+            upload_id = response['UploadId']
+
+            async def upload_part(part_number):
+                async with self._semaphore:
+                    body = await run_blocking(read_file, src_path, (part_number - 1) * part_size, part_size)
+                    response = await self._client.upload_part(
+                        Bucket=bucket_name,
+                        Key=file_key,
+                        UploadId=upload_id,
+                        PartNumber=part_number,
+                        Body=body
+                    )
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+            try:
+                parts = await asyncio.gather(*[upload_part(n) for n in range(1, nbr_of_parts + 1)])
+                async with self._semaphore:
+                    await self._client.complete_multipart_upload(
+                        Bucket=bucket_name,
+                        Key=file_key,
+                        UploadId=upload_id,
+                        MultipartUpload={'Parts': list(parts)}
+                    )
+
+            except:
+                async with self._semaphore:
+                    await self._client.abort_multipart_upload(Bucket=bucket_name, Key=file_key, UploadId=upload_id)
+                raise
+
+        seconds = time.time() - start
+        return {
+            'bytes': filesize,
+            'seconds': seconds,
+            'mb_per_s': filesize / MB / seconds if seconds > 0 else 0.0
+        }
+
+
+    async def delete(self, bucket_name, file_key):
+        """
+            Deletes a file from the S3 bucket, see CloudStorage.delete
+        """
+
+        # validate input
+        self.validate_input(bucket_name, file_key)
+
+        # check if the file exists in the cloudstorage
+        if not await self.does_file_exists_in_cloudstorage(bucket_name, file_key):
+            raise Exception('File does not exists in the cloudstorage')
+
+        async with self._semaphore:
+            await self._client.delete_object(Bucket=bucket_name, Key=file_key)
+
+
+    async def run_many(self, func, items):
+        """Runs a transfer coroutine on many objects concurrently, bounded by the semaphore
+
+        Arguments
+        ---------
+        func : coroutine function
+            Called as func(bucket_name, file_key, path), e.g. get or post
+        items : list
+            List of (bucket_name, file_key, path) tuples
+
+        Returns
+        -------
+        results : list
+            One dict per item, in the same order, like CloudStorage.run_many
+        """
+
+        async def run_one(item):
+
+            bucket_name, file_key, path = item
+            result = {
+                'bucket_name': bucket_name,
+                'file_key': file_key,
+                'path': path,
+                'success': False,
+                'error': None,
+                'stats': None
+            }
+
+            try:
+                result['stats'] = await func(bucket_name, file_key, path)
+                result['success'] = True
+            except Exception as e:
+                result['error'] = str(e)
+
+            return result
+
+        return list(await asyncio.gather(*[run_one(item) for item in items]))
+
+
+    async def get_many(self, items):
+        """
+            Downloads many files concurrently, items are (bucket_name, file_key, out_path) tuples
+        """
+        return await self.run_many(self.get, items)
+
+
+    async def post_many(self, items):
+        """
+            Uploads many files concurrently, items are (bucket_name, file_key, src_path) tuples
+        """
+        return await self.run_many(self.post, items)
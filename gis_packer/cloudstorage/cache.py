@@ -0,0 +1,258 @@
+"""
+    Local cache of the files downloaded from the cloudstorage, keyed by bucket/key/ETag with LRU eviction
+"""
+
+import os
+import time
+import fcntl
+import shutil
+import hashlib
+import threading
+from uuid import uuid4
+
+# ioctl request cloning a file on copy-on-write filesystems (btrfs, xfs), see linux/fs.h
+FICLONE = 0x40049409
+
+# seconds after which a temporary file is considered left by a crashed download
+TMP_MAX_AGE_S = 24 * 3600
+
+
+def sha256(val):
+    """ Returns the hex sha256 of a str """
+    return hashlib.sha256(val.encode('utf-8')).hexdigest()
+
+
+def copy_file(src_path, out_path):
+    """
+        Copies a file with os.sendfile, the content is copied by the kernel without going through user space
+    """
+
+    with open(src_path, 'rb') as src, open(out_path, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+
+
+def reflink_file(src_path, out_path):
+    """
+        Clones a file on copy-on-write filesystems (btrfs, xfs), returns false if not supported
+    """
+
+    try:
+        with open(src_path, 'rb') as src, open(out_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        return False
+
+
+def clone_file(src_path, out_path):
+    """
+        Makes an independent copy of a file, a reflink when possible, then a copy with os.sendfile
+    """
+
+    if not reflink_file(src_path, out_path):
+        copy_file(src_path, out_path)
+
+
+class DownloadCache:
+    """
+        Class to keep the downloaded files on disk, up to max_size bytes
+    """
+
+    def __init__(self, cache_dir, max_size):
+
+        # validate input
+        if cache_dir is None or cache_dir == '':
+            raise Exception('Invalid cache directory')
+
+        if not isinstance(max_size, int) or max_size < 0:
+            raise Exception('Invalid max size')
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        # the objects are stored under the hash of bucket/key/etag,
+        # the refs remember the last etag seen for each bucket/key
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.refs_dir = os.path.join(cache_dir, 'refs')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.refs_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+
+
+    def _object_path(self, bucket_name, file_key, etag):
+        return os.path.join(self.objects_dir, sha256(f'{bucket_name}/{file_key}/{etag}'))
+
+
+    def _ref_path(self, bucket_name, file_key):
+        return os.path.join(self.refs_dir, sha256(f'{bucket_name}/{file_key}'))
+
+
+    def get_etag(self, bucket_name, file_key):
+        """
+            Returns the ETag of the cached copy of a file, None if not cached
+        """
+
+        try:
+            with open(self._ref_path(bucket_name, file_key), 'r') as fh:
+                etag = fh.read()
+        except OSError:
+            return None
+
+        if not os.path.exists(self._object_path(bucket_name, file_key, etag)):
+            return None
+
+        return etag
+
+
+    def fetch(self, bucket_name, file_key, etag, out_path):
+        """Makes a copy of a cached file at out_path
+
+        The copy is a reflink or a real copy, never a hardlink, so modifying the output in place
+        never changes the cached file
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        file_key : str
+            Key of the file
+        etag : str
+            ETag of the file
+        out_path : str
+            Path where to make the file available
+
+        Returns
+        -------
+        success : bool
+            Returns true if the file was in the cache
+        """
+
+        object_path = self._object_path(bucket_name, file_key, etag)
+
+        try:
+            clone_file(object_path, out_path)
+        except FileNotFoundError:
+            if os.path.exists(out_path):
+                os.remove(out_path)
+            return False
+
+        # mark as recently used
+        try:
+            os.utime(object_path)
+        except OSError:
+            pass
+
+        return True
+
+
+    def tmp_path(self):
+        """
+            Returns a path, on the same filesystem as the cache, where to download a file before adding it
+        """
+        return os.path.join(self.objects_dir, f'.{uuid4()}.tmp')
+
+
+    def add(self, bucket_name, file_key, etag, tmp_path, out_path=None):
+        """Moves a downloaded file into the cache and evicts the least recently used files
+
+        The copy at out_path is made before the file enters the cache, so neither this eviction
+        nor the eviction of another thread can delete it first (e.g. a file larger than the cache)
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        file_key : str
+            Key of the file
+        etag : str
+            ETag of the file
+        tmp_path : str
+            Path of the downloaded file, see tmp_path
+        out_path : str
+            Path where to make a copy of the file, optional
+        """
+
+        if out_path is not None:
+            clone_file(tmp_path, out_path)
+
+        os.replace(tmp_path, self._object_path(bucket_name, file_key, etag))
+
+        # remember the etag
+        ref_path = self._ref_path(bucket_name, file_key)
+        ref_tmp_path = f'{ref_path}.{uuid4()}.tmp'
+        with open(ref_tmp_path, 'w') as fh:
+            fh.write(etag)
+        os.replace(ref_tmp_path, ref_path)
+
+        self.evict()
+
+
+    def evict(self):
+        """
+            Deletes the least recently used files until the cache fits in max_size bytes, and the
+            temporary files older than TMP_MAX_AGE_S left by crashed downloads
+        """
+
+        with self._lock:
+
+            now = time.time()
+            entries = []
+            total_size = 0
+            for entry in os.scandir(self.objects_dir):
+                if not entry.is_file():
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+
+                # downloads in progress, or left by a crash
+                if entry.name.endswith('.tmp'):
+                    if now - stat.st_mtime > TMP_MAX_AGE_S:
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                    continue
+
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+            # oldest first
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                    total_size -= size
+                except OSError:
+                    pass
+
+
+    def size(self):
+        """
+            Returns the size in bytes of the cached files
+        """
+        return sum([e.stat().st_size for e in os.scandir(self.objects_dir) if e.is_file() and not e.name.endswith('.tmp')])
+
+
+    def clear(self):
+        """
+            Deletes every cached file
+        """
+
+        with self._lock:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.objects_dir, exist_ok=True)
+            os.makedirs(self.refs_dir, exist_ok=True)
@@ -0,0 +1,89 @@
+"""
+    Checkpoint files recording the state of an interrupted transfer, so it can be resumed
+"""
+
+import os
+import json
+import hashlib
+from uuid import uuid4
+
+# boto3 doubles the part size until the upload fits in the parts limit
+from ..utils.basic import MAX_MULTIPART_PARTS
+
+
+def get_part_size(filesize, multipart_chunksize):
+    """
+        Returns the part size boto3 would use to upload a file, see utils.basic.get_content_hash
+    """
+
+    part_size = multipart_chunksize
+    while filesize > part_size * MAX_MULTIPART_PARTS:
+        part_size *= 2
+
+    return part_size
+
+
+def get_upload_checkpoint_path(checkpoint_dir, bucket_name, file_key):
+    """
+        Returns the path of the checkpoint of an upload to bucket_name/file_key
+    """
+
+    name = hashlib.sha256(f'{bucket_name}/{file_key}'.encode('utf-8')).hexdigest()
+    return os.path.join(checkpoint_dir, f'{name}.json')
+
+
+def get_download_checkpoint_paths(out_path):
+    """
+        Returns the paths of the partial file and of the checkpoint of a download to out_path
+    """
+
+    return f'{out_path}.part', f'{out_path}.part.json'
+
+
+class Checkpoint:
+    """
+        Class to read and write the state of a transfer as a json file, replaced atomically on every save
+    """
+
+    def __init__(self, checkpoint_path):
+
+        self.checkpoint_path = checkpoint_path
+
+        # create the parent directory
+        checkpoint_dir = os.path.dirname(checkpoint_path)
+        if checkpoint_dir != '' and not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+
+    def load(self):
+        """
+            Returns the saved state, None if there is no checkpoint or if it is unreadable
+        """
+
+        try:
+            with open(self.checkpoint_path, 'r') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+
+    def save(self, state):
+        """
+            Saves the state, a crash never leaves a partially written checkpoint
+        """
+
+        tmp_path = f'{self.checkpoint_path}.{uuid4()}.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump(state, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+    def delete(self):
+        """
+            Deletes the checkpoint
+        """
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
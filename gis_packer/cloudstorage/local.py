@@ -0,0 +1,417 @@
+"""
+    Storage backend keeping the files of some buckets on a local or shared filesystem (NFS, NVMe) instead of S3
+"""
+
+import os
+import time
+import threading
+from datetime import datetime, timezone
+from uuid import uuid4
+
+# content hash equal to the ETag S3 would give the file
+from ..utils.basic import get_content_hash
+
+# reflink or sendfile copy
+from .cache import clone_file
+
+# bytes in a megabyte
+MB = 1024 * 1024
+
+
+class LocalMetadata(dict):
+    """
+        HEAD-like metadata of a file of a local bucket, the ETag hashes the whole file so it is only
+        computed when read
+    """
+
+    def __init__(self, local_storage, path, stat, **kwargs):
+        super().__init__(**kwargs)
+        self._local_storage = local_storage
+        self._path = path
+        self._stat = stat
+
+
+    def __missing__(self, key):
+        if key != 'ETag':
+            raise KeyError(key)
+        self['ETag'] = f'"{self._local_storage.get_etag(self._path, self._stat)}"'
+        return self['ETag']
+
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class LocalStorage:
+    """
+        Class storing the files of the local buckets under their root directory, the file key is the relative path.
+
+        It has the same methods as CloudStorage for the operations on a bucket, CloudStorage sends it the
+        calls on the local buckets. The files are cloned (reflink) when the filesystem supports it and
+        copied otherwise, so the stored files never share their content with the caller's files.
+    """
+
+    def __init__(self, buckets, multipart_threshold, multipart_chunksize):
+
+        # validate input
+        if not isinstance(buckets, dict):
+            raise Exception('Local buckets must be a dict of bucket name -> root directory')
+
+        self.buckets = {bucket_name: os.path.abspath(root_dir) for bucket_name, root_dir in buckets.items()}
+
+        # to give the files the same ETag as S3
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+
+        # path -> (size, mtime_ns, etag), hashing a file is only done once per version
+        self._etags = {}
+        self._lock = threading.Lock()
+
+
+    def is_local(self, bucket_name):
+        """ Returns true if the bucket is stored on the filesystem """
+        return bucket_name in self.buckets
+
+
+    def validate_input(self, bucket_name, file_key):
+        """ Checks the bucket name and file key input """
+        if bucket_name is None or file_key is None or not isinstance(bucket_name, str) or not isinstance(file_key, str) or bucket_name == '' or file_key == '':
+            raise Exception('invalid input')
+
+        if not self.is_local(bucket_name):
+            raise Exception(f'{bucket_name} is not a local bucket')
+
+
+    def get_path(self, bucket_name, file_key):
+        """
+            Returns the path of a file of a local bucket
+        """
+
+        # validate input
+        self.validate_input(bucket_name, file_key)
+
+        # the key must stay inside the root directory
+        parts = file_key.split('/')
+        if file_key.startswith('/') or any([p in ('', '.', '..') for p in parts]):
+            raise Exception(f'Invalid file key {file_key}')
+
+        return os.path.join(self.buckets[bucket_name], *parts)
+
+
+    def get_etag(self, path, stat=None):
+        """
+            Returns the content hash of a file, computed again only if its size or mtime changed
+        """
+
+        if stat is None:
+            stat = os.stat(path)
+
+        with self._lock:
+            cached = self._etags.get(path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+
+        etag = get_content_hash(path, multipart_threshold=self.multipart_threshold, multipart_chunksize=self.multipart_chunksize)
+        with self._lock:
+            self._etags[path] = (stat.st_size, stat.st_mtime_ns, etag)
+
+        return etag
+
+
+    def to_metadata(self, path, stat):
+        """ Returns the HEAD-like metadata of a file, see LocalMetadata """
+        return LocalMetadata(
+            self,
+            path,
+            stat,
+            ContentLength=stat.st_size,
+            LastModified=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+        )
+
+
+    def tmp_path(self, path):
+        """ Returns a temporary path in the same directory, hidden from list """
+        return os.path.join(os.path.dirname(path), f'.{uuid4()}.tmp')
+
+
+    def head(self, bucket_name, file_key):
+        """
+            Returns the ContentLength, ETag and LastModified of a file, None if the file does not exist, see CloudStorage.head
+        """
+
+        path = self.get_path(bucket_name, file_key)
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return self.to_metadata(path, stat)
+
+
+    def does_file_exists_in_cloudstorage(self, bucket_name, file_key):
+        """
+            Checks if file exists in the local bucket
+        """
+        return self.head(bucket_name, file_key) is not None
+
+
+    def list(self, bucket_name, prefix=''):
+        """
+            Lists the files of a local bucket whose key starts with a prefix, in the byte order of the keys like S3, see CloudStorage.list
+        """
+
+        if bucket_name is None or not isinstance(bucket_name, str) or not self.is_local(bucket_name):
+            raise Exception('invalid input')
+
+        # only walk the directory holding the prefix
+        root_dir = self.buckets[bucket_name]
+        prefix_dir = os.path.join(root_dir, *prefix.split('/')[:-1])
+        if os.path.commonpath([root_dir, os.path.abspath(prefix_dir)]) != root_dir:
+            raise Exception(f'Invalid prefix {prefix}')
+
+        files = []
+        for dir_path, _, filenames in os.walk(prefix_dir):
+            for filename in filenames:
+
+                # transfers in progress
+                if filename.startswith('.') and filename.endswith('.tmp'):
+                    continue
+
+                path = os.path.join(dir_path, filename)
+                file_key = os.path.relpath(path, root_dir).replace(os.sep, '/')
+                if file_key.startswith(prefix):
+                    files.append((file_key.encode('utf-8'), file_key, path))
+
+        for _, file_key, path in sorted(files):
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            yield LocalMetadata(
+                self,
+                path,
+                stat,
+                Key=file_key,
+                Size=stat.st_size,
+                LastModified=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+            )
+
+
+    def list_parallel(self, bucket_name, prefix='', max_workers=None):
+        """
+            Lists the files of a local bucket as a dict Key -> (size, LastModified timestamp, None), see CloudStorage.list_parallel.
+            The ETag is not computed, see get_etag
+        """
+        return {obj['Key']: (obj['Size'], obj['LastModified'].timestamp(), None) for obj in self.list(bucket_name, prefix=prefix)}
+
+
+    def get(self, bucket_name, file_key, out_path, show_progress=True, use_cache=True, priority=None, metadata=None):
+        """Copies a file of a local bucket to out_path, with a reflink when possible, see CloudStorage.get
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the local bucket
+        file_key : str
+            Key of the file
+        out_path : str
+            Path where to save the file
+        show_progress : bool
+            Unused, the transfer does not go through the network
+        use_cache : bool
+            Unused, the files of local buckets are never cached
+        priority : str
+            Unused, the bandwidth limit only applies to S3
+        metadata : dict
+            Unused, the file is read from the filesystem
+
+        Returns
+        -------
+        stats : dict
+            Bytes, duration in seconds, throughput in MB/s and whether the cache was hit
+        """
+
+        path = self.get_path(bucket_name, file_key)
+
+        # check if we already have this file
+        if os.path.exists(out_path):
+            raise Exception('File already in local storage')
+
+        if not os.path.isfile(path):
+            raise Exception('File does not exists in the cloudstorage')
+
+        start = time.time()
+        filesize = os.path.getsize(path)
+
+        # copy next to the output, so a failed copy never leaves a partial file
+        tmp_path = self.tmp_path(out_path)
+        try:
+            clone_file(path, tmp_path)
+            os.replace(tmp_path, out_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        seconds = time.time() - start
+        return {
+            'bytes': filesize,
+            'seconds': seconds,
+            'mb_per_s': filesize / MB / seconds if seconds > 0 else 0.0,
+            'cached': False
+        }
+
+
+    def post(self, bucket_name, file_key, src_path, show_progress=True, overwrite=False, priority=None):
+        """Stores a copy of a file in a local bucket, with a reflink when possible, see CloudStorage.post
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the local bucket
+        file_key : str
+            Key we want to give to the file
+        src_path : str
+            Path to the file we want to store
+        show_progress : bool
+            Unused, the transfer does not go through the network
+        overwrite : bool
+            If true an existing file with the same key is replaced instead of raising
+        priority : str
+            Unused, the bandwidth limit only applies to S3
+
+        Returns
+        -------
+        stats : dict
+            Bytes, duration in seconds and throughput in MB/s
+        """
+
+        path = self.get_path(bucket_name, file_key)
+
+        # validate input
+        if src_path is None or src_path == '':
+            raise Exception('Invalid file path')
+
+        # check if on disk
+        if not os.path.exists(src_path):
+            raise Exception(f'File not found at {src_path}')
+
+        # check if the file exists in the bucket
+        if not overwrite and os.path.exists(path):
+            raise Exception('File already exists in the cloudstorage')
+
+        start = time.time()
+        filesize = os.path.getsize(src_path)
+
+        # the new file replaces the key atomically
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = self.tmp_path(path)
+        try:
+            clone_file(src_path, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        seconds = time.time() - start
+        return {
+            'bytes': filesize,
+            'seconds': seconds,
+            'mb_per_s': filesize / MB / seconds if seconds > 0 else 0.0
+        }
+
+
+    def post_bytes(self, bucket_name, file_key, content, priority=None):
+        """
+            Writes an in-memory file to a local bucket, an existing file is overwritten, see CloudStorage.post_bytes
+        """
+
+        path = self.get_path(bucket_name, file_key)
+
+        if not isinstance(content, (bytes, bytearray)):
+            raise Exception('Content must be bytes')
+
+        start = time.time()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = self.tmp_path(path)
+        try:
+            with open(tmp_path, 'wb') as fh:
+                fh.write(content)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        etag = self.get_etag(path)
+
+        seconds = time.time() - start
+        return {
+            'bytes': len(content),
+            'seconds': seconds,
+            'mb_per_s': len(content) / MB / seconds if seconds > 0 else 0.0,
+            'etag': etag,
+            'content_hash': etag
+        }
+
+
+    def get_resumable(self, bucket_name, file_key, out_path, show_progress=True, max_retries=5, priority=None):
+        """
+            Same as get, a local copy is never worth resuming
+        """
+
+        stats = self.get(bucket_name, file_key, out_path, show_progress=show_progress)
+        stats['resumed_from'] = 0
+
+        return stats
+
+
+    def post_resumable(self, bucket_name, file_key, src_path, show_progress=True, max_retries=5, priority=None):
+        """
+            Same as post, a local copy is never worth resuming
+        """
+
+        stats = self.post(bucket_name, file_key, src_path, show_progress=show_progress)
+        stats['resumed_from'] = 0
+
+        return stats
+
+
+    def list_parts(self, bucket_name, file_key, upload_id):
+        raise Exception('Multipart uploads are not supported by local buckets')
+
+
+    def delete_keys(self, bucket_name, file_keys, max_workers=None):
+        """
+            Deletes files from a local bucket, keys that do not exist are not reported as errors, see CloudStorage.delete_keys
+        """
+
+        errors = []
+        for file_key in file_keys:
+            try:
+                os.remove(self.get_path(bucket_name, file_key))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                errors.append({'Key': file_key, 'Code': 'RequestFailed', 'Message': str(e)})
+
+        return errors
+
+
+    def delete(self, bucket_name, file_key):
+        """
+            Deletes a file from a local bucket, see CloudStorage.delete
+        """
+
+        path = self.get_path(bucket_name, file_key)
+
+        # check if the file exists in the bucket
+        if not os.path.isfile(path):
+            raise Exception('File does not exists in the cloudstorage')
+
+        os.remove(path)
@@ -0,0 +1,309 @@
+"""
+    Scheduling of the transfers: global bandwidth limit, priority classes, size-aware ordering and per-class metrics
+"""
+
+import os
+import time
+import fcntl
+import struct
+import threading
+from contextlib import contextmanager
+
+# priority classes, the interactive transfers take the bandwidth first
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BATCH = 'batch'
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BATCH)
+
+# order in which the files of a batch are started
+ORDER_FIFO = 'fifo'
+ORDER_SMALLEST_FIRST = 'smallest'
+ORDER_LARGEST_FIRST = 'largest'
+ORDERS = (ORDER_FIFO, ORDER_SMALLEST_FIRST, ORDER_LARGEST_FIRST)
+
+# bytes in a megabyte
+MB = 1024 * 1024
+
+# tokens, last refill time and time until which the batch consumers wait, in the state file of a shared bucket
+STATE_FORMAT = struct.Struct('<ddd')
+
+# seconds the batch consumers keep waiting after an interactive consumer is due to retry
+INTERACTIVE_MARGIN_S = 0.05
+
+
+class TokenBucket:
+    """
+        Token bucket limiting the number of bytes per second shared by every thread, unlimited if rate is None.
+
+        A consumer larger than the bucket is let through and the debt is paid by the next consumers, so the
+        average rate is respected whatever the chunk size. While an interactive consumer is waiting for
+        tokens, the batch consumers wait behind it.
+
+        If state_path is given the state of the bucket is kept in that file, locked while updated, so every
+        process using the same file (batch workers, worker children, parallel cli invocations) shares
+        the rate instead of each getting its own.
+    """
+
+    def __init__(self, rate=None, burst=None, state_path=None):
+
+        if rate is not None and rate <= 0:
+            raise Exception('Invalid rate')
+
+        if burst is None and rate is not None:
+            burst = rate
+
+        self.rate = rate
+        self.burst = burst
+        self.state_path = state_path
+
+        # runtime var, only used without a state file
+        self._tokens = burst
+        self._last_refill = time.time()
+        self._interactive_until = 0.0
+        self._cond = threading.Condition()
+
+
+    @contextmanager
+    def _state(self):
+        """
+            Context manager loading the tokens, last refill time and interactive deadline from the state file
+            and saving them back, the file is locked in between
+        """
+
+        if self.state_path is None:
+            yield
+            return
+
+        # opened on every call, a descriptor inherited through a fork would share the lock
+        fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+
+            data = os.pread(fd, STATE_FORMAT.size, 0)
+            if len(data) == STATE_FORMAT.size:
+                self._tokens, self._last_refill, self._interactive_until = STATE_FORMAT.unpack(data)
+            else:
+                self._tokens, self._last_refill, self._interactive_until = self.burst, time.time(), 0.0
+
+            yield
+
+            os.pwrite(fd, STATE_FORMAT.pack(self._tokens, self._last_refill, self._interactive_until), 0)
+
+        finally:
+            os.close(fd)
+
+
+    def _try_consume(self, nbr_of_bytes, interactive):
+        """
+            Takes the tokens if possible, returns None if taken or the seconds to wait before trying again
+        """
+
+        with self._state():
+
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + max(0.0, now - self._last_refill) * self.rate)
+            self._last_refill = now
+
+            # give way to the interactive transfers
+            if not interactive and self._interactive_until > now:
+                return min(self._interactive_until - now, 1.0)
+
+            if self._tokens > 0:
+                self._tokens -= nbr_of_bytes
+                return None
+
+            # wait for the debt to be paid, the batch consumers wait behind the interactive ones
+            wait_s = min(-self._tokens / self.rate + 0.001, 1.0)
+            if interactive:
+                self._interactive_until = max(self._interactive_until, now + wait_s + INTERACTIVE_MARGIN_S)
+
+            return wait_s
+
+
+    def consume(self, nbr_of_bytes, priority=PRIORITY_BATCH):
+        """Blocks until nbr_of_bytes can be transferred
+
+        Arguments
+        ---------
+        nbr_of_bytes : int
+            Number of bytes about to be, or just, transferred
+        priority : str
+            'interactive' or 'batch'
+        """
+
+        if self.rate is None or nbr_of_bytes <= 0:
+            return
+
+        interactive = priority == PRIORITY_INTERACTIVE
+
+        with self._cond:
+            while True:
+                wait_s = self._try_consume(nbr_of_bytes, interactive)
+                if wait_s is None:
+                    self._cond.notify_all()
+                    return
+                self._cond.wait(wait_s)
+
+
+class ClassMetrics:
+    """
+        Bytes, transfers and busy time of one priority class, the throughput is computed over the time
+        at least one transfer of the class was running
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.transfers = 0
+        self.failures = 0
+        self.active = 0
+        self.busy_s = 0.0
+        self._since = None
+
+
+    def start(self):
+        if self.active == 0:
+            self._since = time.monotonic()
+        self.active += 1
+
+
+    def end(self, success):
+        self.active -= 1
+        if success:
+            self.transfers += 1
+        else:
+            self.failures += 1
+        if self.active == 0:
+            self.busy_s += time.monotonic() - self._since
+
+
+    def stats(self):
+        seconds = self.busy_s
+        if self.active > 0:
+            seconds += time.monotonic() - self._since
+        return {
+            'bytes': self.bytes,
+            'transfers': self.transfers,
+            'failures': self.failures,
+            'active': self.active,
+            'seconds': seconds,
+            'mb_per_s': self.bytes / MB / seconds if seconds > 0 else 0.0
+        }
+
+
+class TransferScheduler:
+    """
+        Class every transfer of a CloudStorage goes through
+
+        Usage
+        -----
+            with scheduler.transfer(PRIORITY_BATCH):
+                ...
+                scheduler.throttle(len(chunk), PRIORITY_BATCH)
+    """
+
+    def __init__(self, max_bytes_per_s=None, burst_bytes=None, state_path=None):
+
+        self.bandwidth = TokenBucket(rate=max_bytes_per_s, burst=burst_bytes, state_path=state_path)
+        self._metrics = {priority: ClassMetrics() for priority in PRIORITIES}
+        self._lock = threading.Lock()
+
+        # transfers calling another transfer (e.g. post_resumable -> post) are counted once
+        self._local = threading.local()
+
+
+    def validate_priority(self, priority):
+        """ Checks the priority class """
+        if priority not in PRIORITIES:
+            raise Exception(f'priority must be one of : {PRIORITIES}')
+
+
+    @contextmanager
+    def transfer(self, priority):
+        """
+            Context manager counting a transfer in the metrics of its class
+        """
+
+        self.validate_priority(priority)
+
+        depth = getattr(self._local, 'depth', 0)
+        if depth > 0:
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+
+        with self._lock:
+            self._metrics[priority].start()
+        self._local.depth = 1
+
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            self._local.depth = 0
+            with self._lock:
+                self._metrics[priority].end(success)
+
+
+    def throttle(self, nbr_of_bytes, priority):
+        """
+            Counts the bytes of a transfer and blocks while the bandwidth limit is reached
+        """
+
+        with self._lock:
+            self._metrics[priority].bytes += nbr_of_bytes
+
+        self.bandwidth.consume(nbr_of_bytes, priority)
+
+
+    def callback(self, priority, progress=None):
+        """
+            Returns a boto3 transfer callback throttling the transfer, the transfer threads sleep in it
+            when the bandwidth limit is reached
+        """
+
+        def on_bytes(nbr_of_bytes):
+            if progress is not None:
+                progress(nbr_of_bytes)
+            self.throttle(nbr_of_bytes, priority)
+
+        return on_bytes
+
+
+    def metrics(self):
+        """
+            Returns the bytes, transfers, failures, busy seconds and throughput of each priority class
+        """
+
+        with self._lock:
+            return {priority: m.stats() for priority, m in self._metrics.items()}
+
+
+def get_order(sizes, order):
+    """Returns the indices of the files in the order they must be started
+
+    Arguments
+    ---------
+    sizes : list
+        Size in bytes of each file
+    order : str
+        'fifo', 'smallest' (lowest latency per file) or 'largest' (shortest total time)
+
+    Returns
+    -------
+    indices : list
+        Indices of the files, ties keep their submission order
+    """
+
+    if order not in ORDERS:
+        raise Exception(f'order must be one of : {ORDERS}')
+
+    indices = list(range(0, len(sizes)))
+    if order == ORDER_SMALLEST_FIRST:
+        indices.sort(key=lambda i: sizes[i])
+    elif order == ORDER_LARGEST_FIRST:
+        indices.sort(key=lambda i: -sizes[i])
+
+    return indices
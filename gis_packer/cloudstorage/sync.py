@@ -0,0 +1,92 @@
+"""
+    Comparison of a local directory with a prefix of the cloudstorage, used by CloudStorage.sync
+"""
+
+import os
+
+# content hash equal to the ETag of a file uploaded by boto3
+from ..utils.basic import get_content_hash
+
+
+# directions
+SYNC_UPLOAD = 'upload'
+SYNC_DOWNLOAD = 'download'
+SYNC_DIRECTIONS = (SYNC_UPLOAD, SYNC_DOWNLOAD)
+
+# how two files are compared
+COMPARE_SIZE = 'size'
+COMPARE_MTIME = 'mtime'
+COMPARE_ETAG = 'etag'
+COMPARE_MODES = (COMPARE_SIZE, COMPARE_MTIME, COMPARE_ETAG)
+
+# files left by interrupted transfers
+TEMPORARY_SUFFIXES = ('.part', '.part.json', '.tmp')
+
+
+def list_local_files(local_dir):
+    """Lists the files of a directory, recursively
+
+    Arguments
+    ---------
+    local_dir : str
+        Path to the directory
+
+    Returns
+    -------
+    files : dict
+        Relative path (with / separators) -> (size, mtime)
+    """
+
+    files = {}
+    for root, _, filenames in os.walk(local_dir):
+        for filename in filenames:
+
+            if filename.endswith(TEMPORARY_SUFFIXES):
+                continue
+
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            rel_path = os.path.relpath(path, local_dir).replace(os.sep, '/')
+            files[rel_path] = (stat.st_size, stat.st_mtime)
+
+    return files
+
+
+def is_different(local_path, local_file, remote_file, direction, compare, multipart_threshold, multipart_chunksize):
+    """Returns true if a file present on both sides must be transferred
+
+    Arguments
+    ---------
+    local_path : str
+        Path to the local file
+    local_file : tuple
+        (size, mtime) of the local file
+    remote_file : tuple
+        (size, mtime, etag) of the remote file
+    direction : str
+        SYNC_UPLOAD or SYNC_DOWNLOAD
+    compare : str
+        COMPARE_SIZE compares the sizes, COMPARE_MTIME also transfers the files more recent on the source side,
+        COMPARE_ETAG compares the content hash of the local file with the ETag
+    multipart_threshold : int
+        Multipart threshold used to upload the remote files, see get_content_hash
+    multipart_chunksize : int
+        Part size used to upload the remote files, see get_content_hash
+    """
+
+    local_size, local_mtime = local_file
+    remote_size, remote_mtime, remote_etag = remote_file
+
+    if local_size != remote_size:
+        return True
+
+    if compare == COMPARE_MTIME:
+        if direction == SYNC_UPLOAD:
+            return local_mtime > remote_mtime
+        return remote_mtime > local_mtime
+
+    if compare == COMPARE_ETAG:
+        content_hash = get_content_hash(local_path, multipart_threshold=multipart_threshold, multipart_chunksize=multipart_chunksize)
+        return content_hash != remote_etag
+
+    return False
@@ -0,0 +1,122 @@
+"""
+    Bounded queue of in-memory files uploaded concurrently to the cloudstorage
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .scheduler import PRIORITY_BATCH
+
+
+class UploadQueue:
+    """
+        Class to upload in-memory files in the background, submit blocks once max_pending files are waiting
+        so the memory used stays bounded
+
+        Usage
+        -----
+            with UploadQueue(get_cloudstorage()) as uploads:
+                uploads.submit(bucket_name, file_key, content)
+    """
+
+    def __init__(self, cloudstorage, max_workers=None, max_pending=None, priority=PRIORITY_BATCH):
+
+        if max_workers is None:
+            max_workers = cloudstorage.max_workers
+
+        if max_pending is None:
+            max_pending = 2 * max_workers
+
+        if max_workers < 1 or max_pending < 1:
+            raise Exception('Invalid queue size')
+
+        self.cloudstorage = cloudstorage
+        self.priority = priority
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+
+    def _upload(self, bucket_name, file_key, content, on_uploaded):
+
+        result = {
+            'bucket_name': bucket_name,
+            'file_key': file_key,
+            'success': False,
+            'error': None,
+            'stats': None
+        }
+
+        try:
+            result['stats'] = self.cloudstorage.post_bytes(bucket_name, file_key, content, priority=self.priority)
+            if on_uploaded is not None:
+                on_uploaded(bucket_name, file_key, result['stats']['content_hash'])
+            result['success'] = True
+
+        except Exception as e:
+            result['error'] = str(e)
+
+        finally:
+            self._pending.release()
+
+        return result
+
+
+    def submit(self, bucket_name, file_key, content, on_uploaded=None):
+        """Queues a file for upload, blocks while the queue is full
+
+        Arguments
+        ---------
+        bucket_name : str
+            Name of the AWS S3 bucket
+        file_key : str
+            Key of the file
+        content : bytes
+            Content of the file
+        on_uploaded : function
+            Called as on_uploaded(bucket_name, file_key, content_hash) by the upload thread once the file is uploaded,
+            an exception marks the upload as failed
+        """
+
+        self.cloudstorage.validate_input(bucket_name, file_key)
+
+        self._pending.acquire()
+        try:
+            self._futures.append(self._executor.submit(self._upload, bucket_name, file_key, content, on_uploaded))
+        except:
+            self._pending.release()
+            raise
+
+
+    def join(self):
+        """Waits for every queued upload
+
+        Returns
+        -------
+        results : list
+            One dict per file, in the submission order, with the bucket_name, file_key, success, error and stats
+        """
+
+        results = [future.result() for future in self._futures]
+        self._futures = []
+
+        return results
+
+
+    def close(self):
+        """
+            Waits for every queued upload and stops the upload threads
+        """
+
+        results = self.join()
+        self._executor.shutdown(wait=True)
+
+        return results
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
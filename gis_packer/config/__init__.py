@@ -29,6 +29,85 @@ ALLOWED_KEYS = set([
     DB_NAME_KEY
 ])
 
+# Optional config keys, the default value is used when the key is not in the config file
+REPLICA_PATH_KEY = 'REPLICA_PATH'
+SELECT_CACHE_SIZE_KEY = 'SELECT_CACHE_SIZE'
+SELECT_CACHE_TTL_S_KEY = 'SELECT_CACHE_TTL_S'
+SELECT_CACHE_DIR_KEY = 'SELECT_CACHE_DIR'
+DB_POOL_SIZE_KEY = 'DB_POOL_SIZE'
+DB_POOL_MAX_OVERFLOW_KEY = 'DB_POOL_MAX_OVERFLOW'
+DB_POOL_TIMEOUT_S_KEY = 'DB_POOL_TIMEOUT_S'
+DB_POOL_RECYCLE_S_KEY = 'DB_POOL_RECYCLE_S'
+DB_POOL_PRE_PING_KEY = 'DB_POOL_PRE_PING'
+S3_MULTIPART_THRESHOLD_MB_KEY = 'S3_MULTIPART_THRESHOLD_MB'
+S3_MULTIPART_CHUNKSIZE_MB_KEY = 'S3_MULTIPART_CHUNKSIZE_MB'
+S3_MAX_CONCURRENCY_KEY = 'S3_MAX_CONCURRENCY'
+S3_USE_THREADS_KEY = 'S3_USE_THREADS'
+S3_MAX_WORKERS_KEY = 'S3_MAX_WORKERS'
+DOWNLOAD_CACHE_DIR_KEY = 'DOWNLOAD_CACHE_DIR'
+DOWNLOAD_CACHE_MAX_GB_KEY = 'DOWNLOAD_CACHE_MAX_GB'
+TRANSFER_CHECKPOINT_DIR_KEY = 'TRANSFER_CHECKPOINT_DIR'
+S3_ENDPOINT_URL_KEY = 'S3_ENDPOINT_URL'
+S3_ASYNC_MAX_CONCURRENCY_KEY = 'S3_ASYNC_MAX_CONCURRENCY'
+LOCAL_BUCKETS_KEY = 'LOCAL_BUCKETS'
+
+# bandwidth limit of the transfers to S3, shared by every process of the host through the TRANSFER_BANDWIDTH_STATE_PATH
+# file (in $HOME/.config, mounted in every container): the batch workers, the worker's children and parallel cli
+# invocations all draw from the same TRANSFER_MAX_MB_PER_S. Other hosts and the asyncio interface are not limited by it.
+TRANSFER_MAX_MB_PER_S_KEY = 'TRANSFER_MAX_MB_PER_S'
+TRANSFER_BURST_MB_KEY = 'TRANSFER_BURST_MB'
+TRANSFER_BANDWIDTH_STATE_PATH_KEY = 'TRANSFER_BANDWIDTH_STATE_PATH'
+TRANSFER_ORDER_KEY = 'TRANSFER_ORDER'
+WORKER_SOCKET_PATH_KEY = 'WORKER_SOCKET_PATH'
+
+OPTIONAL_KEYS = {
+    REPLICA_PATH_KEY: os.path.join('/root', '.cache', 'gis_packer', 'catalog.sqlite'),
+    SELECT_CACHE_SIZE_KEY: 128,
+    SELECT_CACHE_TTL_S_KEY: 300,
+    SELECT_CACHE_DIR_KEY: None,
+    DB_POOL_SIZE_KEY: 5,
+    DB_POOL_MAX_OVERFLOW_KEY: 10,
+    DB_POOL_TIMEOUT_S_KEY: 30,
+    DB_POOL_RECYCLE_S_KEY: 1800,
+    DB_POOL_PRE_PING_KEY: True,
+    S3_MULTIPART_THRESHOLD_MB_KEY: 8,
+    S3_MULTIPART_CHUNKSIZE_MB_KEY: 8,
+    S3_MAX_CONCURRENCY_KEY: 10,
+    S3_USE_THREADS_KEY: True,
+    S3_MAX_WORKERS_KEY: 16,
+    DOWNLOAD_CACHE_DIR_KEY: None,
+    DOWNLOAD_CACHE_MAX_GB_KEY: 50,
+    TRANSFER_CHECKPOINT_DIR_KEY: os.path.join('/root', '.cache', 'gis_packer', 'transfers'),
+    S3_ENDPOINT_URL_KEY: None,
+    S3_ASYNC_MAX_CONCURRENCY_KEY: 64,
+    LOCAL_BUCKETS_KEY: None,
+    TRANSFER_MAX_MB_PER_S_KEY: None,
+    TRANSFER_BURST_MB_KEY: None,
+    TRANSFER_BANDWIDTH_STATE_PATH_KEY: os.path.join('/root', '.config', 'gis_packer_bandwidth.state'),
+    TRANSFER_ORDER_KEY: 'fifo',
+    WORKER_SOCKET_PATH_KEY: os.path.join('/root', '.config', 'gis_packer_worker.sock')
+}
+
+
+def to_bool(value):
+    """
+        Returns the boolean value of a config value, a json boolean or a string like 'true' / 'false'
+    """
+
+    if isinstance(value, bool):
+        return value
+
+    if isinstance(value, int):
+        return value != 0
+
+    if isinstance(value, str) and value.strip().lower() in ('true', 'yes', 'on', '1'):
+        return True
+
+    if isinstance(value, str) and value.strip().lower() in ('false', 'no', 'off', '0'):
+        return False
+
+    raise Exception(f'Invalid boolean {value}')
+
 
 __config = None
 def load_config(config_file_path=None):
@@ -83,12 +162,14 @@ class gisPackerConfig:
 
     def __getitem__(self, key):
         if key not in self._config:
+            if key in OPTIONAL_KEYS:
+                return OPTIONAL_KEYS[key]
             raise Exception(f'{key} not in config file')
         return self._config[key]
 
 
     def __setitem__(self, key, value):
-        if key not in self._config:
+        if key not in self._config and key not in OPTIONAL_KEYS:
             raise Exception(f'{key} not in config file')
 
         if value is None:
@@ -3,26 +3,37 @@
 """
 
 import json
+import threading
 
 import numpy as np
 import pandas as pd
 import geopandas as gpd
 
-from shapely.wkt import loads as wkt_loads
+from geopandas.array import from_wkb, from_wkt
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+
+from psycopg2.extras import execute_values
 
 
 # config file interface
-from ..config import get_config, DB_USERNAME_KEY, DB_PASSWORD_KEY, DB_HOSTNAME_KEY, DB_PORT_KEY, DB_NAME_KEY
+from ..config import get_config, to_bool, DB_USERNAME_KEY, DB_PASSWORD_KEY, DB_HOSTNAME_KEY, DB_PORT_KEY, DB_NAME_KEY
+from ..config import SELECT_CACHE_SIZE_KEY, SELECT_CACHE_TTL_S_KEY, SELECT_CACHE_DIR_KEY
+from ..config import DB_POOL_SIZE_KEY, DB_POOL_MAX_OVERFLOW_KEY, DB_POOL_TIMEOUT_S_KEY, DB_POOL_RECYCLE_S_KEY, DB_POOL_PRE_PING_KEY
+
+# search filters
+from .filters import build_raster_where
 
-# basic utils
-from ..utils.basic import is_iso_dt_str_valid
+# local replica of the raster table
+from .replica import get_replica
+
+# search results cache
+from .cache import ResultCache, make_select_key
 
 
 # data model for raster
 create_table_raster_query = """
-    CREATE TABLE raster (
+    CREATE TABLE IF NOT EXISTS raster (
         index BIGINT GENERATED ALWAYS AS IDENTITY,
         taken_at TIMESTAMP NOT NULL,
         bucket_name VARCHAR(128) NOT NULL,
@@ -37,17 +48,171 @@ create_table_raster_query = """
     )
 """
 
+# table keeping track of the migrations applied to the database
+create_table_schema_version_query = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT NOT NULL,
+        applied_at timestamp NOT NULL DEFAULT current_timestamp,
+        PRIMARY KEY(version)
+    )
+"""
+
+# key of the advisory lock held while migrating, so only one process migrates at a time
+schema_migration_lock_key = 20201127
+
+# versioned migrations of the schema, applied in order.
+# Migrations that are not transactional run in autocommit mode (e.g. CREATE INDEX CONCURRENTLY)
+# and must be safe to re-run if a previous attempt was interrupted
+schema_migrations = [
+    {
+        'version': 1,
+        'transactional': True,
+        'queries': [
+            create_table_raster_query
+        ]
+    },
+    {
+        'version': 2,
+        'transactional': False,
+        'queries': [
+            'DROP INDEX CONCURRENTLY IF EXISTS raster_geometry_idx',
+            'CREATE INDEX CONCURRENTLY raster_geometry_idx ON raster USING GIST (geometry)',
+            'DROP INDEX CONCURRENTLY IF EXISTS raster_taken_at_idx',
+            'CREATE INDEX CONCURRENTLY raster_taken_at_idx ON raster (taken_at)',
+            'DROP INDEX CONCURRENTLY IF EXISTS raster_pixel_size_m_idx',
+            'CREATE INDEX CONCURRENTLY raster_pixel_size_m_idx ON raster (pixel_size_m)',
+            'ANALYZE raster'
+        ]
+    },
+    {
+        'version': 3,
+        'transactional': False,
+        'queries': [
+            'ALTER TABLE raster ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)',
+            'DROP INDEX CONCURRENTLY IF EXISTS raster_content_hash_idx',
+            'CREATE INDEX CONCURRENTLY raster_content_hash_idx ON raster (content_hash)'
+        ]
+    },
+    {
+        # file keys in byte order, the order of the S3 listings, see Database.stream_keys
+        'version': 4,
+        'transactional': False,
+        'queries': [
+            'DROP INDEX CONCURRENTLY IF EXISTS raster_bucket_name_file_key_c_idx',
+            'CREATE INDEX CONCURRENTLY raster_bucket_name_file_key_c_idx ON raster (bucket_name, file_key COLLATE "C")'
+        ]
+    }
+]
+
+# columns of the raster table set on insert
+raster_insert_columns = ['taken_at', 'bucket_name', 'file_key', 'pixel_size_m', 'geometry', 'bands', 'profile', 'content_hash']
+
+# row template used to bind the values of a raster
+raster_insert_template = '(%s, %s, %s, %s, ST_GeomFromText(%s), %s::jsonb, %s::jsonb, %s)'
+
+# columns returned when searching for raster
+raster_select_columns = """
+    index,
+    taken_at,
+    bucket_name,
+    file_key,
+    pixel_size_m,
+    bands,
+    ST_AsBinary(geometry) as geometry,
+    created_at,
+    content_hash
+"""
+
+# conflict modes of insert_many
+ON_CONFLICT_NOTHING = 'nothing'
+ON_CONFLICT_UPDATE = 'update'
+ON_CONFLICT_MODES = (ON_CONFLICT_NOTHING, ON_CONFLICT_UPDATE)
+
+
+def validate_raster_row(row):
+    """
+        Checks the metadata of a raster and returns it as a tuple of values ordered like raster_insert_columns
+    """
+
+    if not isinstance(row, dict):
+        raise Exception('Invalid row')
+
+    for column in raster_insert_columns:
+        if column not in row and column != 'content_hash':
+            raise Exception(f'Missing {column}')
+
+    if not isinstance(row['taken_at'], str):
+        raise Exception('Invalid taken_at')
+
+    if not isinstance(row['bucket_name'], str):
+        raise Exception('Invalid bucket_name')
+
+    if not isinstance(row['file_key'], str):
+        raise Exception('Invalid file_key')
+
+    if not isinstance(row['pixel_size_m'], int):
+        raise Exception('Invalid pixel_size_m')
+
+    if not isinstance(row['geometry'], str):
+        raise Exception('Invalid geometry')
+
+    if not isinstance(row['bands'], dict):
+        raise Exception('Invalid bands')
+
+    if not isinstance(row['profile'], dict):
+        raise Exception('Invalid profile')
+
+    content_hash = row.get('content_hash', None)
+    if content_hash is not None and (not isinstance(content_hash, str) or len(content_hash) > 64):
+        raise Exception('Invalid content_hash')
+
+    # serialize the dicts
+    bands = json.dumps(row['bands'])
+    profile = json.dumps(row['profile'])
+
+    return (
+        row['taken_at'],
+        row['bucket_name'],
+        row['file_key'],
+        row['pixel_size_m'],
+        row['geometry'],
+        bands,
+        profile,
+        content_hash
+    )
+
 
 __database = None
+__database_lock = threading.Lock()
 def get_database():
     global __database
 
-    if __database is None:
-        __database = Database()
+    # threads fanning out must share a single engine, and so a single pool
+    with __database_lock:
+        if __database is None:
+            __database = Database()
 
     return __database
 
 
+def clear_select_cache():
+    """
+        Drops the cached search results, those of the Database of this process if any
+        and those of the on-disk tier shared by the processes
+    """
+
+    with __database_lock:
+        database = __database
+
+    if database is not None:
+        database.cache.clear()
+        return
+
+    cache_dir = get_config()[SELECT_CACHE_DIR_KEY]
+    if cache_dir is not None:
+        ResultCache(max_entries=0, ttl_s=0, cache_dir=cache_dir).clear()
+
+
 class Database:
 
     def __init__(self):
@@ -60,10 +225,22 @@ class Database:
         port = config[DB_PORT_KEY]
         db_name = config[DB_NAME_KEY]
 
-        # Set up database connection engine
+        # Set up database connection engine, the pool bounds the number of connections shared by all threads
         self.engine = create_engine(
             f'postgresql+psycopg2://{username}:{password}@{hostname}:{port}/{db_name}',
-            connect_args={'options': '-csearch_path={}'.format('public')}
+            connect_args={'options': '-csearch_path={}'.format('public')},
+            pool_size=int(config[DB_POOL_SIZE_KEY]),
+            max_overflow=int(config[DB_POOL_MAX_OVERFLOW_KEY]),
+            pool_timeout=float(config[DB_POOL_TIMEOUT_S_KEY]),
+            pool_recycle=int(config[DB_POOL_RECYCLE_S_KEY]),
+            pool_pre_ping=to_bool(config[DB_POOL_PRE_PING_KEY])
+        )
+
+        # cache of the search results
+        self.cache = ResultCache(
+            max_entries=int(config[SELECT_CACHE_SIZE_KEY]),
+            ttl_s=float(config[SELECT_CACHE_TTL_S_KEY]),
+            cache_dir=config[SELECT_CACHE_DIR_KEY]
         )
 
         # check if the raster table is in the database, if not create it
@@ -72,45 +249,95 @@ class Database:
 
     def execute_query(self, query):
         """
-            Executes a SQL query on the database, returns nothing
+            Executes a SQL query on the database, returns nothing, the cached search results are cleared
         """
 
         with self.engine.connect() as connection:
             with connection.begin():
                 connection.execute(query)
 
+        # the query may have changed the rows of cached search results
+        self.cache.clear()
+
 
     def init_raster_table(self):
         """
-            If the db doesn't contain the table raster, it creates it
+            Brings the schema of the database up to date, creating the table raster if needed
+        """
+
+        self.migrate()
+
+
+    def get_schema_version(self):
+        """
+            Returns the version of the schema currently applied to the database (0 if none)
         """
 
-        # check if the table raster is in the table
-        result = []
         with self.engine.connect() as connection:
             with connection.begin():
-                rs = connection.execute("""
-                    SELECT EXISTS (
-                        SELECT FROM
-                            information_schema.tables
-                        WHERE
-                            table_name = 'raster'
-                    );
-                """)
 
-            for row in rs:
-                result.append(row)
+                # the table is only created by migrate, under the lock
+                if connection.execute("SELECT to_regclass('schema_version')").scalar() is None:
+                    return 0
+
+                rs = connection.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+                version = rs.scalar()
+
+        return int(version)
+
+
+    def migrate(self):
+        """
+            Applies the schema migrations that have not yet been applied to the database
+        """
+
+        # latest version known by this code
+        latest_version = max([m['version'] for m in schema_migrations])
+
+        # nothing to do, skip the lock
+        if self.get_schema_version() >= latest_version:
+            return
+
+        # autocommit connection, CREATE INDEX CONCURRENTLY can't run inside a transaction block
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+
+            # wait for any other process migrating the database
+            connection.execute(f'SELECT pg_advisory_lock({schema_migration_lock_key})')
+            try:
+
+                # concurrent CREATE TABLE IF NOT EXISTS can fail on the catalog unique index, hence under the lock
+                connection.execute(create_table_schema_version_query)
+
+                # the version may have changed while we were waiting on the lock
+                version = self.get_schema_version()
 
-        # grab first row
-        result = str(result[0][0])
+                for migration in schema_migrations:
 
-        # convert to boolean
-        has_table = (result in ('t', 'true', 'True'))
+                    if migration['version'] <= version:
+                        continue
 
-        # if the database doesn't have the table raster, create it
-        if not has_table:
-            print('Table raster not found in database, creating now...')
-            self.execute_query(create_table_raster_query)
+                    print(f"Migrating the database schema to version {migration['version']}...")
+
+                    if migration['transactional']:
+                        with self.engine.connect() as tx_connection:
+                            with tx_connection.begin():
+                                for query in migration['queries']:
+                                    tx_connection.execute(query)
+                                tx_connection.execute(
+                                    'INSERT INTO schema_version (version) VALUES (%s)',
+                                    (migration['version'],)
+                                )
+
+                    else:
+                        for query in migration['queries']:
+                            connection.execute(query)
+                        connection.execute(
+                            'INSERT INTO schema_version (version) VALUES (%s)',
+                            (migration['version'],)
+                        )
+
+            finally:
+                connection.execute(f'SELECT pg_advisory_unlock({schema_migration_lock_key})')
 
 
     def execute_query_with_return(self, query):
@@ -125,7 +352,7 @@ class Database:
         if 'geometry' in results.columns:
 
             # parse geometry
-            results['geometry'] = results['geometry'].apply(wkt_loads)
+            results['geometry'] = decode_geometries(results['geometry'])
 
             # convert to geodataframe
             results = gpd.GeoDataFrame(results)
@@ -142,7 +369,8 @@ class Database:
             pixel_size_m,
             geometry,
             bands,
-            profile
+            profile,
+            content_hash=None
         ):
         """Inserts the metadata of a raster in the DB
 
@@ -162,42 +390,141 @@ class Database:
                 Information about the bands
             profile : dict
                 Other information about the raster
+            content_hash : str
+                Hash of the file's content, S3 ETag compatible (see utils.basic.get_content_hash)
         """
 
-        if not isinstance(taken_at, str):
-            raise Exception('Invalid taken_at')
+        self.insert_many([{
+            'taken_at': taken_at,
+            'bucket_name': bucket_name,
+            'file_key': file_key,
+            'pixel_size_m': pixel_size_m,
+            'geometry': geometry,
+            'bands': bands,
+            'profile': profile,
+            'content_hash': content_hash
+        }])
 
-        if not isinstance(bucket_name, str):
-            raise Exception('Invalid bucket_name')
 
-        if not isinstance(file_key, str):
-            raise Exception('Invalid file_key')
+    def insert_many(self, rows, on_conflict=None, page_size=1000):
+        """Inserts the metadata of many raster in the DB within a single transaction
 
-        if not isinstance(pixel_size_m, int):
-            raise Exception('Invalid pixel_size_m')
+        Arguments
+        ---------
+            rows : list
+                List of dicts with the same keys as the arguments of insert
+            on_conflict : str
+                What to do when a (bucket_name, file_key) is already in the DB.
+                None raises, 'nothing' skips the row and 'update' overwrites it
+            page_size : int
+                Number of rows sent to the DB per statement
+
+        Returns
+        -------
+            nbr_of_rows : int
+                Number of rows inserted or updated
+        """
 
-        if not isinstance(geometry, str):
-            raise Exception('Invalid geometry')
+        # validate input
+        if not isinstance(rows, list):
+            raise Exception('Invalid rows')
 
-        if not isinstance(bands, dict):
-            raise Exception('Invalid bands')
+        if on_conflict is not None and on_conflict not in ON_CONFLICT_MODES:
+            raise Exception(f'on_conflict must be one of : {ON_CONFLICT_MODES}')
 
-        if not isinstance(profile, dict):
-            raise Exception('Invalid profile')
+        if not isinstance(page_size, int) or page_size < 1:
+            raise Exception('Invalid page_size')
 
-        # serialize the dicts
-        bands = json.dumps(bands)
-        profile = json.dumps(profile)
+        # validate and serialize every row before touching the DB
+        values = [validate_raster_row(row) for row in rows]
 
-        # build sql query
+        if len(values) == 0:
+            return 0
+
+        # conflict clause on the (bucket_name, file_key) unique key
+        ON_CONFLICT = ''
+        if on_conflict == ON_CONFLICT_NOTHING:
+            ON_CONFLICT = 'ON CONFLICT (bucket_name, file_key) DO NOTHING'
+
+        elif on_conflict == ON_CONFLICT_UPDATE:
+            updated_columns = [c for c in raster_insert_columns if c not in ('bucket_name', 'file_key')]
+            updates = ', '.join([f'{c} = EXCLUDED.{c}' for c in updated_columns])
+            ON_CONFLICT = f'ON CONFLICT (bucket_name, file_key) DO UPDATE SET {updates}'
+
+        # build sql query, the values are bound by psycopg2
         sql_query = f"""
             INSERT INTO raster
-                (taken_at, bucket_name, file_key, pixel_size_m, geometry, bands, profile)
+                ({', '.join(raster_insert_columns)})
             VALUES
-                ('{taken_at}', '{bucket_name}', '{file_key}', {pixel_size_m}, '{geometry}', '{bands}', '{profile}')
+                %s
+            {ON_CONFLICT}
         """
 
-        self.execute_query(sql_query)
+        # run all the pages in a single transaction
+        nbr_of_rows = 0
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                for i in range(0, len(values), page_size):
+                    execute_values(
+                        cursor,
+                        sql_query,
+                        values[i:i+page_size],
+                        template=raster_insert_template,
+                        page_size=page_size
+                    )
+                    nbr_of_rows += cursor.rowcount
+            connection.commit()
+
+        except:
+            connection.rollback()
+            raise
+
+        finally:
+            connection.close()
+
+        # cached search results may be stale
+        self.cache.clear()
+
+        return nbr_of_rows
+
+
+    def find_by_content_hash(self, content_hash):
+        """Returns the raster whose file has the provided content hash
+
+        Arguments
+        ---------
+            content_hash : str
+                Hash of the file's content
+
+        Returns
+        -------
+            results : GeoDataFrame
+                The raster with this content hash (empty if none)
+        """
+
+        if not isinstance(content_hash, str) or content_hash == '':
+            raise Exception('Invalid content_hash')
+
+        sql_query = f"""
+            SELECT
+                {raster_select_columns}
+            FROM
+                raster
+            WHERE
+                content_hash = :content_hash
+            ORDER BY
+                index
+        """
+
+        # run
+        results = pd.read_sql_query(
+            con=self.engine,
+            sql=text(sql_query),
+            params={'content_hash': content_hash}
+        )
+
+        return raster_results_to_gdf(results)
 
 
     def delete(
@@ -209,12 +536,65 @@ class Database:
             Deletes an raster from the database
         """
 
-        # build sql query
-        sql_query = f"""
-            DELETE FROM raster WHERE bucket_name = '{bucket_name}' AND file_key = '{file_key}'
+        self.delete_many([(bucket_name, file_key)])
+
+
+    def delete_many(self, keys, page_size=1000):
+        """Deletes many raster from the database within a single transaction
+
+        Arguments
+        ---------
+            keys : list
+                List of (bucket_name, file_key) tuples
+            page_size : int
+                Number of keys sent per statement
+
+        Returns
+        -------
+            nbr_of_rows : int
+                Number of rows deleted
+        """
+
+        # validate input
+        if not isinstance(keys, list):
+            raise Exception('Invalid keys')
+
+        if len(keys) == 0:
+            return 0
+
+        sql_query = """
+            DELETE FROM raster WHERE (bucket_name, file_key) IN (VALUES %s)
+        """
+
+        # run all the pages in a single transaction
+        nbr_of_rows = 0
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                for i in range(0, len(keys), page_size):
+                    execute_values(cursor, sql_query, keys[i:i+page_size], page_size=page_size)
+                    nbr_of_rows += cursor.rowcount
+            connection.commit()
+
+        except:
+            connection.rollback()
+            raise
+
+        finally:
+            connection.close()
+
+        # cached search results may be stale
+        self.cache.clear()
+
+        return nbr_of_rows
+
+
+    def build_raster_filters(self, **filters):
+        """
+            Validates the search filters and returns the WHERE clause with its bound parameters, see build_raster_where
         """
 
-        self.execute_query(sql_query)
+        return build_raster_where(**filters)
 
 
     def select(
@@ -224,97 +604,320 @@ class Database:
             TAKEN_AT_MIN=None,
             TAKEN_AT_MAX=None,
             PIXEL_SIZE_M_MAX=None,
-            POINT_CONTAINED=None
+            POINT_CONTAINED=None,
+            INTERSECTS=None,
+            MIN_OVERLAP=None,
+            FROM_REPLICA=False,
+            USE_CACHE=True
         ):
         """
-            Returns the raster using filters
+            Returns the raster using filters, from the local replica if FROM_REPLICA is true.
+            Results are cached unless USE_CACHE is false
         """
 
+        # answer from the local replica
+        if FROM_REPLICA:
+            return get_replica().select(
+                OFFSET=OFFSET,
+                LIMIT=LIMIT,
+                TAKEN_AT_MIN=TAKEN_AT_MIN,
+                TAKEN_AT_MAX=TAKEN_AT_MAX,
+                PIXEL_SIZE_M_MAX=PIXEL_SIZE_M_MAX,
+                POINT_CONTAINED=POINT_CONTAINED,
+                INTERSECTS=INTERSECTS,
+                MIN_OVERLAP=MIN_OVERLAP
+            )
+
         # validate input
+        if not isinstance(OFFSET, int):
+            raise Exception('invalid OFFSET arg')
         if not isinstance(LIMIT, int):
             raise Exception('invalid LIMIT arg')
-        if TAKEN_AT_MIN is not None and not isinstance(TAKEN_AT_MIN, str):
-            raise Exception('invalid TAKEN_AT_MIN arg')
-        if TAKEN_AT_MAX is not None and not isinstance(TAKEN_AT_MAX, str):
-            raise Exception('invalid TAKEN_AT_MAX arg')
-        if POINT_CONTAINED is not None and not isinstance(POINT_CONTAINED, tuple):
-            raise Exception('invalid POINT_CONTAINED arg')
 
-        if TAKEN_AT_MAX is not None and not is_iso_dt_str_valid(TAKEN_AT_MAX):
-            raise Exception('invalid iso format TAKEN_AT_MAX arg')
-        if TAKEN_AT_MIN is not None and not is_iso_dt_str_valid(TAKEN_AT_MIN):
-            raise Exception('invalid iso format TAKEN_AT_MIN arg')
+        # check the cache
+        cache_key = None
+        if USE_CACHE:
+            cache_key = make_select_key(
+                OFFSET=OFFSET,
+                LIMIT=LIMIT,
+                TAKEN_AT_MIN=TAKEN_AT_MIN,
+                TAKEN_AT_MAX=TAKEN_AT_MAX,
+                PIXEL_SIZE_M_MAX=PIXEL_SIZE_M_MAX,
+                POINT_CONTAINED=POINT_CONTAINED,
+                INTERSECTS=INTERSECTS,
+                MIN_OVERLAP=MIN_OVERLAP
+            )
+            results = self.cache.get(cache_key)
+            if results is not None:
+                return results
 
-        # convert point to postgis point
-        point_contained = None
-        if POINT_CONTAINED is not None:
+        # where statements to filter raster
+        WHERE, params = self.build_raster_filters(
+            TAKEN_AT_MIN=TAKEN_AT_MIN,
+            TAKEN_AT_MAX=TAKEN_AT_MAX,
+            PIXEL_SIZE_M_MAX=PIXEL_SIZE_M_MAX,
+            POINT_CONTAINED=POINT_CONTAINED,
+            INTERSECTS=INTERSECTS,
+            MIN_OVERLAP=MIN_OVERLAP
+        )
 
-            # validate lat, lng
-            lat, lng = POINT_CONTAINED
-            if not isinstance(lat, (float, int)) or not isinstance(lng, (float, int)):
-                raise Exception('invalid POINT_CONTAINED arg')
+        # Build SQL Query
+        sql_query = f"""
+            SELECT
+                {raster_select_columns}
+            FROM
+                raster
+            WHERE
+                {WHERE}
+            ORDER BY
+                index
+            OFFSET
+                :offset
+            LIMIT
+                :limit
+        """
+        params['offset'] = OFFSET
+        params['limit'] = LIMIT
 
-            # parse
-            point_contained = f'POINT({lng} {lat})'
+        # run
+        results = pd.read_sql_query(
+            con=self.engine,
+            sql=text(sql_query),
+            params=params
+        )
 
+        results = raster_results_to_gdf(results)
 
-        # where statements to filter raster
-        WHERE_TAKEN_AT_MIN = ''
-        if TAKEN_AT_MIN is not None:
-            WHERE_TAKEN_AT_MIN = f"AND taken_at >= '{TAKEN_AT_MIN}'"
+        # cache
+        if cache_key is not None:
+            self.cache.set(cache_key, results)
 
-        WHERE_TAKEN_AT_MAX = ''
-        if TAKEN_AT_MAX is not None:
-            WHERE_TAKEN_AT_MAX = f"AND taken_at >= '{TAKEN_AT_MAX}'"
+        return results
 
-        WHERE_PIXEL_SIZE_M_MAX = ''
-        if PIXEL_SIZE_M_MAX is not None:
-            WHERE_PIXEL_SIZE_M_MAX = f'AND pixel_size_m <= {PIXEL_SIZE_M_MAX}'
 
-        WHERE_POINT_CONTAINED = ''
-        if point_contained is not None:
-            WHERE_POINT_CONTAINED = f"AND ST_Contains(geometry, '{point_contained}')"
+    def stream_keys(self, bucket_name, prefix='', PAGE_SIZE=10000):
+        """Streams the file keys of a bucket in byte order, the order of a S3 listing, in constant memory
 
+        Pages are fetched with keyset pagination on file_key, using the raster_bucket_name_file_key_c_idx index
 
-        # Build SQL Query
-        sql_query = f"""
+        Arguments
+        ---------
+            bucket_name : str
+                Name of the AWS S3 bucket
+            prefix : str
+                Only return the file keys starting with this prefix
+            PAGE_SIZE : int
+                Number of rows fetched per keyset query
+
+        Returns
+        -------
+            generator of tuple
+                (file_key, seconds since the row was created)
+        """
+
+        # validate input
+        if not isinstance(PAGE_SIZE, int) or PAGE_SIZE < 1:
+            raise Exception('invalid PAGE_SIZE arg')
+
+        sql_query = text("""
             SELECT
-                index,
-                taken_at,
-                bucket_name,
                 file_key,
-                pixel_size_m,
-                bands,
-                ST_AsText(geometry) as geometry,
-                created_at
+                EXTRACT(EPOCH FROM (NOW() - created_at)) AS age_s
             FROM
                 raster
             WHERE
-                true {WHERE_TAKEN_AT_MIN} {WHERE_TAKEN_AT_MAX} {WHERE_PIXEL_SIZE_M_MAX} {WHERE_POINT_CONTAINED}
+                bucket_name = :bucket_name AND
+                file_key COLLATE "C" >= :prefix AND
+                file_key COLLATE "C" > :after_key
             ORDER BY
-                index
-            OFFSET
-                {OFFSET}
+                file_key COLLATE "C"
             LIMIT
-                {LIMIT}
+                :page_size
+        """)
+
+        after_key = ''
+        while True:
+
+            with self.engine.connect() as connection:
+                rows = connection.execute(sql_query, {
+                    'bucket_name': bucket_name,
+                    'prefix': prefix,
+                    'after_key': after_key,
+                    'page_size': PAGE_SIZE
+                }).fetchall()
+
+            for row in rows:
+
+                # the keys with the prefix are contiguous
+                if not row['file_key'].startswith(prefix):
+                    return
+
+                yield row['file_key'], float(row['age_s'])
+
+            # last page
+            if len(rows) < PAGE_SIZE:
+                break
+
+            after_key = rows[-1]['file_key']
+
+
+    def stream(
+            self,
+            AFTER_INDEX=None,
+            PAGE_SIZE=10000,
+            CHUNK_SIZE=1000,
+            AS_GDF=True,
+            TAKEN_AT_MIN=None,
+            TAKEN_AT_MAX=None,
+            PIXEL_SIZE_M_MAX=None,
+            POINT_CONTAINED=None,
+            INTERSECTS=None,
+            MIN_OVERLAP=None
+        ):
+        """Streams the raster matching the filters ordered by index, in constant memory
+
+        Pages are fetched with keyset pagination on index (WHERE index > last index seen),
+        so every page costs the same no matter how deep it is. Each page is read through a
+        server-side cursor, CHUNK_SIZE rows at a time.
+
+        Arguments
+        ---------
+            AFTER_INDEX : int
+                Only return raster with an index strictly greater than this one (to resume a stream)
+            PAGE_SIZE : int
+                Number of rows fetched per keyset query
+            CHUNK_SIZE : int
+                Number of rows pulled from the server-side cursor at a time
+            AS_GDF : bool
+                If true yields GeoDataFrame chunks, otherwise yields the rows as dicts
+
+        Returns
+        -------
+            generator of GeoDataFrame or dict
         """
 
-        # run
-        results = pd.read_sql_query(
-            con=self.engine,
-            sql=sql_query
+        # validate input
+        if AFTER_INDEX is not None and not isinstance(AFTER_INDEX, int):
+            raise Exception('invalid AFTER_INDEX arg')
+        if not isinstance(PAGE_SIZE, int) or PAGE_SIZE < 1:
+            raise Exception('invalid PAGE_SIZE arg')
+        if not isinstance(CHUNK_SIZE, int) or CHUNK_SIZE < 1:
+            raise Exception('invalid CHUNK_SIZE arg')
+
+        # where statements to filter raster
+        WHERE, params = self.build_raster_filters(
+            TAKEN_AT_MIN=TAKEN_AT_MIN,
+            TAKEN_AT_MAX=TAKEN_AT_MAX,
+            PIXEL_SIZE_M_MAX=PIXEL_SIZE_M_MAX,
+            POINT_CONTAINED=POINT_CONTAINED,
+            INTERSECTS=INTERSECTS,
+            MIN_OVERLAP=MIN_OVERLAP
         )
 
-        if len(results.index) > 0:
+        # Build SQL Query
+        sql_query = text(f"""
+            SELECT
+                {raster_select_columns}
+            FROM
+                raster
+            WHERE
+                {WHERE} AND index > :after_index
+            ORDER BY
+                index
+            LIMIT
+                :page_size
+        """)
+
+        # start before the first index
+        last_index = -1 if AFTER_INDEX is None else AFTER_INDEX
 
-            # parse geometry
-            results['geometry'] = results['geometry'].apply(wkt_loads)
+        while True:
 
-            # parse datetime columns
-            results['taken_at'] = results['taken_at'].dt.strftime('%Y-%m-%d %H:%M:%S')
-            results['created_at'] = results['created_at'].dt.strftime('%Y-%m-%d %H:%M:%S')
+            # keyset pagination
+            params['after_index'] = last_index
+            params['page_size'] = PAGE_SIZE
 
-        # convert to geodataframe
-        results = gpd.GeoDataFrame(results)
+            nbr_of_rows = 0
+            with self.engine.connect().execution_options(stream_results=True) as connection:
 
-        return results
+                rs = connection.execute(sql_query, params)
+                columns = list(rs.keys())
+
+                while True:
+
+                    rows = rs.fetchmany(CHUNK_SIZE)
+                    if len(rows) == 0:
+                        break
+
+                    nbr_of_rows += len(rows)
+                    last_index = rows[-1]['index']
+
+                    # convert
+                    chunk = pd.DataFrame.from_records(rows, columns=columns)
+                    chunk = raster_results_to_gdf(chunk)
+
+                    if AS_GDF:
+                        yield chunk
+                    else:
+                        for record in chunk.to_dict(orient='records'):
+                            yield record
+
+            # last page
+            if nbr_of_rows < PAGE_SIZE:
+                break
+
+
+def decode_geometries(values):
+    """
+        Decodes a column of WKB (bytes) or WKT (str) geometries in a single vectorized call,
+        geopandas only vectorizes it with pygeos (or shapely 2) installed
+    """
+
+    # nulls as None, pandas may give NaN
+    values = np.array(values, dtype=object)
+    notnull = pd.notna(values)
+    values[~notnull] = None
+
+    # grab the first geometry to find the encoding
+    first = values[notnull][0] if notnull.any() else None
+
+    if isinstance(first, str):
+        return from_wkt(values)
+
+    # psycopg2 returns bytea columns as memoryviews, the decoders only take bytes
+    if isinstance(first, memoryview):
+        values[notnull] = list(map(bytes, values[notnull]))
+
+    return from_wkb(values)
+
+
+def format_datetimes(values):
+    """
+        Formats a column of datetimes to the '%Y-%m-%d %H:%M:%S' format without looping in python
+    """
+
+    # truncate to the second, 'YYYY-MM-DDTHH:MM:SS'
+    values = pd.to_datetime(values).to_numpy(dtype='datetime64[s]')
+    values = np.datetime_as_string(values, unit='s')
+
+    return np.char.replace(values, 'T', ' ')
+
+
+def raster_results_to_gdf(results):
+    """
+        Parses the geometry and datetime columns of raster search results and returns a GeoDataFrame
+    """
+
+    if len(results.index) > 0:
+
+        # parse geometry
+        results['geometry'] = decode_geometries(results['geometry'])
+
+        # parse datetime columns
+        results['taken_at'] = format_datetimes(results['taken_at'])
+        results['created_at'] = format_datetimes(results['created_at'])
+
+    # convert to geodataframe
+    results = gpd.GeoDataFrame(results)
+
+    return results
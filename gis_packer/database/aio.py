@@ -0,0 +1,281 @@
+"""
+    Asyncio interface to the database, built on an asyncpg connection pool
+"""
+
+import re
+import json
+from datetime import datetime, timezone
+
+import pandas as pd
+
+# config file interface
+from ..config import get_config, DB_USERNAME_KEY, DB_PASSWORD_KEY, DB_HOSTNAME_KEY, DB_PORT_KEY, DB_NAME_KEY
+from ..config import DB_POOL_SIZE_KEY, DB_POOL_MAX_OVERFLOW_KEY, DB_POOL_TIMEOUT_S_KEY, DB_POOL_RECYCLE_S_KEY
+
+# search filters
+from .filters import build_raster_where
+
+# data model shared with the synchronous interface
+from . import validate_raster_row, raster_select_columns, raster_insert_columns, raster_results_to_gdf
+from . import ON_CONFLICT_NOTHING, ON_CONFLICT_UPDATE, ON_CONFLICT_MODES
+
+# search results cached by Database.select
+from . import clear_select_cache
+
+
+# filters bound as timestamps, asyncpg only accepts datetimes for them
+timestamp_params = ('taken_at_min', 'taken_at_max')
+
+
+def parse_timestamp(dt_str):
+    """
+        Converts an ISO timestamp to a naive UTC datetime
+    """
+
+    try:
+        dt = datetime.fromisoformat(dt_str)
+    except:
+        dt = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
+
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return dt
+
+
+def to_positional(sql_query, params):
+    """
+        Converts a query using :name parameters to the $n parameters used by asyncpg, returns the query and the values
+    """
+
+    names = []
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f'${names.index(name) + 1}'
+
+    # skip the :: casts
+    sql_query = re.sub(r'(?<!:):([a-z_][a-z0-9_]*)', replace, sql_query)
+
+    values = []
+    for name in names:
+        value = params[name]
+        if name in timestamp_params:
+            value = parse_timestamp(value)
+        values.append(value)
+
+    return sql_query, values
+
+
+class AsyncDatabase:
+    """
+        Class to interact with the database from asyncio code, every operation shares a bounded pool of connections
+
+        Usage
+        -----
+            async with AsyncDatabase() as database:
+                results = await database.select(LIMIT=10)
+    """
+
+    def __init__(self):
+
+        # grab config
+        config = get_config()
+        self._dsn = {
+            'user': config[DB_USERNAME_KEY],
+            'password': config[DB_PASSWORD_KEY],
+            'host': config[DB_HOSTNAME_KEY],
+            'port': int(config[DB_PORT_KEY]),
+            'database': config[DB_NAME_KEY]
+        }
+        self._max_size = int(config[DB_POOL_SIZE_KEY]) + int(config[DB_POOL_MAX_OVERFLOW_KEY])
+        self._timeout_s = float(config[DB_POOL_TIMEOUT_S_KEY])
+        self._recycle_s = float(config[DB_POOL_RECYCLE_S_KEY])
+
+        # runtime var
+        self.pool = None
+
+
+    async def connect(self):
+        """
+            Opens the connection pool
+        """
+
+        # optional dependency
+        try:
+            import asyncpg
+        except ImportError:
+            raise Exception('asyncpg must be installed to use the asyncio database interface')
+
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(
+                min_size=1,
+                max_size=self._max_size,
+                timeout=self._timeout_s,
+                max_inactive_connection_lifetime=self._recycle_s,
+                server_settings={'search_path': 'public'},
+                **self._dsn
+            )
+
+        return self
+
+
+    async def close(self):
+        """
+            Closes the connection pool
+        """
+
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+
+    async def __aenter__(self):
+        return await self.connect()
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+    async def insert(
+            self,
+            taken_at,
+            bucket_name,
+            file_key,
+            pixel_size_m,
+            geometry,
+            bands,
+            profile,
+            content_hash=None
+        ):
+        """
+            Inserts the metadata of a raster in the DB, see Database.insert
+        """
+
+        await self.insert_many([{
+            'taken_at': taken_at,
+            'bucket_name': bucket_name,
+            'file_key': file_key,
+            'pixel_size_m': pixel_size_m,
+            'geometry': geometry,
+            'bands': bands,
+            'profile': profile,
+            'content_hash': content_hash
+        }])
+
+
+    async def insert_many(self, rows, on_conflict=None):
+        """
+            Inserts the metadata of many raster in the DB within a single transaction, see Database.insert_many
+        """
+
+        # validate input
+        if not isinstance(rows, list):
+            raise Exception('Invalid rows')
+
+        if on_conflict is not None and on_conflict not in ON_CONFLICT_MODES:
+            raise Exception(f'on_conflict must be one of : {ON_CONFLICT_MODES}')
+
+        # validate and serialize every row before touching the DB
+        values = []
+        for row in rows:
+            value = list(validate_raster_row(row))
+            value[0] = parse_timestamp(value[0])
+            values.append(value)
+
+        if len(values) == 0:
+            return
+
+        # conflict clause on the (bucket_name, file_key) unique key
+        ON_CONFLICT = ''
+        if on_conflict == ON_CONFLICT_NOTHING:
+            ON_CONFLICT = 'ON CONFLICT (bucket_name, file_key) DO NOTHING'
+
+        elif on_conflict == ON_CONFLICT_UPDATE:
+            updated_columns = [c for c in raster_insert_columns if c not in ('bucket_name', 'file_key')]
+            updates = ', '.join([f'{c} = EXCLUDED.{c}' for c in updated_columns])
+            ON_CONFLICT = f'ON CONFLICT (bucket_name, file_key) DO UPDATE SET {updates}'
+
+        sql_query = f"""
+            INSERT INTO raster
+                ({', '.join(raster_insert_columns)})
+            VALUES
+                ($1, $2, $3, $4, ST_GeomFromText($5), $6::jsonb, $7::jsonb, $8)
+            {ON_CONFLICT}
+        """
+
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.executemany(sql_query, values)
+
+        # cached search results may be stale
+        clear_select_cache()
+
+
+    async def delete(self, bucket_name, file_key):
+        """
+            Deletes an raster from the database
+        """
+
+        async with self.pool.acquire() as connection:
+            await connection.execute(
+                'DELETE FROM raster WHERE bucket_name = $1 AND file_key = $2',
+                bucket_name,
+                file_key
+            )
+
+        # cached search results may be stale
+        clear_select_cache()
+
+
+    async def select(
+            self,
+            OFFSET=0,
+            LIMIT=1000,
+            **filters
+        ):
+        """
+            Returns the raster using filters, same arguments and output as Database.select
+        """
+
+        # validate input
+        if not isinstance(OFFSET, int):
+            raise Exception('invalid OFFSET arg')
+        if not isinstance(LIMIT, int):
+            raise Exception('invalid LIMIT arg')
+
+        # where statements to filter raster
+        WHERE, params = build_raster_where(**filters)
+        params['offset'] = OFFSET
+        params['limit'] = LIMIT
+
+        # Build SQL Query
+        sql_query, values = to_positional(f"""
+            SELECT
+                {raster_select_columns}
+            FROM
+                raster
+            WHERE
+                {WHERE}
+            ORDER BY
+                index
+            OFFSET
+                :offset
+            LIMIT
+                :limit
+        """, params)
+
+        async with self.pool.acquire() as connection:
+            rows = await connection.fetch(sql_query, *values)
+
+        # convert
+        results = pd.DataFrame.from_records([dict(row) for row in rows], columns=[
+            'index', 'taken_at', 'bucket_name', 'file_key', 'pixel_size_m', 'bands', 'geometry', 'created_at', 'content_hash'
+        ])
+
+        # jsonb columns are returned as str by asyncpg
+        results['bands'] = results['bands'].apply(json.loads)
+
+        return raster_results_to_gdf(results)
@@ -0,0 +1,186 @@
+"""
+    Cache of the search results, an in-process LRU with an optional on-disk tier
+"""
+
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+from glob import glob
+from collections import OrderedDict
+
+# search filters
+from .filters import parse_raster_filters
+
+
+def make_select_key(OFFSET=0, LIMIT=1000, **filters):
+    """
+        Returns the cache key of a search, the filters are normalized so equivalent searches share the same key
+    """
+
+    filters = parse_raster_filters(**filters)
+
+    # geometries are compared through their wkt
+    for k in ('point_contained', 'intersects'):
+        if filters[k] is not None:
+            filters[k] = filters[k].wkt
+
+    filters['offset'] = OFFSET
+    filters['limit'] = LIMIT
+
+    return json.dumps(filters, sort_keys=True)
+
+
+class ResultCache:
+    """
+        Class to cache search results in memory (LRU) and optionally on disk, both with a TTL
+    """
+
+    def __init__(self, max_entries=128, ttl_s=300, cache_dir=None):
+
+        # validate input
+        if not isinstance(max_entries, int) or max_entries < 0:
+            raise Exception('Invalid max_entries')
+
+        if not isinstance(ttl_s, (float, int)) or ttl_s < 0:
+            raise Exception('Invalid ttl_s')
+
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.cache_dir = cache_dir
+
+        # create the on-disk tier
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        # key -> (expires_at, value), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # counters
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+
+    def _disk_path(self, key):
+        """ Returns the path of the on-disk entry of a key """
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.pickle')
+
+
+    def get(self, key):
+        """Returns the cached value of a key, None if missing or expired
+
+        Arguments
+        ---------
+        key : str
+            Cache key
+
+        Returns
+        -------
+        value : object
+            A copy of the cached value
+        """
+
+        now = time.time()
+
+        with self._lock:
+
+            # in-process tier
+            if key in self._entries:
+                expires_at, value = self._entries[key]
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value.copy()
+                del self._entries[key]
+
+            # on-disk tier
+            if self.cache_dir is not None:
+                path = self._disk_path(key)
+                try:
+                    if os.path.getmtime(path) + self.ttl_s > now:
+                        with open(path, 'rb') as fh:
+                            value = pickle.load(fh)
+                        self._set_in_memory(key, value, os.path.getmtime(path) + self.ttl_s)
+                        self.disk_hits += 1
+                        return value.copy()
+                    os.remove(path)
+                except (OSError, pickle.UnpicklingError, EOFError):
+                    pass
+
+            self.misses += 1
+            return None
+
+
+    def _set_in_memory(self, key, value, expires_at):
+        """ Adds an entry to the in-process tier and evicts the least recently used ones """
+
+        if self.max_entries == 0:
+            return
+
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+    def set(self, key, value):
+        """Caches a value
+
+        Arguments
+        ---------
+        key : str
+            Cache key
+        value : object
+            Value to cache (DataFrame or any object with a copy method)
+        """
+
+        value = value.copy()
+
+        with self._lock:
+
+            self._set_in_memory(key, value, time.time() + self.ttl_s)
+
+            if self.cache_dir is not None:
+
+                # write then rename, so other processes never read a partial file
+                path = self._disk_path(key)
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as fh:
+                    pickle.dump(value, fh)
+                os.replace(tmp_path, path)
+
+
+    def clear(self):
+        """
+            Drops every entry of both tiers
+        """
+
+        with self._lock:
+
+            self._entries.clear()
+
+            if self.cache_dir is not None:
+                for path in glob(os.path.join(self.cache_dir, '*.pickle')):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+
+    def stats(self):
+        """
+            Returns the hit and miss counters
+        """
+
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'entries': len(self._entries)
+            }
@@ -0,0 +1,169 @@
+"""
+    Validation of the filters used to search for raster
+"""
+
+from shapely.geometry import Point
+
+# basic utils
+from ..utils.basic import is_iso_dt_str_valid
+
+# gis utils
+from ..utils.gis import aoi_to_geometry
+
+
+def parse_raster_filters(
+        TAKEN_AT_MIN=None,
+        TAKEN_AT_MAX=None,
+        PIXEL_SIZE_M_MAX=None,
+        POINT_CONTAINED=None,
+        INTERSECTS=None,
+        MIN_OVERLAP=None
+    ):
+    """Validates the search filters and returns them parsed
+
+    Arguments
+    ---------
+        TAKEN_AT_MIN : str
+            Min timestamp for when the raster was taken (ISO format)
+        TAKEN_AT_MAX : str
+            Max timestamp for when the raster was taken (ISO format)
+        PIXEL_SIZE_M_MAX : int
+            Max pixel size in ground meters
+        POINT_CONTAINED : tuple
+            Point in the (lat,lng) format that must be contained by the geometry
+        INTERSECTS : tuple, dict or str
+            Area of interest the geometry must intersect, as a (min_lng, min_lat, max_lng, max_lat)
+            bounding box or a GeoJSON
+        MIN_OVERLAP : float
+            Min fraction of the area of interest covered by the geometry, ranges between ]0.0,1.0]
+
+    Returns
+    -------
+        filters : dict
+            The filters, with the point and the area of interest as shapely geometries
+    """
+
+    # validate input
+    if TAKEN_AT_MIN is not None and not isinstance(TAKEN_AT_MIN, str):
+        raise Exception('invalid TAKEN_AT_MIN arg')
+    if TAKEN_AT_MAX is not None and not isinstance(TAKEN_AT_MAX, str):
+        raise Exception('invalid TAKEN_AT_MAX arg')
+    if PIXEL_SIZE_M_MAX is not None and not isinstance(PIXEL_SIZE_M_MAX, (float, int)):
+        raise Exception('invalid PIXEL_SIZE_M_MAX arg')
+    if POINT_CONTAINED is not None and not isinstance(POINT_CONTAINED, tuple):
+        raise Exception('invalid POINT_CONTAINED arg')
+    if MIN_OVERLAP is not None and not isinstance(MIN_OVERLAP, (float, int)):
+        raise Exception('invalid MIN_OVERLAP arg')
+    if MIN_OVERLAP is not None and (MIN_OVERLAP <= 0 or MIN_OVERLAP > 1):
+        raise Exception('MIN_OVERLAP must range between ]0.0,1.0]')
+    if MIN_OVERLAP is not None and INTERSECTS is None:
+        raise Exception('MIN_OVERLAP requires INTERSECTS')
+
+    if TAKEN_AT_MAX is not None and not is_iso_dt_str_valid(TAKEN_AT_MAX):
+        raise Exception('invalid iso format TAKEN_AT_MAX arg')
+    if TAKEN_AT_MIN is not None and not is_iso_dt_str_valid(TAKEN_AT_MIN):
+        raise Exception('invalid iso format TAKEN_AT_MIN arg')
+
+    # convert point to geometry
+    point_contained = None
+    if POINT_CONTAINED is not None:
+
+        # validate lat, lng
+        lat, lng = POINT_CONTAINED
+        if not isinstance(lat, (float, int)) or not isinstance(lng, (float, int)):
+            raise Exception('invalid POINT_CONTAINED arg')
+
+        # parse
+        point_contained = Point(lng, lat)
+
+    # convert area of interest to geometry
+    intersects = None
+    if INTERSECTS is not None:
+        intersects = aoi_to_geometry(INTERSECTS)
+
+    return {
+        'taken_at_min': TAKEN_AT_MIN,
+        'taken_at_max': TAKEN_AT_MAX,
+        'pixel_size_m_max': PIXEL_SIZE_M_MAX,
+        'point_contained': point_contained,
+        'intersects': intersects,
+        'min_overlap': MIN_OVERLAP
+    }
+
+
+def build_raster_where(
+        TAKEN_AT_MIN=None,
+        TAKEN_AT_MAX=None,
+        PIXEL_SIZE_M_MAX=None,
+        POINT_CONTAINED=None,
+        INTERSECTS=None,
+        MIN_OVERLAP=None
+    ):
+    """Validates the search filters and returns the PostGIS WHERE clause with its named bound parameters
+
+    Arguments
+    ---------
+        TAKEN_AT_MIN : str
+            Min timestamp for when the raster was taken (ISO format)
+        TAKEN_AT_MAX : str
+            Max timestamp for when the raster was taken (ISO format)
+        PIXEL_SIZE_M_MAX : int
+            Max pixel size in ground meters
+        POINT_CONTAINED : tuple
+            Point in the (lat,lng) format that must be contained by the geometry
+        INTERSECTS : tuple, dict or str
+            Area of interest the geometry must intersect, as a (min_lng, min_lat, max_lng, max_lat)
+            bounding box or a GeoJSON
+        MIN_OVERLAP : float
+            Min fraction of the area of interest covered by the geometry, ranges between ]0.0,1.0]
+
+    Returns
+    -------
+        where : str
+            Conditions of the WHERE clause
+        params : dict
+            Parameters bound to the conditions
+    """
+
+    # validate input
+    filters = parse_raster_filters(
+        TAKEN_AT_MIN=TAKEN_AT_MIN,
+        TAKEN_AT_MAX=TAKEN_AT_MAX,
+        PIXEL_SIZE_M_MAX=PIXEL_SIZE_M_MAX,
+        POINT_CONTAINED=POINT_CONTAINED,
+        INTERSECTS=INTERSECTS,
+        MIN_OVERLAP=MIN_OVERLAP
+    )
+
+    # where statements to filter raster
+    where = ['true']
+    params = {}
+
+    if filters['taken_at_min'] is not None:
+        where.append('taken_at >= :taken_at_min')
+        params['taken_at_min'] = filters['taken_at_min']
+
+    if filters['taken_at_max'] is not None:
+        where.append('taken_at <= :taken_at_max')
+        params['taken_at_max'] = filters['taken_at_max']
+
+    if filters['pixel_size_m_max'] is not None:
+        where.append('pixel_size_m <= :pixel_size_m_max')
+        params['pixel_size_m_max'] = filters['pixel_size_m_max']
+
+    if filters['point_contained'] is not None:
+        where.append('ST_Contains(geometry, ST_GeomFromText(:point_contained))')
+        params['point_contained'] = filters['point_contained'].wkt
+
+    if filters['intersects'] is not None:
+        # the bounding box operator && is answered by the GiST index, ST_Intersects refines it
+        where.append('geometry && ST_GeomFromText(:intersects)')
+        where.append('ST_Intersects(geometry, ST_GeomFromText(:intersects))')
+        params['intersects'] = filters['intersects'].wkt
+
+    if filters['min_overlap'] is not None:
+        # fraction of the area of interest covered by the raster
+        where.append('ST_Area(ST_Intersection(geometry, ST_GeomFromText(:intersects))) >= :min_overlap * ST_Area(ST_GeomFromText(:intersects))')
+        params['min_overlap'] = filters['min_overlap']
+
+    return ' AND '.join(where), params
@@ -0,0 +1,293 @@
+"""
+    Local offline replica of the raster table, stored in SQLite with an R-tree spatial index
+"""
+
+import os
+import json
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+import geopandas as gpd
+
+from shapely.wkb import loads as wkb_loads
+
+# config file interface
+from ..config import get_config, REPLICA_PATH_KEY
+
+# search filters
+from .filters import parse_raster_filters
+
+
+# data model of the replica, mirrors the raster table of the database
+create_replica_queries = [
+    """
+    CREATE TABLE IF NOT EXISTS raster (
+        "index" INTEGER NOT NULL,
+        taken_at TEXT NOT NULL,
+        bucket_name TEXT NOT NULL,
+        file_key TEXT NOT NULL,
+        pixel_size_m INTEGER NOT NULL,
+        geometry BLOB NOT NULL,
+        bands TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        content_hash TEXT,
+        PRIMARY KEY("index"),
+        UNIQUE (bucket_name, file_key)
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS raster_taken_at_idx ON raster (taken_at)',
+    'CREATE INDEX IF NOT EXISTS raster_pixel_size_m_idx ON raster (pixel_size_m)',
+    'CREATE VIRTUAL TABLE IF NOT EXISTS raster_rtree USING rtree(id, min_x, max_x, min_y, max_y)'
+]
+
+# columns of the replica, in the order returned by select like Database.select
+replica_columns = ['index', 'taken_at', 'bucket_name', 'file_key', 'pixel_size_m', 'bands', 'geometry', 'created_at', 'content_hash']
+
+
+__replica = None
+def get_replica():
+    global __replica
+
+    if __replica is None:
+        __replica = Replica(get_config()[REPLICA_PATH_KEY])
+
+    return __replica
+
+
+def normalize_timestamp(dt_str):
+    """
+        Converts an ISO timestamp to the '%Y-%m-%d %H:%M:%S' format used in the replica
+    """
+
+    try:
+        dt = datetime.fromisoformat(dt_str)
+    except:
+        dt = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
+
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class Replica:
+    """
+        Class to search a local copy of the raster table without reaching the database
+    """
+
+    def __init__(self, replica_path):
+
+        self.replica_path = replica_path
+
+        # create the parent directory
+        replica_dir = os.path.dirname(replica_path)
+        if replica_dir != '' and not os.path.isdir(replica_dir):
+            os.makedirs(replica_dir)
+
+        # connect
+        self.connection = sqlite3.connect(replica_path, check_same_thread=False)
+
+        # create the tables
+        with self.connection:
+            for query in create_replica_queries:
+                self.connection.execute(query)
+
+            # replica created before the content hash was added, its rows get one on the next full sync
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(raster)')]
+            if 'content_hash' not in columns:
+                self.connection.execute('ALTER TABLE raster ADD COLUMN content_hash TEXT')
+
+
+    def get_high_water_mark(self):
+        """
+            Returns the greatest index stored in the replica (None if empty)
+        """
+
+        return self.connection.execute('SELECT MAX("index") FROM raster').fetchone()[0]
+
+
+    def count(self):
+        """
+            Returns the number of raster stored in the replica
+        """
+
+        return self.connection.execute('SELECT COUNT(*) FROM raster').fetchone()[0]
+
+
+    def clear(self):
+        """
+            Deletes every raster from the replica
+        """
+
+        with self.connection:
+            self.connection.execute('DELETE FROM raster')
+            self.connection.execute('DELETE FROM raster_rtree')
+
+
+    def sync(self, database, full=False, page_size=10000):
+        """Copies the raster added to the database since the last sync
+
+        The greatest index in the replica is used as a high-water mark. Rows updated in place
+        (upserts) or deleted from the database since the last sync are only picked up by a full sync.
+
+        Arguments
+        ---------
+            database : Database
+                Database to copy the raster from
+            full : bool
+                If true the replica is emptied and rebuilt from scratch
+            page_size : int
+                Number of rows fetched from the database per page
+
+        Returns
+        -------
+            nbr_of_rows : int
+                Number of rows copied
+        """
+
+        if full:
+            self.clear()
+
+        nbr_of_rows = 0
+        for chunk in database.stream(AFTER_INDEX=self.get_high_water_mark(), PAGE_SIZE=page_size):
+
+            rows = []
+            bounds = []
+            for record in chunk.to_dict(orient='records'):
+
+                geometry = record['geometry']
+                content_hash = record.get('content_hash', None)
+                rows.append((
+                    int(record['index']),
+                    record['taken_at'],
+                    record['bucket_name'],
+                    record['file_key'],
+                    int(record['pixel_size_m']),
+                    geometry.wkb,
+                    json.dumps(record['bands']),
+                    record['created_at'],
+                    content_hash if isinstance(content_hash, str) else None
+                ))
+
+                min_x, min_y, max_x, max_y = geometry.bounds
+                bounds.append((int(record['index']), min_x, max_x, min_y, max_y))
+
+            # commit each chunk, an interrupted sync resumes from the last one
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO raster ("index", taken_at, bucket_name, file_key, pixel_size_m, geometry, bands, created_at, content_hash) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    rows
+                )
+                self.connection.executemany('INSERT OR REPLACE INTO raster_rtree VALUES (?, ?, ?, ?, ?)', bounds)
+
+            nbr_of_rows += len(rows)
+
+        return nbr_of_rows
+
+
+    def select(
+            self,
+            OFFSET=0,
+            LIMIT=1000,
+            TAKEN_AT_MIN=None,
+            TAKEN_AT_MAX=None,
+            PIXEL_SIZE_M_MAX=None,
+            POINT_CONTAINED=None,
+            INTERSECTS=None,
+            MIN_OVERLAP=None
+        ):
+        """
+            Returns the raster using filters, same arguments and output as Database.select
+        """
+
+        # validate input
+        if not isinstance(OFFSET, int):
+            raise Exception('invalid OFFSET arg')
+        if not isinstance(LIMIT, int):
+            raise Exception('invalid LIMIT arg')
+
+        filters = parse_raster_filters(
+            TAKEN_AT_MIN=TAKEN_AT_MIN,
+            TAKEN_AT_MAX=TAKEN_AT_MAX,
+            PIXEL_SIZE_M_MAX=PIXEL_SIZE_M_MAX,
+            POINT_CONTAINED=POINT_CONTAINED,
+            INTERSECTS=INTERSECTS,
+            MIN_OVERLAP=MIN_OVERLAP
+        )
+
+        # where statements to filter raster
+        where = ['1']
+        params = []
+
+        if filters['taken_at_min'] is not None:
+            where.append('taken_at >= ?')
+            params.append(normalize_timestamp(filters['taken_at_min']))
+
+        if filters['taken_at_max'] is not None:
+            where.append('taken_at <= ?')
+            params.append(normalize_timestamp(filters['taken_at_max']))
+
+        if filters['pixel_size_m_max'] is not None:
+            where.append('pixel_size_m <= ?')
+            params.append(filters['pixel_size_m_max'])
+
+        # the r-tree only returns candidates whose bounding box matches, they are refined below
+        for geometry in (filters['point_contained'], filters['intersects']):
+            if geometry is not None:
+                min_x, min_y, max_x, max_y = geometry.bounds
+                where.append('"index" IN (SELECT id FROM raster_rtree WHERE min_x <= ? AND max_x >= ? AND min_y <= ? AND max_y >= ?)')
+                params += [max_x, min_x, max_y, min_y]
+
+        sql_query = f"""
+            SELECT
+                "index", taken_at, bucket_name, file_key, pixel_size_m, bands, geometry, created_at, content_hash
+            FROM
+                raster
+            WHERE
+                {' AND '.join(where)}
+            ORDER BY
+                "index"
+        """
+
+        # refine the candidates and page through the matches
+        records = []
+        nbr_of_matches = 0
+        for row in self.connection.execute(sql_query, params):
+
+            geometry = wkb_loads(row[6])
+
+            if filters['point_contained'] is not None and not geometry.contains(filters['point_contained']):
+                continue
+
+            if filters['intersects'] is not None:
+
+                if not geometry.intersects(filters['intersects']):
+                    continue
+
+                if filters['min_overlap'] is not None:
+                    overlap = geometry.intersection(filters['intersects']).area
+                    if overlap < filters['min_overlap'] * filters['intersects'].area:
+                        continue
+
+            nbr_of_matches += 1
+            if nbr_of_matches <= OFFSET:
+                continue
+
+            records.append({
+                'index': row[0],
+                'taken_at': row[1],
+                'bucket_name': row[2],
+                'file_key': row[3],
+                'pixel_size_m': row[4],
+                'bands': json.loads(row[5]),
+                'geometry': geometry,
+                'created_at': row[7],
+                'content_hash': row[8]
+            })
+
+            if len(records) >= LIMIT:
+                break
+
+        # convert to geodataframe
+        results = gpd.GeoDataFrame(pd.DataFrame.from_records(records, columns=replica_columns))
+
+        return results
@@ -1 +1,9 @@
-from . import gis, raster, basic
+import importlib
+
+# imported on first access, raster and gis pull rasterio and geopandas
+__all__ = ['gis', 'raster', 'basic']
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__} has no attribute {name}')
@@ -3,10 +3,23 @@
 """
 
 import os
+import queue
 import logging
+import hashlib
+import threading
 from datetime import datetime
 from uuid import uuid4
 
+# boto3's default multipart threshold and part size
+DEFAULT_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+DEFAULT_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+# S3 limits a multipart upload to 10,000 parts
+MAX_MULTIPART_PARTS = 10000
+
+# prefix of the files stored in the cloudstorage
+S3_URI_PREFIX = 's3://'
+
 def get_uuid():
     """
         Returns a random uuid4
@@ -53,3 +66,198 @@ def is_int(val):
         return False
 
     return True
+
+
+def is_s3_uri(path):
+    """
+        Returns true if path is a s3://bucket/key uri
+    """
+    return isinstance(path, str) and path.startswith(S3_URI_PREFIX)
+
+
+def parse_s3_uri(uri):
+    """
+        Splits a s3://bucket/key uri into its bucket name and file key
+    """
+
+    if not is_s3_uri(uri):
+        raise Exception(f'Invalid s3 uri {uri}')
+
+    bucket_name, _, file_key = uri[len(S3_URI_PREFIX):].partition('/')
+    if bucket_name == '' or file_key == '':
+        raise Exception(f'Invalid s3 uri {uri}')
+
+    return bucket_name, file_key
+
+
+def is_float(val):
+    """
+        Returns true if value can be converted to float
+    """
+
+    try:
+        _ = float(val)
+    except:
+        return False
+
+    return True
+
+
+def get_content_hash(file_path, multipart_threshold=DEFAULT_MULTIPART_THRESHOLD, multipart_chunksize=DEFAULT_MULTIPART_CHUNKSIZE):
+    """Returns the hash of a file's content, equal to the ETag S3 gives the file when uploaded by boto3
+
+    Files smaller than the multipart threshold get the md5 of their content, larger files get
+    the md5 of the concatenated md5 of each part followed by the number of parts (e.g. '<md5>-12').
+    The file is read one part at a time.
+
+    Arguments
+    ---------
+    file_path : str
+        Path to the file
+    multipart_threshold : int
+        Size in bytes from which boto3 uploads the file in parts
+    multipart_chunksize : int
+        Size in bytes of each part
+
+    Returns
+    -------
+    content_hash : str
+        Hash of the file's content
+    """
+
+    filesize = os.path.getsize(file_path)
+
+    # single part upload
+    if filesize < multipart_threshold:
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(multipart_chunksize), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    # boto3 doubles the part size until the upload fits in the parts limit
+    while filesize > multipart_chunksize * MAX_MULTIPART_PARTS:
+        multipart_chunksize *= 2
+
+    # multipart upload
+    digests = []
+    with open(file_path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(multipart_chunksize), b''):
+            digests.append(hashlib.md5(chunk).digest())
+
+    return f'{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}'
+
+
+def get_bytes_content_hash(content, multipart_threshold=DEFAULT_MULTIPART_THRESHOLD, multipart_chunksize=DEFAULT_MULTIPART_CHUNKSIZE):
+    """
+        Returns the hash of an in-memory file's content, the one get_content_hash gives the file once written to disk
+    """
+
+    # single part upload
+    if len(content) < multipart_threshold:
+        return hashlib.md5(content).hexdigest()
+
+    # boto3 doubles the part size until the upload fits in the parts limit
+    while len(content) > multipart_chunksize * MAX_MULTIPART_PARTS:
+        multipart_chunksize *= 2
+
+    # multipart upload
+    view = memoryview(content)
+    digests = [hashlib.md5(view[i:i+multipart_chunksize]).digest() for i in range(0, len(content), multipart_chunksize)]
+
+    return f'{hashlib.md5(b"".join(digests)).hexdigest()}-{len(digests)}'
+
+
+def prefetch(iterable, maxsize=10000):
+    """Iterates over an iterable in a background thread, at most maxsize items ahead of the consumer
+
+    Arguments
+    ---------
+    iterable : iterable
+        Iterable to consume in the background, e.g. a paginated listing
+    maxsize : int
+        Max number of items buffered
+
+    Returns
+    -------
+    generator
+        The items of the iterable, an exception raised by the iterable is raised again by the generator
+    """
+
+    done = object()
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                buffer.put(item)
+        except Exception as e:
+            buffer.put((done, e))
+            return
+        buffer.put((done, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if isinstance(item, tuple) and len(item) == 2 and item[0] is done:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+
+    finally:
+        # let the producer exit if the consumer stops early
+        stop.set()
+        while thread.is_alive():
+            try:
+                buffer.get_nowait()
+            except queue.Empty:
+                thread.join(0.1)
+
+
+def get_available_memory():
+    """Returns the number of bytes of memory that can still be allocated
+
+    The memory available on the host is capped by the limit of the cgroup, e.g. of the docker container
+
+    Returns
+    -------
+    nbr_of_bytes : int
+        Available memory in bytes
+    """
+
+    # host
+    available = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    try:
+        with open('/proc/meminfo', 'r') as fh:
+            for line in fh:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+
+    # cgroup v2 then v1
+    for limit_path, usage_path in [
+            ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+            ('/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes')
+        ]:
+        try:
+            with open(limit_path, 'r') as fh:
+                limit = fh.read().strip()
+            with open(usage_path, 'r') as fh:
+                usage = int(fh.read().strip())
+        except (OSError, ValueError):
+            continue
+
+        if limit != 'max':
+            available = min(available, max(0, int(limit) - usage))
+        break
+
+    return available
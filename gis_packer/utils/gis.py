@@ -5,7 +5,8 @@
 import json
 import numpy as np
 
-from shapely.geometry import Point
+from shapely.geometry import Point, box, shape
+from shapely.ops import unary_union
 import geopandas as gpd
 
 
@@ -376,3 +377,63 @@ def get_crs(satdata):
         Returns the ESPG CRS code
     """
     return str(satdata.crs).split(':')[-1]
+
+
+def aoi_to_geometry(aoi):
+    """Takes an area of interest as input and returns it as a shapely geometry
+
+    Arguments
+    ---------
+    aoi : tuple, list, dict or str
+        Bounding box in the (min_lng, min_lat, max_lng, max_lat) order, or a GeoJSON
+        Geometry, Feature or FeatureCollection (as a dict or as a json str)
+
+    Returns
+    -------
+    geometry : shapely.geometry
+        Geometry of the area of interest
+    """
+
+    # bounding box
+    if isinstance(aoi, (tuple, list)):
+
+        if len(aoi) != 4:
+            raise Exception('Bounding box must be of length 4')
+
+        for val in aoi:
+            if not isinstance(val, (float, int)):
+                raise Exception('Bounding box components must be numbers')
+
+        min_lng, min_lat, max_lng, max_lat = aoi
+        if min_lng >= max_lng or min_lat >= max_lat:
+            raise Exception('Bounding box must be in the (min_lng, min_lat, max_lng, max_lat) order')
+
+        return box(min_lng, min_lat, max_lng, max_lat)
+
+    # geojson as str
+    if isinstance(aoi, str):
+        try:
+            aoi = json.loads(aoi)
+        except:
+            raise Exception('Invalid GeoJSON')
+
+    if not isinstance(aoi, dict) or 'type' not in aoi:
+        raise Exception('Invalid GeoJSON')
+
+    # grab the geometries
+    if aoi['type'] == 'FeatureCollection':
+        geometries = [shape(feature['geometry']) for feature in aoi['features']]
+    elif aoi['type'] == 'Feature':
+        geometries = [shape(aoi['geometry'])]
+    else:
+        geometries = [shape(aoi)]
+
+    if len(geometries) == 0:
+        raise Exception('GeoJSON has no geometry')
+
+    geometry = unary_union(geometries)
+
+    if geometry.is_empty or not geometry.is_valid:
+        raise Exception('Invalid GeoJSON geometry')
+
+    return geometry
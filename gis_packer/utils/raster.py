@@ -4,47 +4,173 @@ from .gis import get_pixel_in_m, bboxes_to_GeoJSON, pixel_bbox_to_lat_lng, bound
 # basics
 import os
 import json
+from functools import partial
 from tqdm import tqdm
 from humanize import naturalsize as sz
 
 import numpy as np
-import matplotlib.pyplot as plt
 
-from PIL import Image
-
-from .basic import get_iso_timestamp, is_int
+from .basic import get_iso_timestamp, is_int, is_s3_uri, parse_s3_uri
 
 # import rasterio's tools
 import rasterio
-from rasterio.plot import show as rasterio_show
 from rasterio.mask import mask
+from rasterio.io import MemoryFile, DatasetReaderBase
+from rasterio.enums import Resampling
+from rasterio.session import AWSSession
 from rasterio.warp import calculate_default_transform
 from rasterio.warp import reproject as rasterio_reproject
 
-# xarray
-import xarray as xr
+# matplotlib and xarray are only imported by the functions displaying raster, they are slow to import
 
 # Pretty print
 import pprint
 pp = pprint.PrettyPrinter(depth=4)
 
 
+# GDAL options for the raster read from the cloudstorage, tuned so a COG is read in a few range requests
+REMOTE_GDAL_OPTIONS = {
+
+    # don't list the bucket or look for sidecar files (.aux.xml, .ovr, ...) when opening a file
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif,.tiff,.TIF,.TIFF',
+
+    # the header and the tile offsets of a COG are fetched with the first request
+    'GDAL_INGESTED_BYTES_AT_OPEN': 65536,
+
+    # contiguous tiles are fetched in a single range request, over a reused http/2 connection
+    'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+    'GDAL_HTTP_MULTIPLEX': 'YES',
+    'GDAL_HTTP_VERSION': '2',
+
+    # keep the fetched blocks in memory so they are not requested twice
+    'VSI_CACHE': 'TRUE',
+    'VSI_CACHE_SIZE': 64 * 1024 * 1024,
+    'CPL_VSIL_CURL_CACHE_SIZE': 256 * 1024 * 1024,
+
+    # retry on throttling
+    'GDAL_HTTP_MAX_RETRY': 3,
+    'GDAL_HTTP_RETRY_DELAY': 1
+}
+
+
+__remote_env = None
+def get_remote_env():
+    global __remote_env
+
+    if __remote_env is None:
+
+        from ..config import get_config, AWS_ACCESS_ID_KEY, AWS_ACCESS_SECRET_KEY, AWS_REGION_KEY
+
+        # grab config
+        config = get_config()
+        session = AWSSession(
+            aws_access_key_id=config[AWS_ACCESS_ID_KEY],
+            aws_secret_access_key=config[AWS_ACCESS_SECRET_KEY],
+            region_name=config[AWS_REGION_KEY]
+        )
+
+        # entered for the lifetime of the process, the datasets returned by load read their blocks lazily
+        __remote_env = rasterio.Env(session=session, **REMOTE_GDAL_OPTIONS)
+        __remote_env.__enter__()
+
+    return __remote_env
+
+
+def to_gdal_path(src_path):
+    """
+        Returns the path GDAL must open, s3://bucket/key uris are mapped to /vsis3/bucket/key or to the path of the file for local buckets
+    """
+
+    if not is_s3_uri(src_path):
+        return src_path
+
+    bucket_name, file_key = parse_s3_uri(src_path)
+
+    # local buckets are read directly
+    from ..cloudstorage import get_cloudstorage
+    local_path = get_cloudstorage().get_local_path(bucket_name, file_key)
+    if local_path is not None:
+        return local_path
+
+    # credentials and http options
+    get_remote_env()
+
+    return f'/vsis3/{bucket_name}/{file_key}'
+
+
+def get_size(src_path):
+    """
+        Returns the size in bytes of a local file or of a file in the cloudstorage
+    """
+
+    if not is_s3_uri(src_path):
+        return os.path.getsize(src_path)
+
+    from ..cloudstorage import get_cloudstorage
+
+    metadata = get_cloudstorage().head(*parse_s3_uri(src_path))
+    if metadata is None:
+        raise Exception(f'File not found at {src_path}')
+
+    return metadata['ContentLength']
+
+
+def get_array_size(src_path):
+    """
+        Returns the number of bytes the pixels of an image take once loaded in memory
+    """
+
+    with rasterio.open(to_gdal_path(src_path)) as src:
+        return src.width * src.height * sum([np.dtype(dtype).itemsize for dtype in src.dtypes])
+
+
+def validate_out_path(out_path):
+    """
+        Raises if the output path is neither in a writable directory nor a s3://bucket/key uri
+    """
+
+    if is_s3_uri(out_path):
+        parse_s3_uri(out_path)
+    elif not os.access(os.path.dirname(out_path), os.W_OK):
+        raise Exception(f'Invalid output path')
+
+
+def validate_out_dir(out_dir):
+    """
+        Raises if the output directory is neither a directory nor a s3://bucket/prefix/ uri
+    """
+
+    if is_s3_uri(out_dir):
+        if not out_dir.endswith('/'):
+            raise Exception(f'Output prefix must end with / {out_dir}')
+    elif not os.path.isdir(out_dir):
+        raise Exception(f'Invalid output dir {out_dir}')
+
 
 def load(src_path):
     """
-        Loads raster as a rasterio object
+        Loads raster as a rasterio object, from disk or from a s3://bucket/key uri
+
+        Only the header is read when loading a file from the cloudstorage, the pixels are
+        fetched with range requests when read so windowed reads only download the blocks they need.
+        An opened dataset is returned as is.
     """
 
+    # already opened, e.g. an in-memory file
+    if isinstance(src_path, DatasetReaderBase):
+        return src_path
+
     # validate input
     if src_path is None or src_path == '':
         raise Exception('Must provide a file path')
 
     # check if on disk
-    if not os.path.exists(src_path):
+    if not is_s3_uri(src_path) and not os.path.exists(src_path):
         raise Exception(f'File not found at {src_path}')
 
     # load with rasterio
-    satdata = rasterio.open(src_path)
+    satdata = rasterio.open(to_gdal_path(src_path))
 
     return satdata
 
@@ -74,7 +200,7 @@ def get_attributes(src_path):
     # grab image m / pixel
     x_res_in_m, y_res_in_m = get_pixel_in_m(satdata)
     pixel_size_m = (x_res_in_m + y_res_in_m)/2.0
-    attributes['pixel_size_m'] = pixel_size_m
+    attributes['pixel_size_m'] = int(round(pixel_size_m))
 
     # set geometry
     lat_1 = satdata.bounds.bottom
@@ -86,10 +212,10 @@ def get_attributes(src_path):
     # grab crs
     crs = get_crs(satdata)
 
-    # set profile
+    # set profile, as a plain json dict
     profile = dict({k:v for k, v in satdata.profile.items() if k != 'crs'})
     profile['crs'] = crs
-    attributes['profile'] = json.dumps(profile)
+    attributes['profile'] = json.loads(json.dumps(profile))
 
     return attributes
 
@@ -217,6 +343,8 @@ def show(src_path):
     if not isinstance(satdata, rasterio.io.DatasetReader):
         raise Exception('Wrong Format')
 
+    from rasterio.plot import show as rasterio_show
+
     rasterio_show(satdata)
 
 
@@ -230,44 +358,192 @@ def show_chunk(src_path, chunk_size=512, offset_x=0, offset_y=0, block_size=512)
     if offset_y is None:
         offset_y = 0
 
+    import xarray as xr
+    import matplotlib.pyplot as plt
+
     # load
-    bands = xr.open_rasterio(src_path, chunks={'x':block_size, 'y':block_size})
+    bands = xr.open_rasterio(to_gdal_path(src_path), chunks={'x':block_size, 'y':block_size})
 
     # show
     _ = bands[:, offset_y:chunk_size+offset_y, offset_x:chunk_size+offset_x].plot.imshow()
     plt.show()
 
 
-def write(data, meta, bands, out_path):
+def quicklook(src_path, out_path, max_size=1024):
+    """Writes a downsampled copy of a raster, to preview large files
+
+    The pixels are read decimated, so GDAL uses the overviews of a COG when it has some
+    instead of reading the full resolution image
+
+    Arguments
+    ---------
+        src_path : str
+            Path to source .tif file or s3://bucket/key uri
+        out_path : str
+            Path to output .tif file
+        max_size : int
+            Maximum width and height in pixels of the output
     """
-        Write file with description and metadata
+
+    # load file
+    satdata = load(src_path)
+
+    # check out path
+    validate_out_path(out_path)
+
+    # validate input
+    if not is_int(max_size) or int(max_size) < 1:
+        raise Exception('Invalid max size')
+
+    # output dimensions, never upsampled
+    scale = max(1.0, max(satdata.width, satdata.height) / float(max_size))
+    width = max(1, int(satdata.width / scale))
+    height = max(1, int(satdata.height / scale))
+
+    # read decimated
+    data = satdata.read(out_shape=(satdata.count, height, width), resampling=Resampling.average)
+
+    # update metadata with the new resolution
+    meta = satdata.meta.copy()
+    meta.update({
+        'transform': satdata.transform * satdata.transform.scale(satdata.width / width, satdata.height / height),
+        'width': width,
+        'height': height
+    })
+
+    # grab bands info
+    bands_dict = bands_info(src_path)
+
+    # write
+    write(data, meta, bands_dict, out_path)
+
+
+def write_bands(dst, data, bands):
+    """
+        Writes the pixels, the bands description and metadata to an opened dataset
     """
 
-    with rasterio.open(out_path, 'w', **meta) as dst:
+    # write
+    dst.write(data)
 
-        # write
-        dst.write(data)
+    # write bands info
+    for i in range(0, len(data)):
 
-        # write bands info
-        for i in range(0, len(data)):
+        # grab band index
+        band_index = i+1
 
-            # grab band index
-            band_index = i+1
+        # grab description
+        description = bands[band_index]['description']
+
+        # grab band's metadata
+        band_metadata = bands[band_index]['metadata']
 
-            # grab description
-            description = bands[band_index]['description']
+        # description
+        dst.set_band_description(band_index, description)
 
-            # grab band's metadata
-            band_metadata = bands[band_index]['metadata']
+        # update tags
+        if 'wavelength_units' in band_metadata.keys():
+            dst.update_tags(band_index, wavelength_units=band_metadata['wavelength_units'])
+        if 'wavelength' in band_metadata.keys():
+            dst.update_tags(band_index, wavelength=band_metadata['wavelength'])
+
+
+def register(bucket_name, file_key, content_hash, attributes):
+    """
+        Adds the attributes of a raster uploaded to the cloudstorage to the database, deletes the file if it fails
+    """
 
-            # description
-            dst.set_band_description(band_index, description)
+    from ..database import get_database
+    from ..cloudstorage import get_cloudstorage
 
-            # update tags
-            if 'wavelength_units' in band_metadata.keys():
-                dst.update_tags(band_index, wavelength_units=band_metadata['wavelength_units'])
-            if 'wavelength' in band_metadata.keys():
-                dst.update_tags(band_index, wavelength=band_metadata['wavelength'])
+    try:
+        get_database().insert(
+            attributes['taken_at'],
+            bucket_name,
+            file_key,
+            attributes['pixel_size_m'],
+            attributes['geometry'],
+            attributes['bands'],
+            attributes['profile'],
+            content_hash=content_hash
+        )
+
+    except Exception as e:
+        get_cloudstorage().delete(bucket_name, file_key)
+        raise Exception(f'Could not insert meta data into the database, file deleted from the cloudstorage : {e}')
+
+
+def close_uploads(uploads):
+    """
+        Waits for the uploads of an UploadQueue and raises if any failed
+    """
+
+    failures = [r for r in uploads.close() if not r['success']]
+    if len(failures) > 0:
+        raise Exception(f"{len(failures)} upload(s) failed, first error on {failures[0]['file_key']} : {failures[0]['error']}")
+
+
+def get_upload_queue():
+    """
+        Returns a new UploadQueue on the cloudstorage, to share between many writes to s3:// uris
+    """
+
+    from ..cloudstorage import get_cloudstorage
+    from ..cloudstorage.upload_queue import UploadQueue
+
+    return UploadQueue(get_cloudstorage())
+
+
+def write(data, meta, bands, out_path, uploads=None, register_in_db=False):
+    """Write file with description and metadata
+
+    When out_path is a s3://bucket/key uri the file is encoded in memory and uploaded without touching
+    the disk, through uploads if provided (the upload then happens in the background) or right away otherwise
+
+    Arguments
+    ---------
+        data : numpy.ndarray
+            Pixels as a (bands, height, width) array
+        meta : dict
+            Rasterio metadata of the file
+        bands : dict
+            Bands information, see bands_info
+        out_path : str
+            Path to output .tif file or s3://bucket/key uri
+        uploads : UploadQueue
+            Queue used to upload the s3:// outputs, see get_upload_queue
+        register_in_db : bool
+            If true the attributes of a s3:// output are added to the database once uploaded
+    """
+
+    # local file
+    if not is_s3_uri(out_path):
+        with rasterio.open(out_path, 'w', **meta) as dst:
+            write_bands(dst, data, bands)
+        return
+
+    bucket_name, file_key = parse_s3_uri(out_path)
+
+    # encode in memory
+    with MemoryFile() as memfile:
+        with memfile.open(**meta) as dst:
+            write_bands(dst, data, bands)
+
+        on_uploaded = None
+        if register_in_db:
+            with memfile.open() as satdata:
+                on_uploaded = partial(register, attributes=get_attributes(satdata))
+
+        memfile.seek(0)
+        content = memfile.read()
+
+    # upload
+    if uploads is not None:
+        uploads.submit(bucket_name, file_key, content, on_uploaded=on_uploaded)
+    else:
+        uploads = get_upload_queue()
+        uploads.submit(bucket_name, file_key, content, on_uploaded=on_uploaded)
+        close_uploads(uploads)
 
 
 def unstack_bands(src_path, out_dir):
@@ -279,8 +555,7 @@ def unstack_bands(src_path, out_dir):
     satdata = load(src_path)
 
     # check out dir
-    if not os.path.isdir(out_dir):
-        raise Exception(f'Invalid output dir {out_dir}')
+    validate_out_dir(out_dir)
 
     # get basename
     basename = os.path.basename(src_path)
@@ -303,28 +578,41 @@ def unstack_bands(src_path, out_dir):
     # init list with all the names
     out_paths = []
 
-    # save bands
-    for i, band in enumerate(data):
+    # the bands sent to the cloudstorage are uploaded in the background
+    uploads = get_upload_queue() if is_s3_uri(out_dir) else None
 
-        # grab band index
-        band_index = i+1
+    try:
+        # save bands
+        for i, band in enumerate(data):
 
-        # output name
-        new_basename = basename.replace('.', f'_{band_index}.')
-        out_path = os.path.join(out_dir, new_basename)
+            # grab band index
+            band_index = i+1
 
-        # band info
-        new_bands_dict = {}
-        new_bands_dict[1] = bands_dict[band_index]
+            # output name
+            new_basename = basename.replace('.', f'_{band_index}.')
+            out_path = os.path.join(out_dir, new_basename)
 
-        # add dimensions
-        band = band[np.newaxis, :, :]
+            # band info
+            new_bands_dict = {}
+            new_bands_dict[1] = bands_dict[band_index]
 
-        # write
-        write(band, meta, new_bands_dict, out_path)
+            # add dimensions
+            band = band[np.newaxis, :, :]
 
-        # append
-        out_paths.append(out_path)
+            # write
+            write(band, meta, new_bands_dict, out_path, uploads=uploads)
+
+            # append
+            out_paths.append(out_path)
+
+    except:
+        # stop the upload threads, the error of the write is the one raised
+        if uploads is not None:
+            uploads.close()
+        raise
+
+    if uploads is not None:
+        close_uploads(uploads)
 
     return out_paths
 
@@ -345,8 +633,7 @@ def stack_bands(src_dir, out_path):
         raise Exception('Invalid source directory')
 
     # check out path
-    if not os.access(os.path.dirname(out_path), os.W_OK):
-        raise Exception(f'Invalid output path')
+    validate_out_path(out_path)
 
     # grab all files in source dir
     src_paths = []
@@ -430,8 +717,7 @@ def select_bands(src_path, out_path, band_indexes):
     satdata = load(src_path)
 
     # check out path
-    if not os.access(os.path.dirname(out_path), os.W_OK):
-        raise Exception(f'Invalid output path')
+    validate_out_path(out_path)
 
     # check number of bands
     nbr_of_bands = satdata.count
@@ -501,8 +787,7 @@ def fix_nodata(src_path, out_path):
     satdata = load(src_path)
 
     # check out path
-    if not os.access(os.path.dirname(out_path), os.W_OK):
-        raise Exception(f'Invalid output path')
+    validate_out_path(out_path)
 
     # load metadata
     meta = satdata.meta.copy()
@@ -547,14 +832,13 @@ def compress(src_path, out_path, compression_type='JPEG'):
     satdata = load(src_path)
 
     # check out path
-    if not os.access(os.path.dirname(out_path), os.W_OK):
-        raise Exception(f'Invalid output path')
+    validate_out_path(out_path)
 
     # get the metadata of original GeoTIFF:
     meta = satdata.meta.copy()
 
     # get initial size in bytes
-    init_size = os.path.getsize(src_path)
+    init_size = get_size(src_path)
 
     # check number of bands
     nbr_of_bands = satdata.count
@@ -592,7 +876,7 @@ def compress(src_path, out_path, compression_type='JPEG'):
     write(data, meta, bands_dict, out_path)
 
     # returns size in bytes
-    final_size = os.path.getsize(out_path)
+    final_size = get_size(out_path)
 
     # compute diff
     ratio = round(10000.0*final_size/float(init_size))/100.0
@@ -610,8 +894,7 @@ def to_uint8(src_path, out_path, min_pixel_value=None, max_pixel_value=None):
     satdata = load(src_path)
 
     # check out path
-    if not os.access(os.path.dirname(out_path), os.W_OK):
-        raise Exception(f'Invalid output path')
+    validate_out_path(out_path)
 
     # get the metadata of original GeoTIFF:
     meta = satdata.meta
@@ -682,17 +965,18 @@ def to_uint8(src_path, out_path, min_pixel_value=None, max_pixel_value=None):
     write(scaled_img, meta, bands_dict, out_path)
 
 
-def crop(src_path, out_path, aoi_geojson):
+def crop(src_path, out_path, aoi_geojson, uploads=None, register_in_db=False):
     """
-        Crop raster using a Postgis Box2d geometry
+        Crop raster using a Postgis Box2d geometry, only the window covering the AOI is read
+
+        The output can be a s3://bucket/key uri, see write for uploads and register_in_db
     """
 
     # load raster
     satdata = load(src_path)
 
     # check out path
-    if not os.access(os.path.dirname(out_path), os.W_OK):
-        raise Exception(f'Invalid output path')
+    validate_out_path(out_path)
 
     # Using a copy of the metadata from our original raster dataset, we can write a new geoTIFF
     # containing the new, clipped raster data:
@@ -715,7 +999,7 @@ def crop(src_path, out_path, aoi_geojson):
     bands_dict = bands_info(src_path)
 
     # write the clipped-and-cropped dataset to a new GeoTIFF
-    write(clipped, meta, bands_dict, out_path)
+    write(clipped, meta, bands_dict, out_path, uploads=uploads, register_in_db=register_in_db)
 
 
 def reproject(src_path, out_path, target_crs='4326'):
@@ -739,8 +1023,7 @@ def reproject(src_path, out_path, target_crs='4326'):
     satdata = load(src_path)
 
     # check out path
-    if not os.access(os.path.dirname(out_path), os.W_OK):
-        raise Exception(f'Invalid output path')
+    validate_out_path(out_path)
 
     # calculate a transform and new dimensions using our dataset's current CRS and dimensions
     transform, width, height = calculate_default_transform(satdata.crs,
@@ -759,33 +1042,30 @@ def reproject(src_path, out_path, target_crs='4326'):
                     'width':width,
                     'height':height})
 
-    # apply the transform & metadata to perform the reprojection
-    with rasterio.open(out_path, 'w', **metadata) as reprojected:
-        for band in range(1, satdata.count + 1):
-            rasterio_reproject(
-                source=rasterio.band(satdata, band),
-                destination=rasterio.band(reprojected, band),
-                src_transform=satdata.transform,
-                src_crs=satdata.crs,
-                dst_transform=transform,
-                dst_crs=f'EPSG:{target_crs}'
-            )
-
-    # Set tags & description
-    satdata = load(out_path)
-    data = satdata.read()
-
-    # get meta
-    meta = satdata.meta.copy()
+    # apply the transform & metadata to perform the reprojection, in memory
+    with MemoryFile() as memfile:
+        with memfile.open(**metadata) as reprojected:
+            for band in range(1, satdata.count + 1):
+                rasterio_reproject(
+                    source=rasterio.band(satdata, band),
+                    destination=rasterio.band(reprojected, band),
+                    src_transform=satdata.transform,
+                    src_crs=satdata.crs,
+                    dst_transform=transform,
+                    dst_crs=f'EPSG:{target_crs}'
+                )
+
+            # Set tags & description
+            data = reprojected.read()
 
     # get band info
     bands_dict = bands_info(src_path)
 
     # add other data
-    write(data, meta, bands_dict, out_path)
+    write(data, metadata, bands_dict, out_path)
 
 
-def create_tiles(src_path, out_dir, tile_size_in_m=None, tile_size_in_pixels=None, tile_overlap=0.0):
+def create_tiles(src_path, out_dir, tile_size_in_m=None, tile_size_in_pixels=None, tile_overlap=0.0, register_in_db=False):
     """
     Function to tile an image into smaller square chunks with embedded georeferencing info
     allowing an end user to specify the size of the tile, the overlap of each tile, and when to discard
@@ -803,14 +1083,15 @@ def create_tiles(src_path, out_dir, tile_size_in_m=None, tile_size_in_pixels=Non
             Tile (height,width) in pixels
         tile_overlap : float
             Amount of overlap of each tile in float format. Should range between [0.0,0.9]
+        register_in_db : bool
+            If true and out_dir is a s3://bucket/prefix/ uri, each tile is added to the database once uploaded
     """
 
     # load data
     satdata = load(src_path)
 
     # check out dir
-    if not os.path.isdir(out_dir):
-        raise Exception(f'Invalid output dir {out_dir}')
+    validate_out_dir(out_dir)
 
     # validate input
     if tile_overlap is None or tile_overlap < 0 or tile_overlap > 0.9:
@@ -941,18 +1222,31 @@ def create_tiles(src_path, out_dir, tile_size_in_m=None, tile_size_in_pixels=Non
     # inform user with the number of tiles about to be written to disk
     print(f'Number of tiles = {len(bboxes)}, using tile length = ({tile_size_y},{tile_size_x}) pixels / ({tile_size_y_m},{tile_size_x_m}) meters')
 
+    # the tiles sent to the cloudstorage are encoded in memory and uploaded in the background
+    uploads = get_upload_queue() if is_s3_uri(out_dir) else None
+
     # go through and crop
     ind = 0
-    for bbox in tqdm(bboxes):
+    try:
+        for bbox in tqdm(bboxes):
+
+            # increment
+            ind += 1
+
+            # output path
+            out_path = os.path.join(out_dir, f'{ind}.tif')
 
-        # increment
-        ind += 1
+            # convert to geojson
+            bboxes_geojson = bboxes_to_GeoJSON([bbox], crs)
 
-        # output path
-        out_path = os.path.join(out_dir, f'{ind}.tif')
+            # crop
+            crop(src_path, out_path, bboxes_geojson, uploads=uploads, register_in_db=register_in_db)
 
-        # convert to geojson
-        bboxes_geojson = bboxes_to_GeoJSON([bbox], crs)
+    except:
+        # stop the upload threads, the error of the crop is the one raised
+        if uploads is not None:
+            uploads.close()
+        raise
 
-        # crop
-        crop(src_path, out_path, bboxes_geojson)
+    if uploads is not None:
+        close_uploads(uploads)
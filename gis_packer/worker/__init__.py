@@ -0,0 +1,286 @@
+"""
+    Worker daemon running the cli commands in a process that keeps the modules, connections and caches loaded
+"""
+
+import os
+import sys
+import json
+import socket
+import signal
+import traceback
+import socketserver
+from contextlib import redirect_stdout, redirect_stderr
+
+# commands always run by the cli itself: interactive (prompts, docker tty), long-running servers or the worker itself
+LOCAL_COMMANDS = (
+    'configure',
+    'select-bands',
+    'create-aws-lambda-layer',
+    'notebook',
+    'lab',
+    'tutorials',
+    'documentation',
+    'autotest',
+    'serve-worker'
+)
+
+# seconds the cli waits for the worker to accept a connection
+CONNECT_TIMEOUT_S = 1.0
+
+
+def send_message(sock, message):
+    """ Sends a json message followed by a newline """
+    sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+class SocketStream:
+    """
+        File-like object sending what is written to the cli as messages on the socket, stdout or stderr
+    """
+
+    def __init__(self, sock, name):
+        self.sock = sock
+        self.name = name
+
+
+    def write(self, data):
+        if len(data) > 0:
+            send_message(self.sock, {self.name: data})
+        return len(data)
+
+
+    def flush(self):
+        pass
+
+
+    def isatty(self):
+        return False
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """
+        Runs one command per connection, in a child process forked from the warmed up worker,
+        so the commands run in parallel, each with its own stdout and working directory
+    """
+
+    def handle(self):
+
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            argv = request['argv']
+            cwd = request['cwd']
+        except (ValueError, KeyError):
+            return
+
+        stdout = SocketStream(self.connection, 'stdout')
+        stderr = SocketStream(self.connection, 'stderr')
+
+        try:
+            exit_code = run_command(self.server.cli, argv, cwd, stdout, stderr)
+        except OSError:
+            # the cli went away
+            return
+
+        try:
+            send_message(self.connection, {'exit_code': exit_code})
+        except OSError:
+            pass
+
+
+class WorkerServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+
+    def __init__(self, socket_path, cli):
+        self.cli = cli
+        super().__init__(socket_path, WorkerHandler)
+
+
+def run_command(cli, argv, cwd, stdout, stderr):
+    """Runs a cli command in this process
+
+    Arguments
+    ---------
+    cli : click.Group
+        Group of the cli commands
+    argv : list
+        Arguments of the command, without the program name
+    cwd : str
+        Working directory of the cli
+    stdout : file-like
+        Where the output of the command is written
+    stderr : file-like
+        Where the errors of the command are written
+
+    Returns
+    -------
+    exit_code : int
+        Exit code the cli must return
+    """
+
+    import click
+
+    previous_cwd = os.getcwd()
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                os.chdir(cwd)
+                cli.main(args=argv, prog_name='gis_packer', standalone_mode=False)
+                return 0
+
+            except click.exceptions.Exit as e:
+                return e.exit_code
+
+            except click.exceptions.Abort:
+                stderr.write('Aborted!\n')
+                return 1
+
+            except click.exceptions.ClickException as e:
+                e.show(file=stderr)
+                return e.exit_code
+
+            except SystemExit as e:
+                return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+
+            except OSError as e:
+                # the cli went away, nothing can be written anymore
+                if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                    raise
+                traceback.print_exc(file=stderr)
+                return 1
+
+            except Exception:
+                traceback.print_exc(file=stderr)
+                return 1
+
+    finally:
+        os.chdir(previous_cwd)
+
+
+def warm_up():
+    """
+        Imports the heavy modules, creates the cloudstorage client and checks the database schema before the
+        children are forked, a failure is only printed since the commands that need them will report it
+    """
+
+    try:
+        import rasterio  # noqa: F401
+        import geopandas  # noqa: F401
+        from ..utils import raster  # noqa: F401
+        from ..cloudstorage import get_cloudstorage
+        from ..database import get_database
+
+        get_cloudstorage()
+
+        # the children open their own connections, a connection shared across a fork would be corrupted
+        get_database().engine.dispose()
+
+    except Exception as e:
+        print(f'Warm up failed : {e}')
+
+
+def serve(cli, socket_path):
+    """Runs the worker until interrupted
+
+    Arguments
+    ---------
+    cli : click.Group
+        Group of the cli commands
+    socket_path : str
+        Path of the Unix socket the worker listens on
+    """
+
+    # refuse to replace a running worker, a socket left by a crash is removed
+    if os.path.exists(socket_path):
+        if is_running(socket_path):
+            raise Exception(f'A worker is already listening on {socket_path}')
+        os.remove(socket_path)
+
+    socket_dir = os.path.dirname(socket_path)
+    if socket_dir != '':
+        os.makedirs(socket_dir, exist_ok=True)
+
+    warm_up()
+
+    # the worker runs any command it receives, only the owner can connect
+    previous_umask = os.umask(0o177)
+    try:
+        server = WorkerServer(socket_path, cli)
+    finally:
+        os.umask(previous_umask)
+
+    # docker stop
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        print(f'worker listening on {socket_path}, (ctrl+c to exit)')
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def is_running(socket_path):
+    """
+        Returns true if a worker accepts connections on the socket
+    """
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(CONNECT_TIMEOUT_S)
+            sock.connect(socket_path)
+        return True
+
+    except OSError:
+        return False
+
+
+def forward(argv, socket_path):
+    """Runs a cli command in the worker, its output is written to stdout and stderr as it comes
+
+    Arguments
+    ---------
+    argv : list
+        Arguments of the command, without the program name
+    socket_path : str
+        Path of the Unix socket of the worker
+
+    Returns
+    -------
+    exit_code : int
+        Exit code of the command, None if no worker is running and the command must run locally
+    """
+
+    if len(argv) == 0 or argv[0] in LOCAL_COMMANDS or not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT_S)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return None
+
+        # the command can run for a long time
+        sock.settimeout(None)
+        send_message(sock, {'argv': argv, 'cwd': os.getcwd()})
+
+        for line in sock.makefile('r', encoding='utf-8'):
+            message = json.loads(line)
+            if 'stdout' in message:
+                sys.stdout.write(message['stdout'])
+                sys.stdout.flush()
+            elif 'stderr' in message:
+                sys.stderr.write(message['stderr'])
+                sys.stderr.flush()
+            elif 'exit_code' in message:
+                return message['exit_code']
+
+        raise Exception('The worker closed the connection before the end of the command')
+
+    finally:
+        sock.close()
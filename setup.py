@@ -48,6 +48,7 @@ setuptools.setup(
         'matplotlib',
         'pandas',
         'shapely',
+        'pygeos',
         'boto3',
         'geopandas',
         'rasterio',
@@ -55,5 +56,5 @@ setuptools.setup(
         'dask',
         'xarray'
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
\ No newline at end of file
@@ -0,0 +1,192 @@
+import unittest
+from unittest import mock
+
+import os
+import csv
+
+# import gis packer
+from gis_packer.cloudstorage import get_cloudstorage
+from gis_packer.database import get_database
+from gis_packer.cli.api import merge_sorted_keys, reconcile, post_file, ROW_WITHOUT_OBJECT, OBJECT_WITHOUT_ROW
+from gis_packer.utils.basic import get_iso_timestamp
+
+# PATHS
+three_band_path = '/gis-packer/tests/assets/three_band.tif'
+temp_dir = '/gis-packer/tests/assets/temp/'
+
+# Test Bucket Params
+bucket_name = 'tests-gis'
+
+# create temp folder if not already there
+if not os.path.isdir(temp_dir):
+    os.mkdir(temp_dir)
+
+# get an instance of the cloudstorage and the database
+cloudstorage = get_cloudstorage()
+database = get_database()
+
+
+def byte_order(keys):
+    """
+        Sorts keys in UTF-8 byte order, the order of the S3 listings and of the COLLATE "C" index
+    """
+    return sorted(keys, key=lambda k: k.encode('utf-8'))
+
+
+def merge(row_keys, object_keys):
+    """
+        Merges two lists of keys and returns the (status, file_key) found in only one of them
+    """
+
+    rows = [(k, 0) for k in byte_order(row_keys)]
+    objects = [(k, 0, {'Key': k}) for k in byte_order(object_keys)]
+
+    return [(status, file_key) for status, file_key, _, _ in merge_sorted_keys(rows, objects)]
+
+
+class TestFuncs(unittest.TestCase):
+
+    def test_merge_sorted_keys(self):
+
+        # empty
+        assert merge([], []) == []
+        assert merge(['a', 'b'], []) == [(ROW_WITHOUT_OBJECT, 'a'), (ROW_WITHOUT_OBJECT, 'b')]
+        assert merge([], ['a', 'b']) == [(OBJECT_WITHOUT_ROW, 'a'), (OBJECT_WITHOUT_ROW, 'b')]
+
+        # interleaved
+        assert merge(['a', 'c', 'd', 'f'], ['b', 'c', 'e', 'f', 'g']) == [
+            (ROW_WITHOUT_OBJECT, 'a'),
+            (OBJECT_WITHOUT_ROW, 'b'),
+            (ROW_WITHOUT_OBJECT, 'd'),
+            (OBJECT_WITHOUT_ROW, 'e'),
+            (OBJECT_WITHOUT_ROW, 'g')
+        ]
+
+        # keys in both are matched one to one
+        assert merge(['a', 'b'], ['a', 'b']) == []
+        assert merge(['a', 'a'], ['a', 'a']) == []
+        assert merge(['a', 'a', 'b'], ['a', 'b']) == [(ROW_WITHOUT_OBJECT, 'a')]
+
+        # prefixes, separators, upper case and non-ASCII keys, python compares the code points
+        # which is the UTF-8 byte order
+        keys = ['a', 'a-b', 'a/', 'a/b', 'a0', 'B', 'b', 'é', 'z', '日本/1.tif', '￿', '😀.tif', 'tile 1.tif']
+        assert sorted(keys) == byte_order(keys)
+
+        row_keys = keys[0::2] + ['only_row', 'ü']
+        object_keys = keys[1::2] + keys[0::4] + ['only_object', '𝔘']
+        expected = [(ROW_WITHOUT_OBJECT, k) for k in set(row_keys) - set(object_keys)]
+        expected += [(OBJECT_WITHOUT_ROW, k) for k in set(object_keys) - set(row_keys)]
+        assert merge(row_keys, object_keys) == sorted(expected, key=lambda m: m[1].encode('utf-8'))
+
+    def test_reconcile(self):
+
+        prefix = 'test_reconcile/'
+        both_key = f'{prefix}both.tif'
+        row_key = f'{prefix}row_without_file.tif'
+        file_key = f'{prefix}file_without_row.tif'
+        out_path = os.path.join(temp_dir, 'reconcile.csv')
+        polygon = 'POLYGON((45 45, 45.2 45, 45.2 45.2, 45 45.2, 45 45))'
+
+        # clean up a previous run
+        for key in (both_key, row_key, file_key):
+            database.delete(bucket_name, key)
+            if cloudstorage.does_file_exists_in_cloudstorage(bucket_name, key):
+                cloudstorage.delete(bucket_name, key)
+
+        # a file with its row, a row without file and a file without row
+        now = get_iso_timestamp()
+        cloudstorage.post(bucket_name, both_key, three_band_path, show_progress=False)
+        database.insert(now, bucket_name, both_key, 10, polygon, {}, {})
+        database.insert(now, bucket_name, row_key, 10, polygon, {}, {})
+        cloudstorage.post(bucket_name, file_key, three_band_path, show_progress=False)
+
+        try:
+            # report only
+            reconcile(bucket_name, prefix=prefix, out_path=out_path, min_age_s=0)
+            with open(out_path, 'r', newline='') as fh:
+                mismatches = [(r['status'], r['file_key']) for r in csv.DictReader(fh)]
+            assert mismatches == [(OBJECT_WITHOUT_ROW, file_key), (ROW_WITHOUT_OBJECT, row_key)]
+
+            # the uploads in progress are left alone
+            reconcile(bucket_name, prefix=prefix, out_path=out_path, min_age_s=3600)
+            with open(out_path, 'r', newline='') as fh:
+                assert len(list(csv.DictReader(fh))) == 0
+
+            # fix deletes the stale row but keeps the file without row
+            reconcile(bucket_name, prefix=prefix, fix=True, min_age_s=0)
+            assert [k for k, _ in database.stream_keys(bucket_name, prefix=prefix)] == [both_key]
+            assert cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key)
+            assert cloudstorage.does_file_exists_in_cloudstorage(bucket_name, both_key)
+
+            # it is only deleted on demand
+            reconcile(bucket_name, prefix=prefix, fix=True, delete_orphan_files=True, min_age_s=0)
+            assert not cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key)
+            assert cloudstorage.does_file_exists_in_cloudstorage(bucket_name, both_key)
+
+            # nothing left to reconcile
+            reconcile(bucket_name, prefix=prefix, out_path=out_path, min_age_s=0)
+            with open(out_path, 'r', newline='') as fh:
+                assert len(list(csv.DictReader(fh))) == 0
+
+        finally:
+            for key in (both_key, row_key, file_key):
+                database.delete(bucket_name, key)
+                if cloudstorage.does_file_exists_in_cloudstorage(bucket_name, key):
+                    cloudstorage.delete(bucket_name, key)
+            if os.path.exists(out_path):
+                os.remove(out_path)
+
+    def assert_not_stored(self, file_key):
+        """
+            Checks that neither the file nor its row is stored
+        """
+        assert not cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key)
+        assert [k for k, _ in database.stream_keys(bucket_name, prefix=file_key)] == []
+
+    def test_post_file_rollback(self):
+
+        file_key = 'test_post_file/three_band.tif'
+
+        # clean up a previous run
+        database.delete(bucket_name, file_key)
+        if cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key):
+            cloudstorage.delete(bucket_name, file_key)
+
+        # the file may already be registered by another test, the duplicate check must not skip the upload
+        no_duplicates = database.find_by_content_hash('no-such-content-hash')
+
+        with mock.patch.object(database, 'find_by_content_hash', return_value=no_duplicates):
+
+            # a failed upload adds no row
+            with mock.patch.object(cloudstorage, 'post', side_effect=Exception('upload failed')):
+                with self.assertRaises(Exception):
+                    post_file(bucket_name, file_key, three_band_path)
+            self.assert_not_stored(file_key)
+
+            # a failed attribute extraction deletes the uploaded file
+            with mock.patch('gis_packer.utils.raster.get_attributes', side_effect=Exception('attributes failed')):
+                with self.assertRaises(Exception) as context:
+                    post_file(bucket_name, file_key, three_band_path)
+            assert 'able to delete the uploaded file' in str(context.exception)
+            self.assert_not_stored(file_key)
+
+            # so does a failed insert
+            with mock.patch.object(database, 'insert', side_effect=Exception('insert failed')):
+                with self.assertRaises(Exception) as context:
+                    post_file(bucket_name, file_key, three_band_path)
+            assert 'able to delete the uploaded file' in str(context.exception)
+            self.assert_not_stored(file_key)
+
+            # both stored on success
+            try:
+                post_file(bucket_name, file_key, three_band_path)
+                assert cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key)
+                assert [k for k, _ in database.stream_keys(bucket_name, prefix=file_key)] == [file_key]
+
+            finally:
+                database.delete(bucket_name, file_key)
+                if cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key):
+                    cloudstorage.delete(bucket_name, file_key)
+
+if __name__ == '__main__':
+    unittest.main()
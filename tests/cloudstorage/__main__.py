@@ -3,10 +3,18 @@ import unittest
 import os
 import shutil
 import json
+import time
+import asyncio
 from glob import glob
 
 # import gis packer
 from gis_packer.cloudstorage import get_cloudstorage
+from gis_packer.cloudstorage.cache import DownloadCache
+from gis_packer.cloudstorage.checkpoint import Checkpoint, get_download_checkpoint_paths
+from gis_packer.cloudstorage.aio import AsyncCloudStorage
+from gis_packer.cloudstorage.local import LocalStorage
+from gis_packer.cloudstorage.scheduler import TransferScheduler, get_order
+from gis_packer.utils.basic import get_content_hash
 
 # PATHS
 three_band_path = '/gis-packer/tests/assets/three_band.tif'
@@ -51,6 +59,254 @@ class TestFuncs(unittest.TestCase):
         cloudstorage.delete(bucket_name, file_key)
         assert not cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key)
 
+    def test_post_many_get_many(self):
+
+        # define the file keys
+        file_keys = [f'test_post_many/{i}.tif' for i in range(0, 4)]
+
+        # delete the files from a previous run
+        for file_key in file_keys:
+            if cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key):
+                cloudstorage.delete(bucket_name, file_key)
+
+        # upload
+        results = cloudstorage.post_many([(bucket_name, file_key, three_band_path) for file_key in file_keys])
+        assert all([r['success'] for r in results])
+
+        # list
+        listed_keys = [obj['Key'] for obj in cloudstorage.list(bucket_name, prefix='test_post_many/')]
+        assert sorted(listed_keys) == sorted(file_keys)
+
+        # download
+        out_paths = [os.path.join(temp_dir, f'downloaded_many_{i}.tif') for i in range(0, 4)]
+        for out_path in out_paths:
+            if os.path.exists(out_path):
+                os.remove(out_path)
+        results = cloudstorage.get_many([(bucket_name, k, p) for k, p in zip(file_keys, out_paths)])
+        assert all([r['success'] for r in results])
+        assert all([os.path.exists(p) for p in out_paths])
+
+        # one HEAD per file, the one ordering them by size is reused by the download
+        heads = []
+        def count_head(**kwargs):
+            heads.append(1)
+        cloudstorage._cloudstorage.meta.events.register('before-call.s3.HeadObject', count_head)
+        try:
+            for out_path in out_paths:
+                os.remove(out_path)
+            results = cloudstorage.get_many([(bucket_name, k, p) for k, p in zip(file_keys, out_paths)], order='largest')
+            assert all([r['success'] for r in results])
+            assert len(heads) == len(file_keys)
+        finally:
+            cloudstorage._cloudstorage.meta.events.unregister('before-call.s3.HeadObject', count_head)
+
+        # delete
+        for file_key in file_keys:
+            cloudstorage.delete(bucket_name, file_key)
+
+    def test_download_cache(self):
+
+        # define a file_key
+        file_key = 'test_download_cache.tif'
+        out_paths = [os.path.join(temp_dir, f'cached_{i}.tif') for i in range(0, 3)]
+        for out_path in out_paths:
+            if os.path.exists(out_path):
+                os.remove(out_path)
+
+        # upload image
+        if not cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key):
+            cloudstorage.post(bucket_name, file_key, three_band_path)
+
+        # enable the cache
+        cache_dir = os.path.join(temp_dir, 'download_cache')
+        previous_cache = cloudstorage.download_cache
+        cloudstorage.download_cache = DownloadCache(cache_dir, 1024 ** 3)
+        cloudstorage.download_cache.clear()
+
+        try:
+            # first download goes to the cloudstorage, second one is served from the cache
+            stats = cloudstorage.get(bucket_name, file_key, out_paths[0], show_progress=False)
+            assert stats['cached'] == False
+            stats = cloudstorage.get(bucket_name, file_key, out_paths[1], show_progress=False)
+            assert stats['cached'] == True
+            assert os.path.getsize(out_paths[1]) == os.path.getsize(three_band_path)
+
+            # eviction
+            cloudstorage.download_cache.max_size = 0
+            cloudstorage.download_cache.evict()
+            assert cloudstorage.download_cache.size() == 0
+
+            # a file larger than the cache is still downloaded
+            stats = cloudstorage.get(bucket_name, file_key, out_paths[2], show_progress=False)
+            assert os.path.getsize(out_paths[2]) == os.path.getsize(three_band_path)
+
+        finally:
+            cloudstorage.download_cache = previous_cache
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            cloudstorage.delete(bucket_name, file_key)
+
+    def test_resumable_post_get(self):
+
+        # define a file_key
+        file_key = 'test_resumable.tif'
+        if cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key):
+            cloudstorage.delete(bucket_name, file_key)
+
+        out_path = os.path.join(temp_dir, 'resumed_image.tif')
+        partial_path, checkpoint_path = get_download_checkpoint_paths(out_path)
+        for path in (out_path, partial_path, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+        # upload
+        cloudstorage.post_resumable(bucket_name, file_key, three_band_path, show_progress=False)
+        metadata = cloudstorage.head(bucket_name, file_key)
+
+        # fake a download interrupted halfway
+        with open(three_band_path, 'rb') as src, open(partial_path, 'wb') as dst:
+            dst.write(src.read(metadata['ContentLength'] // 2))
+        Checkpoint(checkpoint_path).save({
+            'bucket_name': bucket_name,
+            'file_key': file_key,
+            'etag': metadata['ETag'],
+            'size': metadata['ContentLength'],
+            'offset': metadata['ContentLength'] // 2
+        })
+
+        # resume
+        stats = cloudstorage.get_resumable(bucket_name, file_key, out_path, show_progress=False)
+        assert stats['resumed_from'] == metadata['ContentLength'] // 2
+        with open(three_band_path, 'rb') as src, open(out_path, 'rb') as dst:
+            assert src.read() == dst.read()
+        assert not os.path.exists(checkpoint_path)
+
+        cloudstorage.delete(bucket_name, file_key)
+
+    def test_sync(self):
+
+        # local directory with two files
+        prefix = 'test_sync/'
+        local_dir = os.path.join(temp_dir, 'sync')
+        shutil.rmtree(local_dir, ignore_errors=True)
+        os.makedirs(os.path.join(local_dir, 'sub'))
+        shutil.copyfile(three_band_path, os.path.join(local_dir, 'a.tif'))
+        shutil.copyfile(three_band_path, os.path.join(local_dir, 'sub', 'b.tif'))
+
+        # first sync uploads everything, the second one nothing
+        report = cloudstorage.sync(local_dir, bucket_name, prefix=prefix, delete=True)
+        assert len(report['transfers']) == 2
+        report = cloudstorage.sync(local_dir, bucket_name, prefix=prefix, compare='etag', delete=True)
+        assert len(report['transfers']) == 0 and report['unchanged'] == 2
+
+        # deletion is mirrored
+        os.remove(os.path.join(local_dir, 'a.tif'))
+        report = cloudstorage.sync(local_dir, bucket_name, prefix=prefix, delete=True, dry_run=True)
+        assert report['deleted'] == [prefix + 'a.tif']
+        cloudstorage.sync(local_dir, bucket_name, prefix=prefix, delete=True)
+        assert list(cloudstorage.list_parallel(bucket_name, prefix=prefix).keys()) == [prefix + 'sub/b.tif']
+
+        cloudstorage.delete(bucket_name, prefix + 'sub/b.tif')
+
+    def test_async_post_get_many(self):
+
+        # define the file keys
+        file_keys = [f'test_async/{i}.tif' for i in range(0, 16)]
+        out_paths = [os.path.join(temp_dir, f'downloaded_async_{i}.tif') for i in range(0, 16)]
+        for out_path in out_paths:
+            if os.path.exists(out_path):
+                os.remove(out_path)
+
+        async def run():
+            async with AsyncCloudStorage(max_concurrency=4) as async_cloudstorage:
+
+                # upload, more files than the concurrency bound
+                results = await async_cloudstorage.post_many([(bucket_name, k, three_band_path) for k in file_keys])
+                assert all([r['success'] for r in results])
+
+                # head
+                exists = await asyncio.gather(*[async_cloudstorage.does_file_exists_in_cloudstorage(bucket_name, k) for k in file_keys])
+                assert all(exists)
+
+                # list
+                listed_keys = [obj['Key'] async for obj in async_cloudstorage.list(bucket_name, prefix='test_async/')]
+                assert sorted(listed_keys) == sorted(file_keys)
+
+                # download
+                results = await async_cloudstorage.get_many([(bucket_name, k, p) for k, p in zip(file_keys, out_paths)])
+                assert all([r['success'] for r in results])
+
+                # delete
+                await asyncio.gather(*[async_cloudstorage.delete(bucket_name, k) for k in file_keys])
+
+        asyncio.run(run())
+        assert all([os.path.exists(p) for p in out_paths])
+
+    def test_local_storage(self):
+
+        # local bucket in the temp folder
+        root_dir = os.path.join(temp_dir, 'local_bucket')
+        shutil.rmtree(root_dir, ignore_errors=True)
+        local_storage = LocalStorage({'tests-local': root_dir}, 8 * 1024 * 1024, 8 * 1024 * 1024)
+
+        # post, same ETag as S3
+        file_keys = ['scenes/b.tif', 'scenes/a.tif']
+        for file_key in file_keys:
+            local_storage.post('tests-local', file_key, three_band_path)
+        metadata = local_storage.head('tests-local', 'scenes/a.tif')
+        assert metadata['ETag'].strip('"') == get_content_hash(three_band_path)
+        assert metadata['ContentLength'] == os.path.getsize(three_band_path)
+
+        # keys outside the root directory are refused
+        with self.assertRaises(Exception):
+            local_storage.post('tests-local', '../escaped.tif', three_band_path)
+
+        # list, in key order
+        assert [obj['Key'] for obj in local_storage.list('tests-local', prefix='scenes/')] == sorted(file_keys)
+
+        # get
+        out_path = os.path.join(temp_dir, 'downloaded_local.tif')
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        local_storage.get('tests-local', 'scenes/a.tif', out_path)
+        with open(three_band_path, 'rb') as src, open(out_path, 'rb') as dst:
+            assert src.read() == dst.read()
+
+        # delete
+        assert local_storage.delete_keys('tests-local', file_keys) == []
+        assert not local_storage.does_file_exists_in_cloudstorage('tests-local', 'scenes/a.tif')
+
+    def test_scheduler(self):
+
+        # size-aware ordering
+        assert get_order([3, 1, 2], 'smallest') == [1, 2, 0]
+        assert get_order([3, 1, 2], 'largest') == [0, 2, 1]
+
+        # 1 MB/s with a 0.5 MB burst, 1.5 MB take at least 1s
+        scheduler = TransferScheduler(max_bytes_per_s=1024 * 1024, burst_bytes=512 * 1024)
+        start = time.time()
+        with scheduler.transfer('batch'):
+            for _ in range(0, 3):
+                scheduler.throttle(512 * 1024, 'batch')
+            scheduler.throttle(1, 'batch')
+        assert time.time() - start >= 0.9
+
+        # per-class metrics
+        metrics = scheduler.metrics()
+        assert metrics['batch']['transfers'] == 1 and metrics['batch']['bytes'] == 3 * 512 * 1024 + 1
+        assert metrics['interactive']['transfers'] == 0
+
+        # two processes sharing the state file share the rate
+        state_path = os.path.join(temp_dir, 'bandwidth.state')
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        schedulers = [TransferScheduler(max_bytes_per_s=1024 * 1024, burst_bytes=512 * 1024, state_path=state_path) for _ in range(0, 2)]
+        start = time.time()
+        for scheduler in schedulers:
+            scheduler.throttle(1024 * 1024, 'batch')
+        schedulers[0].throttle(1, 'batch')
+        assert time.time() - start >= 1.4
+        os.remove(state_path)
+
 
 if __name__ == '__main__':
     unittest.main()
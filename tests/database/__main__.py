@@ -3,12 +3,26 @@ import unittest
 import os
 import shutil
 import json
+import time
+import asyncio
 from glob import glob
 
+import pandas as pd
+import shapely.wkb
+
 # import gis packer
-from gis_packer.database import get_database
+from gis_packer.database import get_database, schema_migrations, decode_geometries
+from gis_packer.database.replica import Replica
+from gis_packer.database.aio import AsyncDatabase
 from gis_packer.utils.basic import get_iso_timestamp
 
+# PATHS
+temp_dir = '/gis-packer/tests/assets/temp/'
+
+# create temp folder if not already there
+if not os.path.isdir(temp_dir):
+    os.mkdir(temp_dir)
+
 # get an instance of the database
 database = get_database()
 
@@ -17,6 +31,12 @@ class TestFuncs(unittest.TestCase):
     def test_execute_query(self):
         database.execute_query('SELECT * FROM raster LIMIT 2')
 
+    def test_schema_version(self):
+
+        # the singleton migrated the database on init, re-running must be a no-op
+        database.migrate()
+        assert database.get_schema_version() == max([m['version'] for m in schema_migrations])
+
     def test_insert_select_delete(self):
 
         # delete
@@ -26,14 +46,162 @@ class TestFuncs(unittest.TestCase):
         now = get_iso_timestamp()
 
         # insert a raster
-        database.insert(now, 'bucket_name', 'file_key', 10, 'POLYGON((45 45, 45.2 45, 45.2 45.2, 45 45.2, 45 45))', {}, {})
+        database.insert(now, 'bucket_name', 'file_key', 10, 'POLYGON((45 45, 45.2 45, 45.2 45.2, 45 45.2, 45 45))', {}, {}, content_hash='test-replica-hash')
 
         # select
         res = database.select(TAKEN_AT_MIN=now)
         assert len(res.index) == 1
 
+        # select with an area of interest
+        res = database.select(TAKEN_AT_MIN=now, INTERSECTS=(45.1, 45.1, 45.3, 45.3))
+        assert len(res.index) == 1
+        res = database.select(TAKEN_AT_MIN=now, INTERSECTS=(45.1, 45.1, 45.3, 45.3), MIN_OVERLAP=0.5)
+        assert len(res.index) == 0
+
+        # select from a local replica
+        replica = Replica(os.path.join(temp_dir, 'catalog.sqlite'))
+        replica.sync(database, full=True)
+        res = replica.select(TAKEN_AT_MIN=now, POINT_CONTAINED=(45.1, 45.1))
+        assert len(res.index) == 1
+        assert res.iloc[0]['content_hash'] == 'test-replica-hash'
+
+        # same columns as the database
+        assert list(res.columns) == list(database.select(TAKEN_AT_MIN=now).columns)
+        res = replica.select(TAKEN_AT_MIN=now, INTERSECTS=(45.1, 45.1, 45.3, 45.3), MIN_OVERLAP=0.5)
+        assert len(res.index) == 0
+
+        # delete
+        database.delete('bucket_name', 'file_key')
+
+    def test_find_by_content_hash(self):
+
+        # delete
+        database.delete('bucket_name', 'file_key')
+
+        # insert a raster with a content hash
+        now = get_iso_timestamp()
+        database.insert(now, 'bucket_name', 'file_key', 10, 'POLYGON((45 45, 45.2 45, 45.2 45.2, 45 45.2, 45 45))', {}, {}, content_hash='test-content-hash')
+
+        # find it
+        res = database.find_by_content_hash('test-content-hash')
+        assert len(res.index) == 1
+        assert res.iloc[0]['file_key'] == 'file_key'
+
+        # delete
+        database.delete('bucket_name', 'file_key')
+
+    def test_select_cache(self):
+
         # delete
         database.delete('bucket_name', 'file_key')
 
+        # generate an iso timestamp
+        now = get_iso_timestamp()
+
+        # the second identical search is answered by the cache
+        res = database.select(TAKEN_AT_MIN=now)
+        hits = database.cache.stats()['hits']
+        res = database.select(TAKEN_AT_MIN=now)
+        assert database.cache.stats()['hits'] == hits + 1
+        assert len(res.index) == 0
+
+        # inserting invalidates the cache
+        database.insert(now, 'bucket_name', 'file_key', 10, 'POLYGON((45 45, 45.2 45, 45.2 45.2, 45 45.2, 45 45))', {}, {})
+        res = database.select(TAKEN_AT_MIN=now)
+        assert len(res.index) == 1
+
+        # so does a delete through the asyncio interface
+        async def run():
+            async with AsyncDatabase() as async_database:
+                await async_database.delete('bucket_name', 'file_key')
+
+        asyncio.run(run())
+        res = database.select(TAKEN_AT_MIN=now)
+        assert len(res.index) == 0
+
+        # and a raw query
+        database.insert(now, 'bucket_name', 'file_key', 10, 'POLYGON((45 45, 45.2 45, 45.2 45.2, 45 45.2, 45 45))', {}, {})
+        res = database.select(TAKEN_AT_MIN=now)
+        assert len(res.index) == 1
+        database.execute_query("DELETE FROM raster WHERE bucket_name = 'bucket_name' AND file_key = 'file_key'")
+        res = database.select(TAKEN_AT_MIN=now)
+        assert len(res.index) == 0
+
+    def test_decode_geometries(self):
+
+        # a large result set, bytea comes back as memoryviews
+        results = pd.read_sql_query(
+            con=database.engine,
+            sql='SELECT ST_AsBinary(ST_MakeEnvelope(i, i, i + 1, i + 1)) as geometry FROM generate_series(1, 200000) i'
+        )
+
+        start = time.time()
+        geometries = decode_geometries(results['geometry'])
+        vectorized_s = time.time() - start
+
+        start = time.time()
+        expected = [shapely.wkb.loads(bytes(v)) for v in results['geometry']]
+        per_row_s = time.time() - start
+
+        print(f'decode 200000 geometries : {round(vectorized_s, 3)} s vectorized, {round(per_row_s, 3)} s per row')
+        assert len(geometries) == len(expected)
+        assert all([geometries[i].equals(expected[i]) for i in (0, 1000, len(expected) - 1)])
+        assert vectorized_s < per_row_s
+
+    def test_async_concurrent_select(self):
+
+        async def run():
+            async with AsyncDatabase() as async_database:
+
+                # many more operations than connections in the pool
+                results = await asyncio.gather(*[async_database.select(LIMIT=1) for _ in range(0, 200)])
+                assert len(results) == 200
+
+        asyncio.run(run())
+
+    def test_insert_many(self):
+
+        # generate an iso timestamp
+        now = get_iso_timestamp()
+
+        # build a batch of 10k rows
+        rows = []
+        for i in range(0, 10000):
+            rows.append({
+                'taken_at': now,
+                'bucket_name': 'bucket_name',
+                'file_key': f'insert_many/{i}.tif',
+                'pixel_size_m': 10,
+                'geometry': 'POLYGON((45 45, 45.2 45, 45.2 45.2, 45 45.2, 45 45))',
+                'bands': {},
+                'profile': {}
+            })
+
+        # insert
+        start = time.time()
+        nbr_of_rows = database.insert_many(rows, on_conflict='update')
+        elapsed = time.time() - start
+        print(f'insert_many : {int(nbr_of_rows/elapsed)} rows/s')
+        assert nbr_of_rows == len(rows)
+
+        # re-ingesting the same batch must be a no-op
+        nbr_of_rows = database.insert_many(rows, on_conflict='nothing')
+        assert nbr_of_rows == 0
+
+        # stream them back in small pages
+        nbr_of_streamed = 0
+        for chunk in database.stream(PAGE_SIZE=1000, CHUNK_SIZE=250, TAKEN_AT_MIN=now):
+            assert len(chunk.index) <= 250
+            nbr_of_streamed += len(chunk.index)
+        assert nbr_of_streamed == len(rows)
+
+        # keys in byte order, like a S3 listing
+        file_keys = [file_key for file_key, _ in database.stream_keys('bucket_name', prefix='insert_many/', PAGE_SIZE=3000)]
+        assert file_keys == sorted([row['file_key'] for row in rows])
+
+        # delete in a single transaction
+        nbr_of_rows = database.delete_many([(row['bucket_name'], row['file_key']) for row in rows])
+        assert nbr_of_rows == len(rows)
+
 if __name__ == '__main__':
     unittest.main()
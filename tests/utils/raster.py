@@ -6,13 +6,18 @@ import json
 from glob import glob
 
 # import gis packer
-from gis_packer.utils.raster import info, show, create_tiles, unstack_bands, compress, to_uint8, reproject
+from gis_packer.utils.raster import info, show, create_tiles, unstack_bands, compress, to_uint8, reproject, quicklook, load
+from gis_packer.cloudstorage import get_cloudstorage
+from gis_packer.cli.batch import run_batch
 
 # PATHS
 single_band_path = '/gis-packer/tests/assets/single_band.tif'
 three_band_path = '/gis-packer/tests/assets/three_band.tif'
 temp_dir = '/gis-packer/tests/assets/temp/'
 
+# Test Bucket Params
+bucket_name = 'tests-gis'
+
 # create temp folder if not already there
 if not os.path.isdir(temp_dir):
     os.mkdir(temp_dir)
@@ -40,6 +45,59 @@ class TestFuncs(unittest.TestCase):
     def test_tile(self):
         create_tiles(three_band_path, temp_dir, tile_overlap=0.6, tile_size_in_pixels=(100,400))
 
+    def test_quicklook(self):
+        out_path = os.path.join(temp_dir, 'quicklook.tif')
+        quicklook(three_band_path, out_path, max_size=64)
+        satdata = load(out_path)
+        assert max(satdata.width, satdata.height) <= 64
+
+    def test_remote_read(self):
+
+        # upload image
+        cloudstorage = get_cloudstorage()
+        file_key = 'test_remote_read.tif'
+        if not cloudstorage.does_file_exists_in_cloudstorage(bucket_name, file_key):
+            cloudstorage.post(bucket_name, file_key, three_band_path, show_progress=False)
+
+        # read without downloading
+        src_uri = f's3://{bucket_name}/{file_key}'
+        assert load(src_uri).count == load(three_band_path).count
+        quicklook(src_uri, os.path.join(temp_dir, 'remote_quicklook.tif'), max_size=64)
+
+        cloudstorage.delete(bucket_name, file_key)
+
+    def test_tile_to_cloudstorage(self):
+
+        # delete the tiles of a previous run
+        cloudstorage = get_cloudstorage()
+        prefix = 'test_tiles/'
+        for obj in cloudstorage.list(bucket_name, prefix=prefix):
+            cloudstorage.delete(bucket_name, obj['Key'])
+
+        # tiles are uploaded from memory
+        create_tiles(three_band_path, f's3://{bucket_name}/{prefix}', tile_overlap=0.0, tile_size_in_pixels=(100,400))
+        file_keys = [obj['Key'] for obj in cloudstorage.list(bucket_name, prefix=prefix)]
+        assert len(file_keys) > 0
+
+        for file_key in file_keys:
+            cloudstorage.delete(bucket_name, file_key)
+
+    def test_batch(self):
+
+        # job file
+        jobs_path = os.path.join(temp_dir, 'jobs.jsonl')
+        with open(jobs_path, 'w') as fh:
+            fh.write(json.dumps({'operation': 'to-uint8', 'file_path': three_band_path, 'out_path': os.path.join(temp_dir, 'batch_uint8.tif')}) + '\n')
+            fh.write(json.dumps({'operation': 'compress', 'file_path': three_band_path, 'out_path': os.path.join(temp_dir, 'batch_compressed.tif')}) + '\n')
+        if os.path.exists(jobs_path + '.manifest'):
+            os.remove(jobs_path + '.manifest')
+
+        # the rerun skips the jobs done
+        report = run_batch(jobs_path, max_workers=2)
+        assert report['done'] == 2 and report['failed'] == 0
+        report = run_batch(jobs_path, max_workers=2)
+        assert report['skipped'] == 2 and report['done'] == 0
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+
+import io
+import os
+import sys
+import time
+import tempfile
+import threading
+import subprocess
+from contextlib import redirect_stdout, redirect_stderr
+
+# import gis packer
+from gis_packer.worker import forward, is_running
+
+# worker serving a small cli, its commands write to stdout and stderr, sleep, fail or exit with a code
+worker_script = """
+import sys
+import time
+import click
+from gis_packer.worker import serve
+
+@click.group()
+def cli():
+    pass
+
+@click.command()
+@click.argument('text')
+@click.option('--exit-code', type=int, default=0)
+def echo(text, exit_code):
+    print(text)
+    sys.stderr.write(f'err {text}\\n')
+    sys.exit(exit_code)
+
+@click.command()
+@click.argument('seconds', type=float)
+def wait(seconds):
+    time.sleep(seconds)
+
+@click.command()
+def fail():
+    raise Exception('failed on purpose')
+
+cli.add_command(echo)
+cli.add_command(wait)
+cli.add_command(fail)
+
+serve(cli, sys.argv[1])
+"""
+
+
+def run_forward(argv, socket_path):
+    """
+        Forwards a command to the worker and returns its exit code, stdout and stderr
+    """
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        exit_code = forward(argv, socket_path)
+
+    return exit_code, stdout.getvalue(), stderr.getvalue()
+
+
+class TestFuncs(unittest.TestCase):
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.temp_dir, 'worker.sock')
+
+        self.process = subprocess.Popen(
+            [sys.executable, '-c', worker_script, self.socket_path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+        # the worker warms up before listening
+        deadline = time.time() + 60
+        while not is_running(self.socket_path):
+            if time.time() > deadline or self.process.poll() is not None:
+                raise Exception('The worker did not start')
+            time.sleep(0.1)
+
+    def tearDown(self):
+
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+        # the worker removes its socket on exit
+        assert not os.path.exists(self.socket_path)
+        os.rmdir(self.temp_dir)
+
+    def test_forward(self):
+
+        # the output is streamed and the exit code returned
+        exit_code, stdout, stderr = run_forward(['echo', 'hello'], self.socket_path)
+        assert exit_code == 0
+        assert stdout == 'hello\n'
+        assert stderr == 'err hello\n'
+
+        exit_code, stdout, stderr = run_forward(['echo', 'bye', '--exit-code', '3'], self.socket_path)
+        assert exit_code == 3
+        assert stdout == 'bye\n'
+
+        # an exception is a failure with its traceback
+        exit_code, stdout, stderr = run_forward(['fail'], self.socket_path)
+        assert exit_code == 1
+        assert 'failed on purpose' in stderr
+
+        # click errors
+        exit_code, stdout, stderr = run_forward(['unknown-command'], self.socket_path)
+        assert exit_code == 2
+
+    def test_local_commands(self):
+
+        # run by the cli itself even with a worker running
+        assert forward(['configure'], self.socket_path) is None
+        assert forward(['serve-worker'], self.socket_path) is None
+        assert forward([], self.socket_path) is None
+
+        # no worker listening
+        assert forward(['echo', 'hello'], os.path.join(self.temp_dir, 'missing.sock')) is None
+
+    def test_concurrent_commands(self):
+
+        # each connection runs in its own forked process
+        results = []
+        def run():
+            results.append(forward(['wait', '1'], self.socket_path))
+
+        start = time.time()
+        threads = [threading.Thread(target=run) for _ in range(0, 4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == [0, 0, 0, 0]
+        assert time.time() - start < 2.5
+
+if __name__ == '__main__':
+    unittest.main()